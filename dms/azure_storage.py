@@ -19,14 +19,19 @@ from azure.core.exceptions import ResourceNotFoundError
 from dms.encryption import decrypt_data
 
 
-def get_blob_service_client() -> Optional[BlobServiceClient]:
+# Parallel range requests per blob download (only used for blobs larger than one chunk)
+DOWNLOAD_MAX_CONCURRENCY = 4
+
+
+def get_blob_service_client(system_settings=None) -> Optional[BlobServiceClient]:
     """
     Get Azure Blob Service client from SystemSettings.
+    Pass an already loaded ``system_settings`` to avoid another query.
     Returns None if not configured.
     """
     from dms.models import SystemSettings
     
-    settings = SystemSettings.load()
+    settings = system_settings or SystemSettings.load()
     if not settings.azure_storage_connection_string_encrypted:
         return None
     
@@ -37,19 +42,23 @@ def get_blob_service_client() -> Optional[BlobServiceClient]:
     return BlobServiceClient.from_connection_string(connection_string)
 
 
-def get_container_client(container_name: Optional[str] = None) -> Optional[ContainerClient]:
+def get_container_client(
+    container_name: Optional[str] = None,
+    system_settings=None
+) -> Optional[ContainerClient]:
     """
     Get Azure Blob Container client.
     Uses container name from SystemSettings if not provided.
+    SystemSettings is loaded at most once (or taken from ``system_settings``).
     """
     from dms.models import SystemSettings
     
-    blob_service = get_blob_service_client()
+    settings = system_settings or SystemSettings.load()
+    blob_service = get_blob_service_client(settings)
     if not blob_service:
         return None
     
     if not container_name:
-        settings = SystemSettings.load()
         container_name = settings.azure_storage_container_name or "documents"
     
     return blob_service.get_container_client(container_name)
@@ -57,7 +66,8 @@ def get_container_client(container_name: Optional[str] = None) -> Optional[Conta
 
 def list_sage_archive_blobs(
     prefix: str = "sage-archive/",
-    container_name: Optional[str] = None
+    container_name: Optional[str] = None,
+    container: Optional[ContainerClient] = None
 ) -> Generator[Tuple[str, int], None, None]:
     """
     List blobs in the Sage archive folder.
@@ -67,11 +77,13 @@ def list_sage_archive_blobs(
     Args:
         prefix: Blob prefix to filter (default: "sage-archive/")
         container_name: Override container name
+        container: Existing container client to reuse
     
     Yields:
         Tuple of (blob_name, blob_size)
     """
-    container = get_container_client(container_name)
+    if container is None:
+        container = get_container_client(container_name)
     if not container:
         return
     
@@ -86,21 +98,28 @@ def list_sage_archive_blobs(
 def download_blob_to_tempfile(
     blob_name: str,
     container_name: Optional[str] = None,
-    suffix: Optional[str] = None
+    suffix: Optional[str] = None,
+    container: Optional[ContainerClient] = None
 ) -> Optional[str]:
     """
     Download a blob to a temporary file.
     
+    The blob is streamed into the file (no full copy in memory). Pass a
+    ``container`` client to reuse its HTTP connection pool across many downloads
+    instead of loading SystemSettings and building a new client per blob.
+    
     Args:
         blob_name: Full blob path
         container_name: Override container name
         suffix: File suffix for temp file (e.g., ".pdf")
+        container: Existing container client to reuse
     
     Returns:
         Path to temporary file, or None if download failed.
         Caller is responsible for deleting the temp file.
     """
-    container = get_container_client(container_name)
+    if container is None:
+        container = get_container_client(container_name)
     if not container:
         return None
     
@@ -113,8 +132,7 @@ def download_blob_to_tempfile(
         fd, temp_path = tempfile.mkstemp(suffix=suffix)
         try:
             with os.fdopen(fd, 'wb') as f:
-                download_stream = blob_client.download_blob()
-                f.write(download_stream.readall())
+                blob_client.download_blob(max_concurrency=DOWNLOAD_MAX_CONCURRENCY).readinto(f)
             return temp_path
         except Exception:
             os.unlink(temp_path)
@@ -1,6 +1,7 @@
 import os
 import hashlib
 import secrets
+from functools import lru_cache
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from django.conf import settings
@@ -23,9 +24,17 @@ def get_encryption_key():
     return key
 
 
+@lru_cache(maxsize=4)
+def _fernet_for_key(key):
+    return Fernet(key)
+
+
 def get_fernet():
-    """Get Fernet instance for legacy encryption."""
-    return Fernet(get_encryption_key())
+    """
+    Get Fernet instance for legacy encryption.
+    Cached per key, so bulk imports do not rebuild the cipher objects on every call.
+    """
+    return _fernet_for_key(get_encryption_key())
 
 
 def get_aesgcm_key():
@@ -141,15 +150,25 @@ def decrypt_with_dek(encrypted_data, dek):
     return aesgcm.decrypt(nonce, ciphertext, None)
 
 
-def calculate_sha256_chunked(file_path, chunk_size=65536):
+def calculate_sha256_chunked(file_path, chunk_size=262144):
     """
     Berechnet SHA256 eines Files per Streaming ohne gesamte Datei in RAM zu laden.
-    Paperless-ngx-Style: 64KB Chunks für optimale Performance.
+    256KB Chunks, damit OpenSSL (SHA-NI) große Blöcke am Stück verarbeitet.
     """
-    sha256_hash = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(chunk_size), b''):
-            sha256_hash.update(chunk)
+    with open(file_path, 'rb', buffering=0) as f:
+        # Python 3.11+: file_digest liest direkt per Dateideskriptor in OpenSSL (SHA-NI)
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        # Fallback: ein wiederverwendeter Puffer statt neuer bytes-Objekte pro Chunk;
+        # update() gibt bei großen Blöcken den GIL frei
+        sha256_hash = hashlib.sha256()
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            sha256_hash.update(view[:size])
     return sha256_hash.hexdigest()
 
 
@@ -274,23 +293,16 @@ def encrypt_stream_to_blob(input_stream, output_stream, chunk_size=CHUNK_SIZE):
     return sha256_hash.hexdigest(), total_read, total_written
 
 
-def decrypt_stream_from_blob(input_stream, output_stream, chunk_size=CHUNK_SIZE):
+def iter_decrypt_stream(input_stream):
     """
-    Decrypt data from input stream to output stream using AES-GCM.
+    Decrypt a blob written by encrypt_stream_to_blob chunk by chunk.
     
     Format per chunk: [4 bytes length][12 bytes nonce][encrypted_chunk with tag]
     
-    Args:
-        input_stream: File-like object with encrypted data
-        output_stream: File-like object to write decrypted data to
-        chunk_size: Original chunk size used during encryption (default 64KB, ignored - uses length prefix)
-    
-    Returns:
-        total_bytes_written
+    Yields the plaintext of each chunk, so at most one chunk (64KB) is held in memory.
     """
     import struct
     aesgcm = AESGCM(get_aesgcm_key())
-    total_written = 0
     
     while True:
         # Read length prefix (4 bytes, big-endian)
@@ -310,11 +322,25 @@ def decrypt_stream_from_blob(input_stream, output_stream, chunk_size=CHUNK_SIZE)
         if len(encrypted_chunk) < encrypted_length:
             raise ValueError("Truncated stream: incomplete encrypted chunk")
         
-        # Decrypt
-        decrypted = aesgcm.decrypt(nonce, encrypted_chunk, None)
+        yield aesgcm.decrypt(nonce, encrypted_chunk, None)
+
+
+def decrypt_stream_from_blob(input_stream, output_stream, chunk_size=CHUNK_SIZE):
+    """
+    Decrypt data from input stream to output stream using AES-GCM.
+    
+    Args:
+        input_stream: File-like object with encrypted data
+        output_stream: File-like object to write decrypted data to
+        chunk_size: Original chunk size used during encryption (default 64KB, ignored - uses length prefix)
+    
+    Returns:
+        total_bytes_written
+    """
+    total_written = 0
+    for decrypted in iter_decrypt_stream(input_stream):
         output_stream.write(decrypted)
         total_written += len(decrypted)
-    
     return total_written
 
 
@@ -345,6 +371,52 @@ def decrypt_bytes_streaming(encrypted_data, chunk_size=CHUNK_SIZE):
     return output_stream.getvalue()
 
 
+# =============================================================================
+# DOCUMENT STORAGE
+# Document content lives encrypted (chunked AES-GCM, see above) in Document.file.
+# =============================================================================
+
+# Encrypted blobs up to this size stay in memory before the upload to storage
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+
+def save_encrypted_file(field_file, source, name):
+    """
+    Encrypt source (file-like object or bytes) into field_file (e.g. Document.file)
+    in a single streaming pass. The model instance is not saved (save=False).
+    
+    Returns:
+        (sha256_hash, original_size)
+    """
+    import tempfile
+    from io import BytesIO
+    from django.core.files.base import File
+    
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as output_stream:
+        sha256_hash, original_size, _ = encrypt_stream_to_blob(source, output_stream)
+        output_stream.seek(0)
+        field_file.save(name, File(output_stream), save=False)
+    return sha256_hash, original_size
+
+
+def iter_decrypted_file(field_file):
+    """
+    Yields the decrypted content of field_file chunk by chunk (for streamed responses).
+    The file is opened through the storage, independent of the FieldFile state.
+    """
+    if not field_file:
+        raise FileNotFoundError('Document has no file')
+    with field_file.storage.open(field_file.name, 'rb') as encrypted_file:
+        yield from iter_decrypt_stream(encrypted_file)
+
+
+def read_decrypted_file(field_file):
+    """Decrypted content of field_file as bytes (for processing that needs the whole file, e.g. PyMuPDF)."""
+    return b''.join(iter_decrypted_file(field_file))
+
+
 # =============================================================================
 # GDPR UTILITIES
 # =============================================================================
@@ -14,7 +14,7 @@ from ..models import (
     Document, Employee, ImportedLeaveRequest, ImportedTimesheet,
     DocumentType, SystemSettings, SystemLog
 )
-from ..encryption import encrypt_data, calculate_sha256
+from ..encryption import calculate_sha256, save_encrypted_file
 
 logger = logging.getLogger(__name__)
 
@@ -188,18 +188,8 @@ class PDFGenerator:
     
     def _html_to_pdf(self, html_content: str) -> bytes:
         """Convert HTML to PDF using weasyprint"""
-        try:
-            from weasyprint import HTML
-            pdf_bytes = HTML(string=html_content).write_pdf()
-            return pdf_bytes
-        except ImportError:
-            try:
-                import pdfkit
-                pdf_bytes = pdfkit.from_string(html_content, False)
-                return pdf_bytes
-            except Exception as e:
-                self._log('ERROR', f'PDF-Generierung fehlgeschlagen: {str(e)}')
-                return html_content.encode('utf-8')
+        from weasyprint import HTML
+        return HTML(string=html_content).write_pdf()
     
     def _create_document(
         self, 
@@ -223,21 +213,23 @@ class PDFGenerator:
                 self._log('INFO', f'Dokument bereits vorhanden: {filename}')
                 return Document.objects.filter(sha256_hash=sha256_hash).first()
             
-            encrypted_content = encrypt_data(pdf_content)
-            
-            document = Document.objects.create(
+            document = Document(
                 title=title,
                 original_filename=filename,
                 file_extension='.pdf',
                 mime_type='application/pdf',
-                encrypted_content=encrypted_content,
-                file_size=len(pdf_content),
                 document_type=doc_type,
                 employee=employee,
                 status='ASSIGNED',
                 source=source,
                 sha256_hash=sha256_hash
             )
+            _, document.file_size = save_encrypted_file(document.file, pdf_content, f"{document.id}.enc")
+            try:
+                document.save()
+            except Exception:
+                document.file.delete(save=False)
+                raise
             
             self._log('INFO', f'Dokument erstellt: {title}', {'document_id': str(document.id)})
             return document
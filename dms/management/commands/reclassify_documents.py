@@ -109,7 +109,7 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Verarbeite {total} Dokumente mit {rules.count()} aktiven Regeln...")
 
-        for doc in documents.iterator():
+        for doc in documents.iterator(chunk_size=2000):
             for rule in rules:
                 if self.match_document(doc, rule):
                     matched += 1
@@ -40,7 +40,7 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('=== DRY RUN ===\n'))
         
         from dms.tasks import find_employee_by_id, parse_employee_id_from_datamatrix, parse_datamatrix_metadata
-        from dms.encryption import decrypt_data
+        from dms.encryption import read_decrypted_file
         
         docs = Document.objects.filter(
             status='REVIEW_NEEDED',
@@ -120,8 +120,8 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('\n=== DRY RUN - Keine Änderungen gespeichert ==='))
     
     def _scan_datamatrix_from_doc(self, doc, timeout_per_page=5):
-        """Scannt DataMatrix aus dem verschlüsselten PDF-Inhalt"""
-        from dms.encryption import decrypt_data
+        """Scannt DataMatrix aus dem verschlüsselten PDF-Blob (Document.file)"""
+        from dms.encryption import read_decrypted_file
         from dms.tasks import parse_employee_id_from_datamatrix, parse_datamatrix_metadata
         
         def timeout_handler(signum, frame):
@@ -129,11 +129,9 @@ class Command(BaseCommand):
         
         try:
             import fitz
-            from pylibdmtx.pylibdmtx import decode
-            from PIL import Image
-            import io
+            from dms.tasks import decode_datamatrix_page
             
-            pdf_bytes = decrypt_data(doc.encrypted_content)
+            pdf_bytes = read_decrypted_file(doc.file)
             pdf_doc = fitz.open(stream=pdf_bytes, filetype='pdf')
             
             for page_num in range(min(len(pdf_doc), 3)):
@@ -142,12 +140,7 @@ class Command(BaseCommand):
                     signal.alarm(timeout_per_page)
                     
                     try:
-                        page = pdf_doc[page_num]
-                        pix = page.get_pixmap(matrix=fitz.Matrix(1.2, 1.2))
-                        img_data = pix.tobytes("png")
-                        img = Image.open(io.BytesIO(img_data))
-                        
-                        decoded = decode(img)
+                        decoded = decode_datamatrix_page(pdf_doc[page_num], zoom=1.2)
                         
                         for d in decoded:
                             raw_data = d.data.decode('utf-8')
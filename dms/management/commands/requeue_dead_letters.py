@@ -0,0 +1,107 @@
+"""
+Management Command: Dead-Letter-Queues abarbeiten
+
+Endgültig fehlgeschlagene Tasks (siehe DeadLetterTask in dms/tasks.py) landen in
+einer eigenen Queue, die kein Worker konsumiert. Nach Behebung der Ursache stellt
+dieses Command die Aufrufe wieder in die normale Queue. Schlagen sie erneut fehl,
+landen sie wieder in der Dead-Letter-Queue.
+
+Verwendung:
+    python manage.py requeue_dead_letters                # Anzahl je Queue anzeigen
+    python manage.py requeue_dead_letters --requeue      # Alle Aufrufe erneut einreihen
+    python manage.py requeue_dead_letters --requeue --limit=100
+"""
+
+from django.core.management.base import BaseCommand
+
+# Header, die Celery (Protokoll v2) selbst setzt; alle anderen sind eigene Header des Aufrufers
+CELERY_MESSAGE_HEADERS = frozenset({
+    'lang', 'task', 'id', 'shadow', 'eta', 'expires', 'group', 'group_index', 'retries',
+    'timelimit', 'root_id', 'parent_id', 'argsrepr', 'kwargsrepr', 'origin', 'ignore_result',
+    'replaced_task_nesting', 'stamped_headers', 'stamps',
+})
+
+
+class Command(BaseCommand):
+    help = 'Zeigt die Dead-Letter-Queues an und stellt ihre Tasks erneut ein'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requeue',
+            action='store_true',
+            help='Tasks aus den Dead-Letter-Queues erneut in die normale Queue stellen',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='Max. Anzahl Tasks pro Queue (0 = alle)',
+        )
+
+    def handle(self, *args, **options):
+        import dms.tasks  # noqa: F401 - registriert die Tasks mit dead_letter_queue
+        from dms_project.celery import app
+
+        queues = sorted({
+            task.dead_letter_queue for task in app.tasks.values()
+            if getattr(task, 'dead_letter_queue', None)
+        })
+
+        with app.connection_for_write() as conn:
+            for queue_name in queues:
+                # Dieselbe Queue-Definition, mit der apply_async(queue=...) sie angelegt hat
+                # (Exchange, Routing-Key, Argumente) - eine Deklaration mit anderen
+                # Argumenten würde vom Broker abgelehnt
+                queue = conn.SimpleQueue(app.amqp.queues[queue_name])
+                try:
+                    pending = queue.qsize()
+                    self.stdout.write(f"{queue_name}: {pending} Task(s)")
+                    if options['requeue'] and pending:
+                        requeued = self.requeue(app, queue, options['limit'])
+                        self.stdout.write(self.style.SUCCESS(f"  {requeued} Task(s) erneut eingereiht"))
+                finally:
+                    queue.close()
+
+    def requeue(self, app, queue, limit):
+        from dms.tasks import log_system_event
+
+        requeued = 0
+        while not limit or requeued < limit:
+            try:
+                message = queue.get(block=False)
+            except queue.Empty:
+                break
+
+            task_name = message.headers.get('task')
+            task_args = message.payload[0]
+            self.resend(app.tasks[task_name], message)
+            message.ack()
+            requeued += 1
+
+            log_system_event('INFO', 'DeadLetter', f"{task_name} erneut eingereiht",
+                             {'task_id': message.headers.get('id'), 'args': [str(a) for a in task_args]})
+        return requeued
+
+    def resend(self, task, message):
+        """
+        Stellt die Nachricht über die normale Route des Tasks (task_routes, Task-Queue)
+        erneut ein. Task-ID, Callbacks, Chain/Chord, Zeitlimits und eigene Header bleiben
+        erhalten; die Retries beginnen von vorn, eine alte Ablaufzeit gilt nicht mehr.
+        """
+        from celery.app.task import Context
+
+        headers = message.headers
+        task_args, task_kwargs, embed = message.payload
+        request = Context(
+            headers,
+            args=task_args,
+            kwargs=task_kwargs,
+            callbacks=embed.get('callbacks'),
+            errbacks=embed.get('errbacks'),
+            chain=embed.get('chain'),
+            chord=embed.get('chord'),
+            headers={k: v for k, v in headers.items() if k not in CELERY_MESSAGE_HEADERS},
+            # Ohne delivery_info routet Celery neu statt zurück in die Dead-Letter-Queue
+            delivery_info={},
+        )
+        task.signature_from_request(request, retries=0, expires=None).apply_async()
@@ -7,7 +7,7 @@ Jede Seite wird einzeln gescannt und pro Mitarbeiter ein Dokument erstellt.
 
 from django.core.management.base import BaseCommand
 from dms.models import Document
-from dms.encryption import decrypt_data, encrypt_data
+from dms.encryption import read_decrypted_file, save_encrypted_file
 from dms.tasks import (
     find_employee_by_id, 
     parse_employee_id_from_datamatrix, 
@@ -16,7 +16,6 @@ from dms.tasks import (
     auto_classify_document
 )
 from pathlib import Path
-import hashlib
 
 
 class Command(BaseCommand):
@@ -95,7 +94,7 @@ class Command(BaseCommand):
         self.stdout.write(f"\nVerarbeite: {doc.original_filename}")
         
         try:
-            pdf_bytes = decrypt_data(doc.encrypted_content)
+            pdf_bytes = read_decrypted_file(doc.file)
             pdf_doc = fitz.open(stream=pdf_bytes, filetype='pdf')
             page_count = len(pdf_doc)
             
@@ -178,9 +177,6 @@ class Command(BaseCommand):
                 pdf_content = new_pdf.tobytes()
                 new_pdf.close()
                 
-                encrypted_content = encrypt_data(pdf_content)
-                file_hash = hashlib.sha256(pdf_content).hexdigest()
-                
                 employee = find_employee_by_id(emp_id, tenant=doc.tenant, mandant_code=mandant_code)
                 status = 'ASSIGNED' if employee else 'REVIEW_NEEDED'
                 
@@ -194,22 +190,23 @@ class Command(BaseCommand):
                 new_metadata['split_from'] = str(doc.id)
                 new_metadata['pages_in_split'] = len(pages)
                 
-                new_doc = Document.objects.create(
+                new_doc = Document(
                     tenant=doc.tenant,
                     title=Path(new_filename).stem,
                     original_filename=new_filename,
                     file_extension='.pdf',
                     mime_type='application/pdf',
-                    encrypted_content=encrypted_content,
-                    file_size=len(pdf_content),
                     employee=employee,
                     status=status,
                     source=doc.source,
-                    sha256_hash=file_hash,
                     metadata=new_metadata,
                     period_year=doc.period_year,
                     period_month=doc.period_month
                 )
+                new_doc.sha256_hash, new_doc.file_size = save_encrypted_file(
+                    new_doc.file, pdf_content, f"{new_doc.id}.enc"
+                )
+                new_doc.save()
                 
                 auto_classify_document(new_doc, tenant=doc.tenant)
                 created_docs.append(new_doc)
@@ -234,18 +231,11 @@ class Command(BaseCommand):
     def _scan_page_with_timeout(self, pdf_doc, page_num, timeout_seconds):
         """Scannt eine Seite mit Timeout (Thread-basiert für Docker-Kompatibilität)"""
         from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
-        from pylibdmtx.pylibdmtx import decode
-        from PIL import Image
-        import fitz
-        import io
+        from dms.tasks import decode_datamatrix_page
         
         def do_scan():
-            page = pdf_doc[page_num]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            
-            decoded = decode(img, timeout=timeout_seconds * 1000, max_count=1)
+            decoded = decode_datamatrix_page(pdf_doc[page_num], zoom=2.0,
+                                             timeout=timeout_seconds * 1000, max_count=1)
             
             for d in decoded:
                 raw_data = d.data.decode('utf-8')
@@ -302,9 +292,6 @@ class Command(BaseCommand):
             pdf_content = new_pdf.tobytes()
             new_pdf.close()
             
-            encrypted_content = encrypt_data(pdf_content)
-            file_hash = hashlib.sha256(pdf_content).hexdigest()
-            
             employee = None
             if emp_id:
                 employee = find_employee_by_id(emp_id, tenant=doc.tenant, mandant_code=mandant_code)
@@ -323,22 +310,23 @@ class Command(BaseCommand):
             new_metadata['split_from'] = str(doc.id)
             new_metadata['page_number'] = page_num + 1
             
-            new_doc = Document.objects.create(
+            new_doc = Document(
                 tenant=doc.tenant,
                 title=Path(new_filename).stem,
                 original_filename=new_filename,
                 file_extension='.pdf',
                 mime_type='application/pdf',
-                encrypted_content=encrypted_content,
-                file_size=len(pdf_content),
                 employee=employee,
                 status=status,
                 source=doc.source,
-                sha256_hash=file_hash,
                 metadata=new_metadata,
                 period_year=doc.period_year,
                 period_month=doc.period_month
             )
+            new_doc.sha256_hash, new_doc.file_size = save_encrypted_file(
+                new_doc.file, pdf_content, f"{new_doc.id}.enc"
+            )
+            new_doc.save()
             
             auto_classify_document(new_doc, tenant=doc.tenant)
             created_count += 1
@@ -32,7 +32,8 @@ class Command(BaseCommand):
         
         self.stdout.write(f"Prüfe {total} Dokumente...")
         
-        for doc in docs.iterator():
+        docs = docs.only('id', 'title', 'metadata', 'period_year', 'period_month')
+        for doc in docs.iterator(chunk_size=2000):
             month_folder = doc.metadata.get('month_folder') if doc.metadata else None
             
             if not month_folder or len(month_folder) != 6:
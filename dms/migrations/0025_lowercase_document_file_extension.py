@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models.functions import Lower
+
+
+def lowercase_file_extensions(apps, schema_editor):
+    # Bestehende Endungen normalisieren; neue werden in Document.save() kleingeschrieben
+    Document = apps.get_model('dms', 'Document')
+    Document.objects.exclude(file_extension=Lower('file_extension')).update(
+        file_extension=Lower('file_extension')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dms', '0024_company_support_access_granted_by_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_file_extensions, migrations.RunPython.noop),
+    ]
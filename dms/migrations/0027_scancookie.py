@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dms', '0026_employee_employee_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanCookie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('mtime_ns', models.BigIntegerField()),
+                ('checked_at', models.DateTimeField()),
+            ],
+        ),
+    ]
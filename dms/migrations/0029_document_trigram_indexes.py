@@ -0,0 +1,46 @@
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+# GIN-Trigramm-Indizes, damit icontains (ILIKE '%…%') auf Titel/Dateiname einen
+# Index nutzen kann. Nur PostgreSQL; SQLite-Entwicklungsumgebungen bleiben unverändert.
+TRIGRAM_INDEXES = (
+    ('dms_document_title_trgm', 'title'),
+    ('dms_document_filename_trgm', 'original_filename'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        # Savepoint: ohne pg_trgm (z.B. nicht in azure.extensions freigegeben) läuft die Migration weiter
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError as e:
+        logger.warning(f"pg_trgm nicht verfügbar, Trigramm-Indizes übersprungen: {e}")
+        return
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON dms_document USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dms', '0028_document_created_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
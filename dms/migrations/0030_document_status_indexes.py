@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dms', '0029_document_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='dms_doc_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(
+                condition=models.Q(status='UNASSIGNED'),
+                fields=['-created_at', '-id'],
+                name='dms_doc_unassigned_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def clear_scan_cookies(apps, schema_editor):
+    # Reiner Cache: der nächste Scan listet alle Verzeichnisse neu und legt die Einträge wieder an
+    apps.get_model('dms', 'ScanCookie').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dms', '0030_document_status_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_scan_cookies, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='scancookie',
+            name='path',
+            field=models.TextField(),
+        ),
+        migrations.AddField(
+            model_name='scancookie',
+            name='path_hash',
+            field=models.CharField(max_length=64, unique=True, default=''),
+            preserve_default=False,
+        ),
+    ]
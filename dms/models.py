@@ -2,6 +2,7 @@ import uuid
 from django.db import models
 from django.contrib.auth.models import User, Group
 from django.utils import timezone
+from django.utils.functional import cached_property
 from dms.managers import TenantAwareManager, TenantAwareManagerAllowNull
 
 
@@ -540,6 +541,10 @@ class Employee(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['tenant', 'employee_id'], name='unique_employee_per_tenant')
         ]
+        indexes = [
+            # employee_id IN (...) über alle Tenants (find_employees_by_ids)
+            models.Index(fields=['employee_id'], name='dms_employee_empid_idx'),
+        ]
 
 
 class DocumentType(models.Model):
@@ -630,11 +635,21 @@ class Document(models.Model):
     def __str__(self):
         return f"{self.title} ({self.status})"
 
+    def save(self, *args, **kwargs):
+        # Endung immer kleingeschrieben speichern (.PDF -> .pdf), damit Vergleiche ohne .lower() auskommen
+        if self.file_extension:
+            self.file_extension = self.file_extension.lower()
+        super().save(*args, **kwargs)
+
     def archive(self):
         self.status = 'ARCHIVED'
         self.archived_at = timezone.now()
         self.save()
 
+    @cached_property
+    def is_pdf(self):
+        return self.mime_type == 'application/pdf' or self.file_extension == '.pdf'
+
     @property
     def file_size_display(self):
         """Human-readable file size."""
@@ -664,6 +679,17 @@ class Document(models.Model):
             ("view_all_documents", "Can view all documents"),
             ("manage_documents", "Can manage all documents"),
         ]
+        indexes = [
+            # Keyset-Pagination der Dokumentliste (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='dms_document_created_id_idx'),
+            # Status-Filter der Listen mit gleicher Sortierung wie die Keyset-Pagination
+            models.Index(fields=['status', '-created_at', '-id'], name='dms_doc_status_created_idx'),
+            # Eingangskorb: nur die (wenigen) nicht zugeordneten Dokumente
+            models.Index(
+                fields=['-created_at', '-id'], name='dms_doc_unassigned_idx',
+                condition=models.Q(status='UNASSIGNED'),
+            ),
+        ]
 
 
 class ProcessedFile(models.Model):
@@ -686,6 +712,21 @@ class ProcessedFile(models.Model):
         ]
 
 
+class ScanCookie(models.Model):
+    """
+    Letzte beobachtete Verzeichnis-mtime eines Sage-Archivordners.
+    Unveränderte Verzeichnisse werden beim nächsten Scan nicht erneut aufgelistet.
+    Eindeutig über den SHA-256 des Pfads, damit auch beliebig lange Pfade passen.
+    """
+    path = models.TextField()
+    path_hash = models.CharField(max_length=64, unique=True)
+    mtime_ns = models.BigIntegerField()
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.path
+
+
 class Task(models.Model):
     PRIORITY_CHOICES = [
         (1, 'Low'),
@@ -752,7 +793,9 @@ class SystemLog(models.Model):
         verbose_name="Mandant",
         help_text="Wenn gesetzt, ist dieser Log nur für diesen Mandanten sichtbar"
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Kein auto_now_add: gepufferte Einträge (log_system_event) tragen den Zeitpunkt
+    # des Ereignisses, nicht den des späteren bulk_create
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default='INFO')
     source = models.CharField(max_length=100)
     message = models.TextField()
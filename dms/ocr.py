@@ -3,43 +3,131 @@ OCR (Optical Character Recognition) Modul für das DMS
 Verwendet Tesseract für Texterkennung aus gescannten PDFs und Bildern
 """
 
+import hashlib
 import io
 import logging
 import re
+import threading
 from pathlib import Path
 from typing import Optional, Tuple, List, Dict
 
 logger = logging.getLogger('dms')
 
+OCR_LANG = 'deu+eng'
+
+# Graustufen mit 220 DPI reichen für gedruckten Text; nur bei schlechter
+# Erkennung (erkannte Wörter mit niedriger Konfidenz) wird die Seite erneut
+# mit 300 DPI gerendert.
+OCR_DPI = 220
+OCR_RETRY_DPI = 300
+OCR_MIN_CONFIDENCE = 60
+
+# OCR-Ergebnisse sind eine reine Funktion des Inhalts -> per SHA-256 cachen
+OCR_CACHE_TIMEOUT = 86400
+
+# Persistenter Tesseract-Handle pro Prozess (tesserocr): die LSTM-Modelle
+# für deu+eng werden nur einmal geladen statt pro Seite einen neuen
+# tesseract-Prozess zu starten.
+_tess_api = None
+_tess_lock = threading.Lock()
+
+
+def _get_tess_api():
+    """
+    Liefert den tesserocr-Handle dieses Prozesses (lazy initialisiert).
+    """
+    global _tess_api
+    
+    if _tess_api is None:
+        from tesserocr import PyTessBaseAPI, OEM, PSM
+        _tess_api = PyTessBaseAPI(lang=OCR_LANG, oem=OEM.LSTM_ONLY, psm=PSM.AUTO)
+    return _tess_api
+
+
+def reset_tess_api():
+    """
+    Verwirft den tesserocr-Handle, damit er im aktuellen Prozess neu aufgebaut wird.
+    Wird nach dem Fork eines Celery-Workers aufgerufen (worker_process_init).
+    """
+    global _tess_api
+    
+    with _tess_lock:
+        if _tess_api is not None:
+            try:
+                _tess_api.End()
+            except Exception:
+                pass
+        _tess_api = None
+
+
+def _ocr_one_page(image) -> Tuple[str, float]:
+    """
+    OCR für eine einzelne Seite.
+    Top-Level-Funktion, damit sie an den billiard-Pool (dms.process_pool) übergeben werden kann.
+    
+    Returns: (text, mittlere Tesseract-Konfidenz 0-100)
+    """
+    api = _get_tess_api()
+    with _tess_lock:
+        api.SetImage(image)
+        return api.GetUTF8Text(), float(api.MeanTextConf())
+
+
+def _ocr_page_batch(images) -> List[Tuple[str, float]]:
+    """OCR für mehrere Seiten in einem Pool-Prozess (ein Teilauftrag pro erlaubtem Prozess)."""
+    return [_ocr_one_page(image) for image in images]
+
+
+def _get_ocr_parallelism(page_count: int) -> int:
+    """
+    Anzahl paralleler OCR-Prozesse, begrenzt durch settings.OCR_PARALLELISM und den
+    billiard-Pool des Workers (verhindert Überbuchung der CPU-Kerne im Celery-Worker).
+    """
+    from .process_pool import get_pool_parallelism
+    
+    return max(1, min(get_pool_parallelism('OCR_PARALLELISM'), page_count))
+
 
 def extract_text_from_pdf(pdf_content: bytes) -> str:
     """
     Extrahiert Text aus einem PDF.
     Versucht zuerst native Textextraktion, dann OCR falls nötig.
     """
+    doc = None
     try:
         import fitz
         
         doc = fitz.open(stream=pdf_content, filetype="pdf")
-        text_parts = []
-        needs_ocr = False
+        page_texts = []
+        needs_ocr_idx = []
         
-        for page in doc:
+        for page_num, page in enumerate(doc):
             page_text = page.get_text()
             if page_text.strip():
-                text_parts.append(page_text)
+                page_texts.append(page_text)
             else:
-                needs_ocr = True
-        
-        doc.close()
+                page_texts.append('')
+                needs_ocr_idx.append(page_num)
         
-        native_text = '\n'.join(text_parts).strip()
+        native_text = '\n'.join(text for text in page_texts if text).strip()
         
         if native_text and len(native_text) > 100:
             return native_text
         
-        if needs_ocr or len(native_text) < 100:
-            ocr_text = ocr_pdf(pdf_content)
+        # Bereits geöffnetes Dokument an OCR weiterreichen statt das PDF erneut zu parsen.
+        # Nur leere Seiten OCRen; hat jede Seite etwas Text (aber insgesamt zu wenig), alle.
+        try:
+            ocr_pages = _ocr_pdf_pages(pdf_content, doc=doc, pages=needs_ocr_idx or None)
+        except Exception as e:
+            logger.error(f"OCR fehlgeschlagen: {e}")
+            ocr_pages = {}
+        if ocr_pages:
+            if needs_ocr_idx:
+                for page_num, ocr_text in ocr_pages.items():
+                    page_texts[page_num] = ocr_text
+                ocr_text = '\n'.join(text for text in page_texts if text).strip()
+            else:
+                ocr_text = '\n\n'.join(ocr_pages[page_num] for page_num in sorted(ocr_pages))
             if ocr_text and len(ocr_text) > len(native_text):
                 return ocr_text
         
@@ -48,24 +136,99 @@ def extract_text_from_pdf(pdf_content: bytes) -> str:
     except Exception as e:
         logger.error(f"PDF-Textextraktion fehlgeschlagen: {e}")
         return ""
+    finally:
+        if doc is not None:
+            doc.close()
 
 
-def ocr_pdf(pdf_content: bytes) -> str:
+def _render_pdf_page(pdf_content: bytes, doc, page_num: int, dpi: int):
     """
-    Führt OCR auf einem PDF durch (für gescannte Dokumente)
+    Rendert eine PDF-Seite als Graustufenbild. Mit geöffnetem fitz-Dokument
+    direkt über PyMuPDF, sonst über pdf2image aus den Bytes.
     """
-    try:
-        from pdf2image import convert_from_bytes
-        import pytesseract
-        
-        images = convert_from_bytes(pdf_content, dpi=300)
+    from PIL import Image
+    
+    if doc is not None:
+        import fitz
         
-        text_parts = []
-        for i, image in enumerate(images):
-            page_text = pytesseract.image_to_string(image, lang='deu+eng')
-            text_parts.append(page_text)
+        pix = doc[page_num].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes('L', (pix.width, pix.height), pix.samples)
+    
+    from pdf2image import convert_from_bytes
+    
+    images = convert_from_bytes(
+        pdf_content, dpi=dpi, grayscale=True,
+        first_page=page_num + 1, last_page=page_num + 1
+    )
+    return images[0] if images else None
+
+
+def _ocr_pdf_pages(pdf_content: bytes, doc=None, pages: Optional[List[int]] = None) -> Dict[int, str]:
+    """
+    OCR für die angegebenen Seiten (0-basiert, None = alle).
+    Gibt {Seitennummer: Text} zurück.
+    """
+    if doc is not None:
+        page_nums = list(pages) if pages is not None else list(range(doc.page_count))
+        images = [_render_pdf_page(pdf_content, doc, page_num, OCR_DPI) for page_num in page_nums]
+    else:
+        from pdf2image import convert_from_bytes
         
-        return '\n\n'.join(text_parts)
+        images = convert_from_bytes(pdf_content, dpi=OCR_DPI, grayscale=True)
+        page_nums = list(range(len(images)))
+        if pages is not None:
+            wanted = set(pages)
+            page_nums = [page_num for page_num in page_nums if page_num in wanted]
+            images = [images[page_num] for page_num in page_nums]
+    
+    if not images:
+        return {}
+    
+    # Tesseract ist CPU-gebunden: Seiten auf den billiard-Pool des Celery-Workers
+    # verteilen (einmal pro Worker gestartet, tesserocr-Handles bleiben geladen)
+    from .process_pool import get_process_pool
+    
+    pool = get_process_pool()
+    page_results = None
+    processes = _get_ocr_parallelism(len(images))
+    if pool is not None and processes > 1:
+        # Höchstens OCR_PARALLELISM Teilaufträge, auch wenn der Pool für den
+        # DataMatrix-Scan größer ist
+        batch = -(-len(images) // processes)
+        try:
+            batches = pool.map(_ocr_page_batch, [images[i:i + batch] for i in range(0, len(images), batch)])
+            page_results = [page_result for batch_results in batches for page_result in batch_results]
+        except Exception as e:
+            logger.warning(f"OCR-Prozess-Pool fehlgeschlagen, OCR im Task-Prozess: {e}")
+    if page_results is None:
+        page_results = [_ocr_one_page(image) for image in images]
+    
+    texts = {}
+    for page_num, (page_text, confidence) in zip(page_nums, page_results):
+        # Leere Seiten (keine Wörter, Konfidenz 0) nicht erneut rendern - 300 DPI
+        # findet dort auch nichts, kostet aber einen zweiten Tesseract-Lauf
+        if confidence < OCR_MIN_CONFIDENCE and page_text.strip():
+            retry_image = _render_pdf_page(pdf_content, doc, page_num, OCR_RETRY_DPI)
+            if retry_image is not None:
+                retry_text, retry_confidence = _ocr_one_page(retry_image)
+                if retry_confidence > confidence:
+                    page_text = retry_text
+        texts[page_num] = page_text
+    
+    return texts
+
+
+def ocr_pdf(pdf_content: bytes, doc=None, pages: Optional[List[int]] = None) -> str:
+    """
+    Führt OCR auf einem PDF durch (für gescannte Dokumente).
+    
+    Ist das PDF bereits als fitz.Document geöffnet, kann es als doc übergeben
+    werden, damit es nicht ein zweites Mal geparst wird. Das Schließen bleibt
+    Sache des Aufrufers.
+    """
+    try:
+        texts = _ocr_pdf_pages(pdf_content, doc=doc, pages=pages)
+        return '\n\n'.join(texts[page_num] for page_num in sorted(texts))
         
     except Exception as e:
         logger.error(f"OCR fehlgeschlagen: {e}")
@@ -78,107 +241,140 @@ def ocr_image(image_content: bytes) -> str:
     """
     try:
         from PIL import Image
-        import pytesseract
         
         image = Image.open(io.BytesIO(image_content))
-        text = pytesseract.image_to_string(image, lang='deu+eng')
-        return text
+        
+        api = _get_tess_api()
+        with _tess_lock:
+            api.SetImage(image)
+            return api.GetUTF8Text()
         
     except Exception as e:
         logger.error(f"Bild-OCR fehlgeschlagen: {e}")
         return ""
 
 
-def classify_document(text: str) -> Tuple[str, float]:
+DOCUMENT_PATTERNS = {
+    'LOHNABRECHNUNG': {
+        'keywords': ['lohnabrechnung', 'gehaltsabrechnung', 'entgeltabrechnung', 
+                    'bruttolohn', 'nettolohn', 'sozialversicherung', 'lohnsteuer',
+                    'arbeitgeber-anteil', 'steuerklasse', 'kirchensteuer'],
+        'weight': 1.0
+    },
+    'ARBEITSVERTRAG': {
+        'keywords': ['arbeitsvertrag', 'anstellungsvertrag', 'dienstvertrag',
+                    'arbeitsverhältnis', 'probezeit', 'kündigungsfrist', 
+                    'arbeitszeit', 'vergütung', 'urlaubsanspruch', 'tarifvertrag'],
+        'weight': 1.0
+    },
+    'URLAUBSANTRAG': {
+        'keywords': ['urlaubsantrag', 'urlaubsanspruch', 'resturlaub', 
+                    'genehmigt', 'abgelehnt', 'erholungsurlaub', 'sonderurlaub'],
+        'weight': 1.0
+    },
+    'KRANKMELDUNG': {
+        'keywords': ['arbeitsunfähigkeit', 'krankmeldung', 'au-bescheinigung',
+                    'arbeitsunfähigkeitsbescheinigung', 'krankheit', 'arzt'],
+        'weight': 1.0
+    },
+    'ZEUGNIS': {
+        'keywords': ['arbeitszeugnis', 'zwischenzeugnis', 'qualifiziertes zeugnis',
+                    'zu unserer vollsten zufriedenheit', 'tätigkeiten umfassten',
+                    'beurteilung', 'leistung und führung'],
+        'weight': 1.0
+    },
+    'KUENDIGUNG': {
+        'keywords': ['kündigung', 'kündigungsschreiben', 'beendigung des arbeitsverhältnisses',
+                    'fristgerecht', 'ordentliche kündigung', 'außerordentliche kündigung'],
+        'weight': 1.0
+    },
+    'BEWERBUNG': {
+        'keywords': ['bewerbung', 'lebenslauf', 'curriculum vitae', 'cv',
+                    'anschreiben', 'motivationsschreiben', 'stellenanzeige'],
+        'weight': 1.0
+    },
+    'SCHULUNG': {
+        'keywords': ['teilnahmebescheinigung', 'zertifikat', 'schulung', 
+                    'weiterbildung', 'fortbildung', 'seminar', 'workshop'],
+        'weight': 1.0
+    },
+    'ABMAHNUNG': {
+        'keywords': ['abmahnung', 'pflichtverstoß', 'arbeitsrechtliche konsequenzen',
+                    'verhaltensbedingt', 'verwarnung'],
+        'weight': 1.0
+    },
+    'LOHNSTEUERKARTE': {
+        'keywords': ['lohnsteuerbescheinigung', 'elektronische lohnsteuerbescheinigung',
+                    'elstam', 'finanzamt', 'steuernummer'],
+        'weight': 1.0
+    },
+    'SOZIALVERSICHERUNG': {
+        'keywords': ['sozialversicherungsnachweis', 'jahresmeldung', 
+                    'sv-ausweis', 'rentenversicherung', 'sozialversicherungsnummer'],
+        'weight': 1.0
+    },
+    'ZEITNACHWEIS': {
+        'keywords': ['zeitnachweis', 'arbeitszeitnachweis', 'stundenzettel',
+                    'überstunden', 'arbeitszeit', 'stundenkonto'],
+        'weight': 1.0
+    }
+}
+
+# Alle Schlüsselwörter in einem Regex - ein C-Durchlauf über den Text statt ~80 Substring-Suchen
+_KEYWORD_PREFILTER = re.compile('|'.join(
+    re.escape(keyword)
+    for config in DOCUMENT_PATTERNS.values()
+    for keyword in sorted(config['keywords'], key=len, reverse=True)
+))
+
+# Vorberechnete Indizes für die Bewertung: jedes Schlüsselwort wird genau einmal gesucht,
+# auch wenn es zu mehreren Dokumenttypen gehört (z.B. 'arbeitszeit', 'urlaubsanspruch')
+_TYPE_LIST = list(DOCUMENT_PATTERNS)
+_TYPE_WEIGHTS = [DOCUMENT_PATTERNS[doc_type]['weight'] for doc_type in _TYPE_LIST]
+_MAX_POSSIBLE = [len(DOCUMENT_PATTERNS[doc_type]['keywords']) for doc_type in _TYPE_LIST]
+_KEYWORD_TYPES: Dict[str, List[int]] = {}
+for _idx, _doc_type in enumerate(_TYPE_LIST):
+    for _keyword in DOCUMENT_PATTERNS[_doc_type]['keywords']:
+        _KEYWORD_TYPES.setdefault(_keyword, []).append(_idx)
+_KEYWORD_TYPES = tuple((keyword, tuple(indices)) for keyword, indices in _KEYWORD_TYPES.items())
+del _idx, _doc_type, _keyword
+
+
+def classify_document(text: str, text_lower: Optional[str] = None) -> Tuple[str, float]:
     """
     Klassifiziert ein Dokument basierend auf dem Textinhalt.
     Gibt den Dokumenttyp und eine Konfidenz (0-1) zurück.
-    """
-    text_lower = text.lower()
     
-    patterns = {
-        'LOHNABRECHNUNG': {
-            'keywords': ['lohnabrechnung', 'gehaltsabrechnung', 'entgeltabrechnung', 
-                        'bruttolohn', 'nettolohn', 'sozialversicherung', 'lohnsteuer',
-                        'arbeitgeber-anteil', 'steuerklasse', 'kirchensteuer'],
-            'weight': 1.0
-        },
-        'ARBEITSVERTRAG': {
-            'keywords': ['arbeitsvertrag', 'anstellungsvertrag', 'dienstvertrag',
-                        'arbeitsverhältnis', 'probezeit', 'kündigungsfrist', 
-                        'arbeitszeit', 'vergütung', 'urlaubsanspruch', 'tarifvertrag'],
-            'weight': 1.0
-        },
-        'URLAUBSANTRAG': {
-            'keywords': ['urlaubsantrag', 'urlaubsanspruch', 'resturlaub', 
-                        'genehmigt', 'abgelehnt', 'erholungsurlaub', 'sonderurlaub'],
-            'weight': 1.0
-        },
-        'KRANKMELDUNG': {
-            'keywords': ['arbeitsunfähigkeit', 'krankmeldung', 'au-bescheinigung',
-                        'arbeitsunfähigkeitsbescheinigung', 'krankheit', 'arzt'],
-            'weight': 1.0
-        },
-        'ZEUGNIS': {
-            'keywords': ['arbeitszeugnis', 'zwischenzeugnis', 'qualifiziertes zeugnis',
-                        'zu unserer vollsten zufriedenheit', 'tätigkeiten umfassten',
-                        'beurteilung', 'leistung und führung'],
-            'weight': 1.0
-        },
-        'KUENDIGUNG': {
-            'keywords': ['kündigung', 'kündigungsschreiben', 'beendigung des arbeitsverhältnisses',
-                        'fristgerecht', 'ordentliche kündigung', 'außerordentliche kündigung'],
-            'weight': 1.0
-        },
-        'BEWERBUNG': {
-            'keywords': ['bewerbung', 'lebenslauf', 'curriculum vitae', 'cv',
-                        'anschreiben', 'motivationsschreiben', 'stellenanzeige'],
-            'weight': 1.0
-        },
-        'SCHULUNG': {
-            'keywords': ['teilnahmebescheinigung', 'zertifikat', 'schulung', 
-                        'weiterbildung', 'fortbildung', 'seminar', 'workshop'],
-            'weight': 1.0
-        },
-        'ABMAHNUNG': {
-            'keywords': ['abmahnung', 'pflichtverstoß', 'arbeitsrechtliche konsequenzen',
-                        'verhaltensbedingt', 'verwarnung'],
-            'weight': 1.0
-        },
-        'LOHNSTEUERKARTE': {
-            'keywords': ['lohnsteuerbescheinigung', 'elektronische lohnsteuerbescheinigung',
-                        'elstam', 'finanzamt', 'steuernummer'],
-            'weight': 1.0
-        },
-        'SOZIALVERSICHERUNG': {
-            'keywords': ['sozialversicherungsnachweis', 'jahresmeldung', 
-                        'sv-ausweis', 'rentenversicherung', 'sozialversicherungsnummer'],
-            'weight': 1.0
-        },
-        'ZEITNACHWEIS': {
-            'keywords': ['zeitnachweis', 'arbeitszeitnachweis', 'stundenzettel',
-                        'überstunden', 'arbeitszeit', 'stundenkonto'],
-            'weight': 1.0
-        }
-    }
+    text_lower kann übergeben werden, wenn der Aufrufer den Text bereits kleingeschrieben hat.
+    """
+    if text_lower is None:
+        text_lower = text.lower()
     
-    scores = {}
+    # Schneller Ausschluss: kein einziges Schlüsselwort im Text -> keine Einzelsuche nötig
+    if not _KEYWORD_PREFILTER.search(text_lower):
+        return ('UNBEKANNT', 0.0)
     
-    for doc_type, config in patterns.items():
-        score = 0
-        for keyword in config['keywords']:
-            if keyword in text_lower:
-                score += 1
-        scores[doc_type] = score * config['weight']
+    scores = [0] * len(_TYPE_LIST)
+    for keyword, indices in _KEYWORD_TYPES:
+        if keyword in text_lower:
+            for idx in indices:
+                scores[idx] += 1
     
-    if not scores or max(scores.values()) == 0:
+    weighted = [score * weight for score, weight in zip(scores, _TYPE_WEIGHTS)]
+    best_idx = max(range(len(weighted)), key=weighted.__getitem__)
+    if weighted[best_idx] == 0:
         return ('UNBEKANNT', 0.0)
     
-    best_type = max(scores, key=scores.get)
-    max_possible = len(patterns[best_type]['keywords'])
-    confidence = min(scores[best_type] / (max_possible * 0.3), 1.0)
+    confidence = min(weighted[best_idx] / (_MAX_POSSIBLE[best_idx] * 0.3), 1.0)
     
-    return (best_type, confidence)
+    return (_TYPE_LIST[best_idx], confidence)
+
+
+def classify_documents(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Klassifiziert mehrere Dokumenttexte auf einmal (Batch-Einstiegspunkt).
+    """
+    return [classify_document(text) for text in texts]
 
 
 def extract_employee_info(text: str) -> Dict[str, Optional[str]]:
@@ -246,11 +442,27 @@ def get_filing_category_suggestion(doc_type: str) -> Optional[str]:
     return category_mapping.get(doc_type)
 
 
-def process_document_with_ocr(content: bytes, mime_type: str) -> Dict:
+def process_document_with_ocr(content: bytes, mime_type: str, content_hash: Optional[str] = None,
+                              bypass_cache: bool = False) -> Dict:
     """
     Verarbeitet ein Dokument mit OCR und KI-Klassifizierung.
     Gibt ein Dictionary mit allen extrahierten Informationen zurück.
+    
+    Ergebnisse werden über den SHA-256 des Inhalts gecacht, damit erneut
+    eingehende Dokumente (weitergeleitete E-Mails, Re-Importe) nicht noch
+    einmal durch Tesseract laufen. Ist der Hash bereits bekannt (z.B.
+    Document.sha256_hash), kann er als content_hash übergeben werden.
     """
+    from django.core.cache import cache
+    
+    cache_key = None
+    if not bypass_cache:
+        content_hash = content_hash or hashlib.sha256(content).hexdigest()
+        cache_key = f"ocr:{content_hash}:{mime_type}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
     result = {
         'text': '',
         'doc_type': 'UNBEKANNT',
@@ -276,6 +488,9 @@ def process_document_with_ocr(content: bytes, mime_type: str) -> Dict:
             result['employee_info'] = extract_employee_info(result['text'])
             result['category_suggestion'] = get_filing_category_suggestion(doc_type)
         
+        if cache_key:
+            cache.set(cache_key, result, timeout=OCR_CACHE_TIMEOUT)
+        
     except Exception as e:
         logger.error(f"Dokumentverarbeitung fehlgeschlagen: {e}")
     
@@ -0,0 +1,102 @@
+"""
+Prozess-Pool für CPU-gebundene Arbeit (OCR, DataMatrix-Scan) im Celery-Worker.
+
+Celery-Prefork-Kinder sind daemonische Prozesse: concurrent.futures und
+multiprocessing dürfen dort keine Kindprozesse starten. billiard (der
+multiprocessing-Fork von Celery) erlaubt das. Der Pool wird einmal pro
+Worker-Prozess in worker_process_init angelegt - bevor Threads, Redis- oder
+DB-Verbindungen existieren - und über alle Tasks wiederverwendet. Dadurch
+bleiben z.B. die tesserocr-Handles in den Pool-Prozessen erhalten.
+
+Der Pool ist so groß wie die größte der beiden Obergrenzen OCR_PARALLELISM und
+PDF_SPLIT_PARALLELISM. Jede Aufgabenart verteilt ihre Arbeit aber nur auf so viele
+Teilaufträge, wie ihre eigene Einstellung erlaubt (get_pool_parallelism) - OCR
+belegt also nie mehr als OCR_PARALLELISM Prozesse, auch wenn der Pool größer ist.
+
+Außerhalb eines Celery-Workers (Web, Management-Commands) gibt es keinen Pool;
+Aufrufer arbeiten dann im eigenen Prozess (ggf. mit get_parallelism Threads).
+"""
+import logging
+import os
+
+logger = logging.getLogger('dms')
+
+_pool = None
+_pool_pid = None
+_pool_processes = 1
+
+
+# Obergrenze je Aufgabenart: Setting und Wert für 0/nicht gesetzt (None = alle CPU-Kerne)
+PARALLELISM_SETTINGS = {
+    'OCR_PARALLELISM': None,
+    'PDF_SPLIT_PARALLELISM': 1,
+}
+
+
+def get_parallelism(setting_name):
+    """Obergrenze paralleler Arbeit für eine Aufgabenart (Setting aus PARALLELISM_SETTINGS), max. CPU-Kerne."""
+    from django.conf import settings
+
+    cpu_count = os.cpu_count() or 1
+    limit = getattr(settings, setting_name, None) or PARALLELISM_SETTINGS[setting_name] or cpu_count
+    return max(1, min(limit, cpu_count))
+
+
+def get_pool_parallelism(setting_name):
+    """Anzahl Pool-Prozesse, die eine Aufgabenart belegen darf (1 ohne Pool)."""
+    return min(get_parallelism(setting_name), get_process_pool_size())
+
+
+def _pool_size():
+    """Größe des Pools: größte Obergrenze aller Aufgabenarten."""
+    return max(get_parallelism(setting_name) for setting_name in PARALLELISM_SETTINGS)
+
+
+def init_process_pool():
+    """Legt den Pool für den aktuellen Worker-Prozess an (worker_process_init)."""
+    global _pool, _pool_pid, _pool_processes
+
+    shutdown_process_pool()
+    size = _pool_size()
+    if size <= 1:
+        return
+    try:
+        from billiard.pool import Pool
+        _pool = Pool(processes=size)
+        _pool_pid = os.getpid()
+        _pool_processes = size
+    except Exception as e:
+        logger.warning(f"Prozess-Pool konnte nicht gestartet werden, arbeite ohne: {e}")
+        _pool = None
+        _pool_pid = None
+
+
+def get_process_pool():
+    """
+    Liefert den Pool dieses Worker-Prozesses oder None (kein Celery-Worker,
+    Parallelität 1, oder geerbter Pool eines anderen Prozesses).
+    """
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    return None
+
+
+def get_process_pool_size():
+    """Anzahl Prozesse im Pool dieses Workers (1 ohne Pool)."""
+    return _pool_processes if get_process_pool() is not None else 1
+
+
+def shutdown_process_pool():
+    """Beendet den Pool (worker_process_shutdown)."""
+    global _pool, _pool_pid, _pool_processes
+
+    pool, owner = _pool, _pool_pid
+    _pool = None
+    _pool_pid = None
+    _pool_processes = 1
+    if pool is not None and owner == os.getpid():
+        try:
+            pool.terminate()
+            pool.join()
+        except Exception:
+            pass
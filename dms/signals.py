@@ -1,4 +1,5 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.core.signals import request_finished
 from django.dispatch import receiver
 from django.db import transaction
 from datetime import date
@@ -106,3 +107,42 @@ def auto_file_document(sender, instance, created, **kwargs):
             logger.info(f"Auto-filed document {instance.id} to personnel file {personnel_file.file_number}")
     except Exception as e:
         logger.error(f"Auto-filing failed for document {instance.id}: {e}")
+
+
+@receiver(post_save, sender='dms.MatchingRule')
+@receiver(post_delete, sender='dms.MatchingRule')
+def invalidate_matching_rule_cache(sender, instance, **kwargs):
+    from dms.tasks import invalidate_rule_automaton_cache
+    
+    invalidate_rule_automaton_cache()
+
+
+@receiver(request_finished)
+def flush_system_logs_after_request(sender, **kwargs):
+    from dms.tasks import flush_system_logs
+    
+    flush_system_logs()
+
+
+@receiver(post_save, sender='dms.Employee')
+@receiver(post_delete, sender='dms.Employee')
+def invalidate_employee_lookup_cache(sender, instance, **kwargs):
+    from dms.tasks import clear_employee_lookup_cache
+    
+    clear_employee_lookup_cache()
+
+
+@receiver(post_save, sender='dms.FileCategory')
+@receiver(post_delete, sender='dms.FileCategory')
+def invalidate_file_category_cache(sender, instance, **kwargs):
+    from dms.tasks import clear_file_category_cache
+    
+    clear_file_category_cache()
+
+
+@receiver(post_save, sender='dms.DocumentType')
+@receiver(post_delete, sender='dms.DocumentType')
+def invalidate_document_type_cache(sender, instance, **kwargs):
+    from dms.tasks import clear_document_type_cache
+    
+    clear_document_type_cache()
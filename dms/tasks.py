@@ -1,23 +1,34 @@
 import os
+import atexit
+import hashlib
 import logging
+import threading
+import time
 import magic
+from collections import defaultdict
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+import ahocorasick
 import redis
 from contextlib import contextmanager
+from functools import lru_cache
 
-from celery import shared_task
+from celery import shared_task, group, chord, Task as CeleryTask
 from django.conf import settings
 from django.utils import timezone
+from django.utils.html import escape
+import bleach
+from rapidfuzz import fuzz
 
-from .models import Document, ProcessedFile, Employee, Task, SystemLog, Tenant, ScanJob, MatchingRule
-from .encryption import encrypt_data, decrypt_data, calculate_sha256, encrypt_file, calculate_sha256_chunked, encrypt_file_streaming
+from .models import Document, ProcessedFile, Employee, Task, SystemLog, Tenant, ScanJob, MatchingRule, ScanCookie
+from .encryption import calculate_sha256_chunked, save_encrypted_file, read_decrypted_file
 from .ocr import process_document_with_ocr, classify_document, extract_employee_info
-from .middleware import set_current_tenant, clear_tenant_context
+from .middleware import set_current_tenant, clear_tenant_context, get_current_tenant
+from .connectors.sage_cloud import SageCloudConnector
 import re
 import tempfile
 import os
-from django.db import transaction
+from django.db import transaction, OperationalError, IntegrityError, connection as db_connection
 
 
 @contextmanager
@@ -76,16 +87,130 @@ def create_review_task(document, source='UNKNOWN'):
         status='OPEN'
     )
     
-    SystemLog.objects.create(
-        level='INFO',
-        source='TASK_CREATE',
-        message=f"Prüfaufgabe erstellt für: {document.original_filename}",
-        details={'document_id': str(document.id), 'task_id': str(task.id), 'source': source}
-    )
+    log_system_event('INFO', 'TASK_CREATE', f"Prüfaufgabe erstellt für: {document.original_filename}",
+                     {'document_id': str(document.id), 'task_id': str(task.id), 'source': source})
     
     return task
 
 
+# Vorkompilierte Matcher pro Regel, Schlüssel: (id, updated_at, case_sensitive).
+# Eine geänderte Regel erhält durch updated_at automatisch einen neuen Eintrag.
+_RULE_MATCHER_CACHE = {}
+_RULE_MATCHER_CACHE_MAX = 2048
+
+
+def _get_rule_matcher(rule):
+    """
+    Liefert den vorbereiteten Matcher einer Regel (kompilierte Regex bzw.
+    kleingeschriebene Phrase/Wörter), damit das nicht pro Dokument passiert.
+    """
+    key = (rule.id, rule.updated_at.timestamp() if rule.updated_at else 0, rule.is_case_sensitive)
+    matcher = _RULE_MATCHER_CACHE.get(key)
+    if matcher is not None:
+        return matcher
+    
+    pattern = rule.match_pattern or ''
+    if not rule.is_case_sensitive:
+        pattern = pattern.lower()
+    
+    if rule.algorithm == 'REGEX':
+        try:
+            flags = 0 if rule.is_case_sensitive else re.IGNORECASE
+            matcher = re.compile(rule.match_pattern, flags)
+        except re.error:
+            matcher = False
+    elif rule.algorithm == 'EXACT':
+        matcher = pattern
+    elif rule.algorithm in ('ANY', 'ALL'):
+        matcher = tuple(pattern.split())
+    elif rule.algorithm == 'FUZZY':
+        matcher = tuple(word for word in pattern.split() if len(word) >= 4)
+    else:
+        matcher = False
+    
+    if len(_RULE_MATCHER_CACHE) >= _RULE_MATCHER_CACHE_MAX:
+        _RULE_MATCHER_CACHE.clear()
+    _RULE_MATCHER_CACHE[key] = matcher
+    return matcher
+
+
+def _fuzzy_match(words, text):
+    """
+    Prüft, ob eines der Wörter mit mindestens 80% Ähnlichkeit im Text vorkommt
+    (rapidfuzz, C-Implementierung).
+    """
+    return any(fuzz.partial_ratio(word, text, score_cutoff=80) for word in words)
+
+
+# Aho-Corasick-Automaten für die Literale aller EXACT/ANY/ALL-Regeln, pro Tenant.
+# Die Signatur (id, updated_at, Groß-/Kleinschreibung) der Regeln erkennt Änderungen
+# auch in anderen Prozessen; lokal leert zusätzlich ein post_save-Signal den Cache.
+_LITERAL_ALGORITHMS = ('EXACT', 'ANY', 'ALL')
+_RULE_AUTOMATON_CACHE = {}
+
+
+def invalidate_rule_automaton_cache():
+    """Verwirft alle gecachten Regel-Automaten (bei Änderung einer MatchingRule)."""
+    _RULE_AUTOMATON_CACHE.clear()
+
+
+def _rule_literals(rule, matcher):
+    if rule.algorithm == 'EXACT':
+        return (matcher,) if matcher else ()
+    return matcher
+
+
+def _get_rule_automata(rules, tenant):
+    """
+    Liefert {case_sensitive: Automaton} für die Literal-Regeln.
+    Payload je Wort: Tupel aus (rule_id, Wortindex).
+    """
+    literal_rules = [rule for rule in rules if rule.algorithm in _LITERAL_ALGORITHMS]
+    signature = tuple(
+        (rule.id, rule.updated_at.timestamp() if rule.updated_at else 0, rule.is_case_sensitive)
+        for rule in literal_rules
+    )
+    cache_key = tenant.pk if tenant else None
+    cached = _RULE_AUTOMATON_CACHE.get(cache_key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    payloads = {False: {}, True: {}}
+    for rule in literal_rules:
+        matcher = _get_rule_matcher(rule)
+        if matcher is False:
+            continue
+        for word_idx, word in enumerate(_rule_literals(rule, matcher)):
+            payloads[rule.is_case_sensitive].setdefault(word, []).append((rule.id, word_idx))
+    
+    automata = {}
+    for case_sensitive, words in payloads.items():
+        if not words:
+            automata[case_sensitive] = None
+            continue
+        automaton = ahocorasick.Automaton()
+        for word, entries in words.items():
+            automaton.add_word(word, tuple(entries))
+        automaton.make_automaton()
+        automata[case_sensitive] = automaton
+    
+    _RULE_AUTOMATON_CACHE[cache_key] = (signature, automata)
+    return automata
+
+
+def _literal_rule_hits(automata, search_text, search_text_lower):
+    """Ein Durchlauf pro Automat: {rule_id: {gefundene Wortindizes}}."""
+    hits = defaultdict(set)
+    for case_sensitive, text in ((False, search_text_lower), (True, search_text)):
+        automaton = automata.get(case_sensitive)
+        if automaton is None:
+            continue
+        for _, entries in automaton.iter(text):
+            for rule_id, word_idx in entries:
+                hits[rule_id].add(word_idx)
+    return hits
+
+
 def auto_classify_document(document, tenant=None):
     """
     Wendet Matching-Regeln auf ein Dokument an.
@@ -95,49 +220,44 @@ def auto_classify_document(document, tenant=None):
     """
     from django.db.models import Q
     
-    rules = MatchingRule.objects.filter(is_active=True).order_by('-priority')
+    rules = MatchingRule.objects.filter(is_active=True).order_by('-priority').only(
+        'id', 'name', 'updated_at', 'algorithm', 'match_pattern', 'is_case_sensitive', 'priority',
+        'assign_document_type', 'assign_employee', 'assign_status'
+    )
     if tenant:
         rules = rules.filter(Q(tenant=tenant) | Q(tenant__isnull=True))
     
+    rules = list(rules)
+    
     search_text = f"{document.original_filename} {document.title}"
+    search_text_lower = search_text.lower()
+    
+    # Alle EXACT/ANY/ALL-Literale in einem Durchlauf statt einer Suche pro Regel
+    automata = _get_rule_automata(rules, tenant)
+    literal_hits = _literal_rule_hits(automata, search_text, search_text_lower)
     
     for rule in rules:
-        pattern = rule.match_pattern
-        
-        if not rule.is_case_sensitive:
-            search_text_check = search_text.lower()
-            pattern = pattern.lower()
-        else:
-            search_text_check = search_text
+        matcher = _get_rule_matcher(rule)
+        search_text_check = search_text if rule.is_case_sensitive else search_text_lower
         
         matched = False
         
-        if rule.algorithm == 'EXACT':
-            matched = pattern in search_text_check
-        elif rule.algorithm == 'ANY':
-            words = pattern.split()
-            matched = any(word in search_text_check for word in words)
-        elif rule.algorithm == 'ALL':
-            words = pattern.split()
-            matched = all(word in search_text_check for word in words)
+        if matcher is False:
+            matched = False
+        elif rule.algorithm in _LITERAL_ALGORITHMS:
+            literals = _rule_literals(rule, matcher)
+            found = literal_hits.get(rule.id, ())
+            if rule.algorithm == 'ALL':
+                matched = len(found) == len(literals)
+            elif literals:
+                matched = bool(found)
+            else:
+                # Leeres Muster: '' in text ist immer wahr, any([]) nie
+                matched = rule.algorithm == 'EXACT'
         elif rule.algorithm == 'REGEX':
-            try:
-                flags = 0 if rule.is_case_sensitive else re.IGNORECASE
-                matched = bool(re.search(rule.match_pattern, search_text, flags))
-            except re.error:
-                matched = False
+            matched = bool(matcher.search(search_text))
         elif rule.algorithm == 'FUZZY':
-            words = pattern.split()
-            for word in words:
-                if len(word) >= 4:
-                    for i in range(len(search_text_check) - len(word) + 1):
-                        substring = search_text_check[i:i+len(word)]
-                        matches = sum(a == b for a, b in zip(word, substring))
-                        if matches >= len(word) * 0.8:
-                            matched = True
-                            break
-                if matched:
-                    break
+            matched = _fuzzy_match(matcher, search_text_check)
         
         if matched:
             changed = False
@@ -160,8 +280,16 @@ def auto_classify_document(document, tenant=None):
                     f"Dokument klassifiziert: {document.original_filename}",
                     {'rule': rule.name, 'document_type': str(document.document_type)})
             
-            if rule.assign_tags.exists():
-                document.tags.add(*rule.assign_tags.all())
+            # Alle Tags der Regel mit einem INSERT verknüpfen (unique_together document/tag
+            # sorgt mit ignore_conflicts dafür, dass vorhandene Zuordnungen übersprungen werden)
+            from .models import DocumentTag
+            
+            tag_ids = list(rule.assign_tags.values_list('id', flat=True))
+            if tag_ids:
+                DocumentTag.objects.bulk_create(
+                    [DocumentTag(document_id=document.pk, tag_id=tag_id) for tag_id in tag_ids],
+                    ignore_conflicts=True
+                )
             
             return True
     
@@ -170,13 +298,221 @@ def auto_classify_document(document, tenant=None):
 logger = logging.getLogger('dms')
 
 
+_redis_pool = None
+_redis_pool_pid = None
+
+
+def reset_redis_pool():
+    """
+    Verwirft den Redis-Connection-Pool. Wird in jedem Celery Prefork-Worker nach
+    dem Fork aufgerufen (worker_process_init), damit keine Sockets des
+    Elternprozesses weiterverwendet werden.
+    """
+    global _redis_pool, _redis_pool_pid
+    _redis_pool = None
+    _redis_pool_pid = None
+
+
 def get_redis_client():
     """
-    Erstellt eine NEUE Redis-Verbindung bei jedem Aufruf.
-    Wichtig für Celery Prefork-Worker - gecachte Verbindungen funktionieren nicht nach Fork.
+    Redis-Client auf einem Connection-Pool pro Prozess (statt neuer TCP-Verbindung
+    pro Aufruf). Der Pool wird nach einem Fork anhand der PID neu aufgebaut.
+    """
+    global _redis_pool, _redis_pool_pid
+    
+    pid = os.getpid()
+    if _redis_pool is None or _redis_pool_pid != pid:
+        redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        _redis_pool = redis.BlockingConnectionPool.from_url(redis_url, max_connections=16, timeout=5)
+        _redis_pool_pid = pid
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+# Zwischenstand laufender Scans liegt in Redis statt in der ScanJob-Zeile
+SCAN_PROGRESS_FIELDS = ('processed_files', 'error_files', 'skipped_files', 'current_file')
+SCAN_PROGRESS_TTL = 120
+
+
+def _scan_progress_key(scan_job_id):
+    return f"dms:scanprogress:{scan_job_id}"
+
+
+def publish_scan_progress(scan_job, **progress):
+    """
+    Schreibt den Fortschritt eines laufenden Scans nach Redis (ein HSET pro Update statt
+    eines UPDATE auf ScanJob). Die ScanJob-Zeile wird nur an Phasengrenzen gespeichert.
+    Ohne Redis wird wie bisher direkt in die Zeile geschrieben.
+    """
+    for field, value in progress.items():
+        setattr(scan_job, field, value)
+    try:
+        client = get_redis_client()
+        key = _scan_progress_key(scan_job.pk)
+        pipe = client.pipeline()
+        pipe.hset(key, mapping={field: getattr(scan_job, field) for field in SCAN_PROGRESS_FIELDS})
+        pipe.expire(key, SCAN_PROGRESS_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        scan_job.save(update_fields=list(SCAN_PROGRESS_FIELDS))
+
+
+def increment_scan_progress(scan_job_id, field='processed_files'):
+    """
+    Zählt den Redis-Zwischenstand eines Scans hoch (für Subtasks, die den ScanJob
+    nicht selbst halten). Ohne Redis bleibt es beim Endstand aus dem Chord-Callback.
+    """
+    try:
+        client = get_redis_client()
+        key = _scan_progress_key(scan_job_id)
+        pipe = client.pipeline()
+        pipe.hincrby(key, field, 1)
+        pipe.expire(key, SCAN_PROGRESS_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def apply_scan_progress(scan_jobs):
+    """Überträgt den Redis-Zwischenstand auf laufende ScanJobs (für die Anzeige)."""
+    running = [job for job in scan_jobs if job.status == 'RUNNING']
+    if not running:
+        return scan_jobs
+    try:
+        client = get_redis_client()
+        pipe = client.pipeline()
+        for job in running:
+            pipe.hgetall(_scan_progress_key(job.pk))
+        snapshots = pipe.execute()
+    except redis.RedisError:
+        return scan_jobs
+    for job, snapshot in zip(running, snapshots):
+        for field, value in snapshot.items():
+            field = field.decode()
+            if field == 'current_file':
+                job.current_file = value.decode()
+            elif field in SCAN_PROGRESS_FIELDS:
+                setattr(job, field, int(value))
+    return scan_jobs
+
+
+# Stale-Check, SETNX und Metadaten in einem atomaren Roundtrip (kein TOCTOU zwischen
+# Erkennen und Löschen eines verwaisten Locks).
+# KEYS: lock_key, meta_key; ARGV: lock_value, timeout, now, hostname, max_age
+# Rückgabe: {acquired, stale_cleared}
+_LOCK_ACQUIRE_SCRIPT = """
+local cleared = 0
+local meta = redis.call('HMGET', KEYS[2], 'start_time', 'timeout')
+local max_age = tonumber(ARGV[5])
+if meta[2] then
+    -- Verlängerte Locks (extend) mit ihrer eigenen TTL bewerten
+    max_age = math.max(max_age, tonumber(meta[2]) * 1.5)
+end
+if meta[1] and (tonumber(ARGV[3]) - tonumber(meta[1])) > max_age then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    cleared = 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    redis.call('HSET', KEYS[2], 'start_time', ARGV[3], 'hostname', ARGV[4],
+               'lock_value', ARGV[1], 'timeout', ARGV[2])
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]) + 60)
+    return {1, cleared}
+end
+return {0, cleared}
+"""
+
+# Nur löschen wenn wir den Lock besitzen
+_LOCK_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("del", KEYS[2])
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+# TTL eines gehaltenen Locks neu setzen (nur durch den Besitzer)
+# KEYS: lock_key, meta_key; ARGV: lock_value, timeout
+_LOCK_EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('HSET', KEYS[2], 'timeout', ARGV[2])
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]) + 60)
+    return 1
+end
+return 0
+"""
+
+# Registrierte Skripte (SHA einmal berechnet) pro Connection-Pool: (pool, acquire, release, extend)
+_lock_scripts = None
+
+
+def _get_lock_scripts(client):
+    """Registriert die Lock-Skripte einmal pro Pool; nach Fork/Reset des Pools erneut."""
+    global _lock_scripts
+    
+    pool = client.connection_pool
+    if _lock_scripts is None or _lock_scripts[0] is not pool:
+        _lock_scripts = (
+            pool,
+            client.register_script(_LOCK_ACQUIRE_SCRIPT),
+            client.register_script(_LOCK_RELEASE_SCRIPT),
+            client.register_script(_LOCK_EXTEND_SCRIPT),
+        )
+    return _lock_scripts[1:]
+
+
+def _lock_keys(lock_name):
+    return [f"dms:lock:{lock_name}", f"dms:lock:{lock_name}:meta"]
+
+
+def extend_distributed_lock(lock_name, lock_value, timeout):
+    """Setzt die TTL eines gehaltenen Locks auf timeout Sekunden. False wenn er nicht mehr gehört."""
+    if lock_value is None:
+        return False
+    client = get_redis_client()
+    _, _, extend = _get_lock_scripts(client)
+    return bool(extend(keys=_lock_keys(lock_name), args=[lock_value, timeout]))
+
+
+def release_distributed_lock(lock_name, lock_value):
+    """
+    Gibt einen Lock frei, den distributed_lock an einen anderen Task übergeben hat
+    (z.B. an den Chord-Callback). Fehler werden nur geloggt; die TTL räumt ohnehin auf.
     """
-    redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
-    return redis.from_url(redis_url)
+    if lock_value is None:
+        return
+    try:
+        client = get_redis_client()
+        _, release, _ = _get_lock_scripts(client)
+        release(keys=_lock_keys(lock_name), args=[lock_value])
+        logger.info(f"[Lock] {lock_name}: released")
+    except Exception as e:
+        logger.warning(f"[Lock] Failed to release {lock_name}: {e}")
+
+
+class LockHandle:
+    """
+    Ergebnis von distributed_lock; bool(handle) ist True wenn der Lock gehalten wird.
+    hand_over() übergibt den Lock an einen anderen Task, der ihn mit
+    release_distributed_lock(name, value) freigibt - distributed_lock gibt ihn dann
+    beim Verlassen nicht mehr frei.
+    """
+    
+    def __init__(self, name, value, acquired):
+        self.name = name
+        self.value = value
+        self.acquired = acquired
+        self.handed_over = False
+    
+    def __bool__(self):
+        return self.acquired
+    
+    def extend(self, timeout):
+        return extend_distributed_lock(self.name, self.value, timeout)
+    
+    def hand_over(self):
+        self.handed_over = True
+        return self.value
 
 
 @contextmanager
@@ -189,98 +525,311 @@ def distributed_lock(lock_name, timeout=1800):
     - Standardmäßig 30 Minuten TTL (statt 1 Stunde)
     - Automatische Erkennung und Bereinigung von verwaisten Locks
     - Metadaten für bessere Diagnose
+    - Erwerb in einem einzigen Lua-Roundtrip
+    - Übergabe an einen Folge-Task per LockHandle.hand_over()
     """
     import uuid
     import time
     import socket
     
     client = get_redis_client()
-    lock_key = f"dms:lock:{lock_name}"
-    meta_key = f"dms:lock:{lock_name}:meta"
+    keys = _lock_keys(lock_name)
     lock_value = str(uuid.uuid4())
-    acquired = False
+    handle = None
     
     try:
-        # Prüfe ob ein alter Lock existiert und zu alt ist (stale lock detection)
-        try:
-            existing_meta = client.hgetall(meta_key)
-            if existing_meta:
-                start_time_raw = existing_meta.get(b'start_time') or existing_meta.get('start_time')
-                if start_time_raw:
-                    start_time = float(start_time_raw)
-                    max_age = timeout * 1.5  # 50% Puffer über TTL
-                    lock_age = time.time() - start_time
-                    
-                    if lock_age > max_age:
-                        logger.warning(f"[Lock] {lock_name}: Stale lock detected (age={lock_age:.0f}s > max={max_age:.0f}s), auto-clearing")
-                        client.delete(lock_key)
-                        client.delete(meta_key)
-        except Exception as e:
-            logger.warning(f"[Lock] Stale check failed: {e}")
-        
-        # SETNX ist atomar - nur EIN Client kann erfolgreich setzen
-        acquired = client.set(lock_key, lock_value, nx=True, ex=timeout)
+        max_age = timeout * 1.5  # 50% Puffer über TTL
+        acquire, _, _ = _get_lock_scripts(client)
+        acquired_flag, stale_cleared = acquire(
+            keys=keys,
+            args=[lock_value, timeout, time.time(), socket.gethostname(), max_age]
+        )
+        handle = LockHandle(lock_name, lock_value, bool(acquired_flag))
         
-        if acquired:
-            # Speichere Metadaten für Diagnose
-            try:
-                client.hset(meta_key, mapping={
-                    'start_time': str(time.time()),
-                    'hostname': socket.gethostname(),
-                    'lock_value': lock_value,
-                    'timeout': str(timeout)
-                })
-                client.expire(meta_key, timeout + 60)
-            except Exception as e:
-                logger.warning(f"[Lock] Failed to set metadata: {e}")
+        if stale_cleared:
+            logger.warning(f"[Lock] {lock_name}: Stale lock detected (max={max_age:.0f}s), auto-cleared")
         
-        logger.info(f"[Lock] {lock_name}: acquired={acquired}, key={lock_key}")
+        logger.info(f"[Lock] {lock_name}: acquired={handle.acquired}, key={keys[0]}")
         
-        yield bool(acquired)
+        yield handle
     except redis.exceptions.ConnectionError as e:
         logger.error(f"[Lock] Redis connection error: {e}")
         # Bei Verbindungsfehler: Lock überspringen, Task trotzdem ausführen
-        yield True
+        yield LockHandle(lock_name, None, True)
     finally:
-        if acquired:
-            # Nur löschen wenn wir den Lock besitzen (Lua-Script für Atomarität)
-            lua_script = """
-            if redis.call("get", KEYS[1]) == ARGV[1] then
-                redis.call("del", KEYS[2])
-                return redis.call("del", KEYS[1])
-            else
-                return 0
-            end
-            """
-            try:
-                client.eval(lua_script, 2, lock_key, meta_key, lock_value)
-                logger.info(f"[Lock] {lock_name}: released")
-            except Exception as e:
-                logger.warning(f"[Lock] Failed to release {lock_name}: {e}")
+        if handle is not None and handle.acquired and not handle.handed_over:
+            release_distributed_lock(lock_name, lock_value)
+
+
+# SystemLog-Einträge werden gepuffert und per bulk_create geschrieben statt ein INSERT
+# pro Ereignis. Der Puffer ist prozessweit (nicht thread-lokal), damit auch Einträge aus
+# ThreadPoolExecutor-Workern beim Flush am Task-/Request-Ende mitgeschrieben werden.
+SYSTEM_LOG_BUFFER_SIZE = 100
+SYSTEM_LOG_BUFFER_SECONDS = 5
+SYSTEM_LOG_IMMEDIATE_LEVELS = ('WARNING', 'ERROR', 'CRITICAL')
+
+_system_log_buffer = []
+_system_log_buffer_since = None
+_system_log_lock = threading.Lock()
+
+
+def flush_system_logs():
+    """Schreibt alle gepufferten SystemLog-Einträge mit einem bulk_create."""
+    global _system_log_buffer, _system_log_buffer_since
+    
+    with _system_log_lock:
+        rows = _system_log_buffer
+        _system_log_buffer = []
+        _system_log_buffer_since = None
+    
+    if not rows:
+        return
+    
+    try:
+        SystemLog.objects.bulk_create(rows, batch_size=500)
+    except Exception as e:
+        logger.error(f"SystemLog flush failed ({len(rows)} entries): {e}")
 
 
 def log_system_event(level, source, message, details=None):
-    SystemLog.objects.create(
-        level=level,
-        source=source,
-        message=message,
-        details=details or {}
-    )
+    global _system_log_buffer_since
+    
     getattr(logger, level.lower())(f"[{source}] {message}")
+    
+    now = time.monotonic()
+    with _system_log_lock:
+        _system_log_buffer.append(SystemLog(
+            timestamp=timezone.now(),
+            level=level,
+            source=source,
+            message=message,
+            details=details or {}
+        ))
+        if _system_log_buffer_since is None:
+            _system_log_buffer_since = now
+        flush_now = (
+            level in SYSTEM_LOG_IMMEDIATE_LEVELS
+            or len(_system_log_buffer) >= SYSTEM_LOG_BUFFER_SIZE
+            or now - _system_log_buffer_since >= SYSTEM_LOG_BUFFER_SECONDS
+        )
+    
+    # Warnungen/Fehler sofort persistieren, Info/Debug spätestens nach 5s bzw. 100 Einträgen
+    if flush_now:
+        flush_system_logs()
+
+
+atexit.register(flush_system_logs)
+
+
+# libmagic-Datenbank nur einmal pro Prozess laden (magic.from_file lädt sie bei jedem Aufruf)
+_magic_instance = None
+_magic_instance_pid = None
+
+# Für die Typerkennung reicht der Dateianfang (Signaturen, ZIP-Einträge von Office-Dateien)
+MIME_SNIFF_BYTES = 8192
+
+
+def _get_magic():
+    global _magic_instance, _magic_instance_pid
+    
+    pid = os.getpid()
+    if _magic_instance is None or _magic_instance_pid != pid:
+        _magic_instance = magic.Magic(mime=True)
+        _magic_instance_pid = pid
+    return _magic_instance
 
 
 def get_mime_type(file_path):
     try:
-        return magic.from_file(file_path, mime=True)
+        with open(file_path, 'rb') as f:
+            header = f.read(MIME_SNIFF_BYTES)
+        return _get_magic().from_buffer(header)
     except Exception:
         return 'application/octet-stream'
 
 
+def _open_pdf(source):
+    """
+    Öffnet eine PDF-Quelle mit PyMuPDF.
+    Akzeptiert einen Pfad (str/Path), die PDF-Bytes oder ein bereits geöffnetes fitz.Document.
+    
+    Returns: (fitz.Document, owns) - owns=True wenn der Aufrufer das Dokument schließen muss
+    """
+    import fitz
+    
+    if isinstance(source, fitz.Document):
+        return source, False
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf"), True
+    return fitz.open(str(source)), True
+
+
+def _pdf_source_name(source, filename=None):
+    """Lesbarer Name einer PDF-Quelle für Logs und Dateinamen."""
+    if filename:
+        return filename
+    if isinstance(source, (str, Path)):
+        return Path(source).name
+    return getattr(source, 'name', None) or 'dokument.pdf'
+
+
+# DataMatrix braucht nur ~6-10 px pro Modul: zuerst mit 1.0x rendern, nur bei
+# leerem Ergebnis (und nicht ohnehin großer Seite) mit 1.5x wiederholen
+DATAMATRIX_ZOOM = 1.0
+DATAMATRIX_RETRY_ZOOM = 1.5
+DATAMATRIX_RETRY_MAX_WIDTH = 2000
+
+
+def render_datamatrix_pixels(page, zoom=DATAMATRIX_ZOOM):
+    """
+    Rendert eine PDF-Seite als Graustufen-Pixmap und gibt (Pixel, Breite, Höhe)
+    im Format zurück, das pylibdmtx.decode direkt akzeptiert.
+    """
+    import fitz
+    
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return (pix.samples, pix.width, pix.height)
+
+
+def decode_datamatrix_page(page, zoom=None, **decode_kwargs):
+    """
+    Rendert eine PDF-Seite und übergibt die Rohpixel direkt an libdmtx
+    (ohne PNG-Encode/Decode über PIL).
+    Ohne zoom: adaptiv 1.0x, bei fehlendem Treffer 1.5x.
+    """
+    from pylibdmtx.pylibdmtx import decode
+    
+    if zoom is not None:
+        return decode(render_datamatrix_pixels(page, zoom), **decode_kwargs)
+    
+    pixels = render_datamatrix_pixels(page, DATAMATRIX_ZOOM)
+    decoded = decode(pixels, **decode_kwargs)
+    if not decoded and pixels[1] < DATAMATRIX_RETRY_MAX_WIDTH:
+        decoded = decode(render_datamatrix_pixels(page, DATAMATRIX_RETRY_ZOOM), **decode_kwargs)
+    return decoded
+
+
+# Personalnummer im Textlayer: Sage-Code als Klartextzeile (…;PN1;…) oder beschriftete
+# Personalnummer. Bewusst enger als _EMPLOYEE_ID_PATTERNS, die für DataMatrix-Inhalte
+# gedacht sind (z.B. würde "MA 5" oder eine beliebige Zahl im Fließtext falsch treffen)
+_TEXT_LAYER_EMPLOYEE_RE = re.compile(
+    r'^[^\n]*;PN\d+\b[^\n]*$|^PN\d+;[^\n]*$|\b(?:Personalnummer|PersonalNr|PersNr)\.?[:\s]*\d+',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def read_text_layer_code(page):
+    """
+    Sucht die Personalnummer im eingebetteten Text einer PDF-Seite.
+    Erspart bei Sage-PDFs mit Textlayer das Rendern und libdmtx-Decoding.
+    
+    Returns: Rohtext (wie DataMatrix-Inhalt weiterzuverarbeiten) oder None
+    """
+    try:
+        text = page.get_text("text")
+    except Exception:
+        return None
+    if not text:
+        return None
+    
+    match = _TEXT_LAYER_EMPLOYEE_RE.search(text)
+    if not match:
+        return None
+    raw_data = match.group(0).strip()
+    return raw_data if parse_employee_id_from_datamatrix(raw_data) else None
+
+
+def _parse_split_code(raw_data):
+    """Returns: (employee_id, mandant_code) oder (None, None)"""
+    emp_id = parse_employee_id_from_datamatrix(raw_data)
+    if emp_id:
+        metadata = parse_datamatrix_metadata(raw_data)
+        return emp_id, metadata.get('tenant_code')
+    return None, None
+
+
+def _decode_split_page(pixels, timeout_ms):
+    """
+    Dekodiert die DataMatrix-Codes einer gerenderten Seite.
+    Returns: (employee_id, mandant_code) oder (None, None)
+    """
+    from pylibdmtx.pylibdmtx import decode
+    
+    # Sage druckt einen Code pro Seite: libdmtx nach dem ersten Symbol abbrechen lassen,
+    # statt die restliche Seite weiter abzusuchen. Nur wenn dieser Code keine
+    # Personalnummer enthält, wird die ganze Seite nach weiteren Codes durchsucht.
+    for max_count in (1, None):
+        decoded = decode(pixels, timeout=timeout_ms, max_count=max_count)
+        if not decoded:
+            break
+        for d in decoded:
+            try:
+                page_result = _parse_split_code(d.data.decode('utf-8'))
+                if page_result[0]:
+                    return page_result
+            except Exception:
+                continue
+    return None, None
+
+
+def _scan_datamatrix_pages(doc, max_pages, deadline, result):
+    """
+    Scannt die ersten Seiten im aufrufenden Thread. Der Timeout ist kooperativ:
+    vor jeder Seite wird die Deadline geprüft, und libdmtx bekommt nur die Restzeit.
+    """
+    import time
+    
+    pages_to_scan = min(len(doc), max_pages)
+    
+    for page_num in range(pages_to_scan):
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            raise TimeoutError("DataMatrix extraction timed out")
+        
+        page = doc[page_num]
+        text_code = read_text_layer_code(page)
+        if text_code:
+            raw_codes = [text_code]
+        else:
+            # Erst nur das erste Symbol suchen (ein Code pro Seite bei Sage); die volle
+            # Suche nur, falls dieser Code keine Personalnummer liefert
+            raw_codes = [d.data.decode('utf-8') for d in decode_datamatrix_page(page, timeout=remaining_ms, max_count=1)]
+            if raw_codes and not any(parse_employee_id_from_datamatrix(raw) for raw in raw_codes):
+                remaining_ms = int((deadline - time.monotonic()) * 1000)
+                if remaining_ms > 0:
+                    raw_codes = [d.data.decode('utf-8') for d in decode_datamatrix_page(page, timeout=remaining_ms)]
+        
+        for raw_data in raw_codes:
+            result['codes'].append({'page': page_num, 'raw': raw_data})
+            
+            emp_id = parse_employee_id_from_datamatrix(raw_data)
+            if emp_id and emp_id not in result['employee_ids']:
+                result['employee_ids'].append(emp_id)
+            
+            metadata = parse_datamatrix_metadata(raw_data)
+            if metadata:
+                result['metadata'] = metadata
+                if 'tenant_code' in metadata and not result['mandant_code']:
+                    result['mandant_code'] = metadata['tenant_code']
+        
+        if result['employee_ids']:
+            break
+    
+    return result
+
+
 def extract_employee_from_datamatrix(file_path, max_pages=1, timeout_seconds=10):
     """
     Extrahiert DataMatrix-Codes aus einem PDF.
     Optimiert: Nur erste Seite scannen, mit Timeout.
     
+    Der Timeout ist kooperativ (Deadline pro Seite, Restzeit als libdmtx-Timeout)
+    statt SIGALRM und funktioniert daher auch außerhalb des Main-Threads. Das
+    fitz-Dokument wird nie an einen anderen Thread übergeben (nicht thread-sicher).
+    
+    Args:
+        file_path: Pfad, PDF-Bytes oder bereits geöffnetes fitz.Document
+    
     Returns:
         dict with keys:
             'success': bool - True if processing succeeded
@@ -290,7 +839,7 @@ def extract_employee_from_datamatrix(file_path, max_pages=1, timeout_seconds=10)
             'mandant_code': str or None - Mandant code from Sage format (MD1 -> "1")
             'metadata': dict - All parsed metadata from DataMatrix
     """
-    import signal
+    import time
     
     result = {
         'success': False,
@@ -301,64 +850,51 @@ def extract_employee_from_datamatrix(file_path, max_pages=1, timeout_seconds=10)
         'metadata': {}
     }
     
-    def timeout_handler(signum, frame):
-        raise TimeoutError("DataMatrix extraction timed out")
-    
+    doc = None
+    owns_doc = False
     try:
-        import fitz
-        from pylibdmtx.pylibdmtx import decode
-        from PIL import Image
-        import io
-        
-        old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(timeout_seconds)
-        
-        try:
-            doc = fitz.open(file_path)
-            pages_to_scan = min(len(doc), max_pages)
-            
-            for page_num in range(pages_to_scan):
-                page = doc[page_num]
-                pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                
-                decoded = decode(img)
-                for d in decoded:
-                    raw_data = d.data.decode('utf-8')
-                    result['codes'].append({'page': page_num, 'raw': raw_data})
-                    
-                    emp_id = parse_employee_id_from_datamatrix(raw_data)
-                    if emp_id and emp_id not in result['employee_ids']:
-                        result['employee_ids'].append(emp_id)
-                    
-                    metadata = parse_datamatrix_metadata(raw_data)
-                    if metadata:
-                        result['metadata'] = metadata
-                        if 'tenant_code' in metadata and not result['mandant_code']:
-                            result['mandant_code'] = metadata['tenant_code']
-                
-                if result['employee_ids']:
-                    break
-            
-            doc.close()
-            result['success'] = True
-            
-        finally:
-            signal.alarm(0)
-            signal.signal(signal.SIGALRM, old_handler)
+        doc, owns_doc = _open_pdf(file_path)
+        deadline = time.monotonic() + timeout_seconds
+        _scan_datamatrix_pages(doc, max_pages, deadline, result)
         
+        result['success'] = True
         return result
         
     except TimeoutError:
-        logger.warning(f"DataMatrix extraction timed out for {file_path}")
+        logger.warning(f"DataMatrix extraction timed out for {_pdf_source_name(file_path)}")
         result['error'] = 'Timeout'
         result['success'] = True
         return result
     except Exception as e:
-        logger.warning(f"DataMatrix extraction failed for {file_path}: {e}")
+        logger.warning(f"DataMatrix extraction failed for {_pdf_source_name(file_path)}: {e}")
         result['error'] = str(e)
         return result
+    finally:
+        if doc is not None and owns_doc:
+            doc.close()
+
+
+# Einmal kompiliert statt bei jedem Aufruf über den re-Cache; die Reihenfolge
+# bestimmt die Priorität (kein Alternations-Regex, der würde den frühesten Treffer im
+# String statt des wichtigsten Formats liefern)
+_EMPLOYEE_ID_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r';PN(\d+)',
+    r'^PN(\d+)',
+    r'PN(\d+);',
+    r'\^1008=([^^\s]+)\^',
+    r'\^1010=(\d+)',
+    r'PersNr[:\s]*(\d+)',
+    r'Personalnummer[:\s]*(\d+)',
+    r'PersonalNr[:\s]*(\d+)',
+    r'MA[:\s]*(\d+)',
+    r'EmpID[:\s]*(\d+)',
+    r'EmployeeID[:\s]*(\d+)',
+    r'^(\d{4,8})$',
+    r'\|(\d+)\|',
+    r'=(\d{1,10})\^',
+)]
+_DIGITS_RE = re.compile(r'(\d+)')
+_DATAMATRIX_SEPARATOR_RE = re.compile(r'[|;,\s\^=]+')
 
 
 def parse_employee_id_from_datamatrix(raw_data):
@@ -380,30 +916,13 @@ def parse_employee_id_from_datamatrix(raw_data):
     if raw_data.isdigit():
         return raw_data
     
-    patterns = [
-        r';PN(\d+)',
-        r'^PN(\d+)',
-        r'PN(\d+);',
-        r'\^1008=([^^\s]+)\^',
-        r'\^1010=(\d+)',
-        r'PersNr[:\s]*(\d+)',
-        r'Personalnummer[:\s]*(\d+)',
-        r'PersonalNr[:\s]*(\d+)',
-        r'MA[:\s]*(\d+)',
-        r'EmpID[:\s]*(\d+)',
-        r'EmployeeID[:\s]*(\d+)',
-        r'^(\d{4,8})$',
-        r'\|(\d+)\|',
-        r'=(\d{1,10})\^',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, raw_data, re.IGNORECASE)
+    for pattern in _EMPLOYEE_ID_PATTERNS:
+        match = pattern.search(raw_data)
         if match:
             value = match.group(1)
             if value.isdigit():
                 return value
-            digits = re.search(r'(\d+)', value)
+            digits = _DIGITS_RE.search(value)
             if digits:
                 return digits.group(1)
     
@@ -414,11 +933,11 @@ def parse_employee_id_from_datamatrix(raw_data):
                 emp_id = part[2:]
                 if emp_id.isdigit():
                     return emp_id
-                digits = re.search(r'(\d+)', emp_id)
+                digits = _DIGITS_RE.search(emp_id)
                 if digits:
                     return digits.group(1)
     
-    parts = re.split(r'[|;,\s\^=]+', raw_data)
+    parts = _DATAMATRIX_SEPARATOR_RE.split(raw_data)
     for part in parts:
         if part.isdigit() and 1 <= len(part) <= 10:
             return part
@@ -433,26 +952,32 @@ def parse_datamatrix_metadata(raw_data):
     
     Returns: dict mit keys: employee_id, tenant_code, username, date, period, year
     """
-    result = {}
     if not raw_data or ';' not in raw_data:
-        return result
+        return {}
     
-    parts = raw_data.strip().split(';')
-    for part in parts:
-        if part.startswith('PN'):
-            result['employee_id'] = part[2:]
-        elif part.startswith('MD'):
-            result['tenant_code'] = part[2:]
-        elif part.startswith('UN'):
-            result['username'] = part[2:]
-        elif part.startswith('ED'):
-            result['date'] = part[2:]
-        elif part.startswith('ES'):
-            result['period'] = part[2:]
-        elif part.startswith('YR'):
-            result['year'] = part[2:]
-    
-    return result
+    # Kopie, damit Aufrufer das gecachte Ergebnis nicht verändern
+    return dict(_parse_datamatrix_metadata_cached(raw_data))
+
+
+_DATAMATRIX_METADATA_KEYS = {
+    'PN': 'employee_id',
+    'MD': 'tenant_code',
+    'UN': 'username',
+    'ED': 'date',
+    'ES': 'period',
+    'YR': 'year',
+}
+
+
+@lru_cache(maxsize=4096)
+def _parse_datamatrix_metadata_cached(raw_data):
+    # Derselbe Sage-Code steht auf jeder Seite eines Segments -> Ergebnis cachen
+    result = {}
+    for part in raw_data.strip().split(';'):
+        key = _DATAMATRIX_METADATA_KEYS.get(part[:2])
+        if key:
+            result[key] = part[2:]
+    return tuple(result.items())
 
 
 def log_datamatrix_content(raw_data, file_name):
@@ -460,69 +985,218 @@ def log_datamatrix_content(raw_data, file_name):
     logger.info(f"DataMatrix in {file_name}: {raw_data[:200] if raw_data else 'None'}")
 
 
-def split_pdf_by_datamatrix(file_path, output_dir, timeout_per_page=5):
+# Ab dieser Seitenzahl lohnt sich der Prozess-Pool (erneutes Parsen pro Prozess)
+SPLIT_PROCESS_MIN_PAGES = 16
+
+
+def _get_split_parallelism(page_count):
+    """
+    Anzahl Prozesse für den DataMatrix-Scan, begrenzt durch settings.PDF_SPLIT_PARALLELISM
+    und den billiard-Pool des Workers (dms.process_pool).
+    1 = Scan im Task-Prozess (Thread-Pool), z.B. außerhalb von Celery.
+    """
+    from .process_pool import get_pool_parallelism
+    
+    if page_count < SPLIT_PROCESS_MIN_PAGES:
+        return 1
+    return get_pool_parallelism('PDF_SPLIT_PARALLELISM')
+
+
+def _scan_pages_threaded(doc, total_pages, timeout_ms):
+    """
+    Rendern im aufrufenden Thread (fitz-Dokumente sind nicht thread-sicher),
+    das teure libdmtx-Decoding läuft ohne GIL parallel im Thread-Pool.
+    Seiten werden blockweise verarbeitet, damit nicht alle Pixmaps gleichzeitig im RAM liegen.
+    Gleiche Obergrenze wie im Prozess-Pool: settings.PDF_SPLIT_PARALLELISM.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .process_pool import get_parallelism
+    
+    page_results = [(None, None)] * total_pages
+    max_workers = get_parallelism('PDF_SPLIT_PARALLELISM')
+    batch_size = max_workers * 2
+    
+    def scan_pages(executor, page_nums, zoom):
+        futures = {}
+        widths = {}
+        for page_num in page_nums:
+            try:
+                page = doc[page_num]
+                if zoom == DATAMATRIX_ZOOM:
+                    text_code = read_text_layer_code(page)
+                    if text_code:
+                        page_results[page_num] = _parse_split_code(text_code)
+                        continue
+                pixels = render_datamatrix_pixels(page, zoom)
+                widths[page_num] = pixels[1]
+                futures[page_num] = executor.submit(_decode_split_page, pixels, timeout_ms)
+            except Exception as e:
+                logger.warning(f"Error scanning page {page_num}: {e}")
+        
+        for page_num, future in futures.items():
+            try:
+                page_results[page_num] = future.result()
+            except Exception as e:
+                logger.warning(f"Error scanning page {page_num}: {e}")
+        return widths
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_start in range(0, total_pages, batch_size):
+            batch = range(batch_start, min(batch_start + batch_size, total_pages))
+            widths = scan_pages(executor, batch, DATAMATRIX_ZOOM)
+            
+            # Zweiter Durchlauf mit höherer Auflösung nur für Seiten ohne Treffer
+            retry = [page_num for page_num in batch
+                     if page_results[page_num][0] is None
+                     and widths.get(page_num, 0) < DATAMATRIX_RETRY_MAX_WIDTH]
+            if retry:
+                scan_pages(executor, retry, DATAMATRIX_RETRY_ZOOM)
+    
+    return page_results
+
+
+def _scan_page_range_worker(pdf_source, start, end, timeout_ms):
+    """
+    Läuft im Prozess-Pool: öffnet das PDF einmal pro Seitenbereich und liefert
+    [(employee_id, mandant_code), ...] für die Seiten start..end-1.
+    """
+    doc, owns_doc = _open_pdf(pdf_source)
+    results = []
+    try:
+        for page_num in range(start, end):
+            try:
+                page = doc[page_num]
+                text_code = read_text_layer_code(page)
+                if text_code:
+                    results.append(_parse_split_code(text_code))
+                    continue
+                pixels = render_datamatrix_pixels(page, DATAMATRIX_ZOOM)
+                page_result = _decode_split_page(pixels, timeout_ms)
+                if page_result[0] is None and pixels[1] < DATAMATRIX_RETRY_MAX_WIDTH:
+                    page_result = _decode_split_page(
+                        render_datamatrix_pixels(page, DATAMATRIX_RETRY_ZOOM), timeout_ms
+                    )
+            except Exception as e:
+                logger.warning(f"Error scanning page {page_num}: {e}")
+                page_result = (None, None)
+            results.append(page_result)
+    finally:
+        if owns_doc:
+            doc.close()
+    return results
+
+
+def _scan_pages_multiprocess(source, doc, total_pages, processes, timeout_ms):
+    """
+    Verteilt Rendern + Decoding zusammenhängender Seitenbereiche auf den
+    billiard-Pool des Workers (echte Parallelität auch für das GIL-gebundene
+    Rendern). Jeder Prozess parst das PDF nur einmal für seinen ganzen Bereich.
+    """
+    from .process_pool import get_process_pool
+    
+    pool = get_process_pool()
+    if pool is None:
+        return _scan_pages_threaded(doc, total_pages, timeout_ms)
+    
+    if isinstance(source, (str, Path)):
+        pdf_source = str(source)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        pdf_source = bytes(source)
+    else:
+        pdf_source = doc.tobytes()
+    
+    chunk = -(-total_pages // processes)
+    starts = list(range(0, total_pages, chunk))
+    ends = [min(start + chunk, total_pages) for start in starts]
+    
+    page_results = [(None, None)] * total_pages
+    try:
+        chunks = pool.starmap(
+            _scan_page_range_worker,
+            [(pdf_source, start, end, timeout_ms) for start, end in zip(starts, ends)]
+        )
+    except Exception as e:
+        # Nicht still auf "kein Split" fallen lassen, sondern im Task-Prozess scannen
+        logger.warning(f"Prozess-Pool für DataMatrix-Scan fehlgeschlagen, scanne im Task: {e}")
+        return _scan_pages_threaded(doc, total_pages, timeout_ms)
+    for start, end, chunk_results in zip(starts, ends, chunks):
+        page_results[start:end] = chunk_results
+    
+    return page_results
+
+
+def _extract_pdf_pages(doc, pages):
+    """
+    Erzeugt aus den angegebenen Seiten (0-basiert, aufsteigend) eines geöffneten
+    fitz.Document ein neues PDF und liefert dessen Bytes.
+    """
+    import fitz
+    
+    new_doc = fitz.open()
+    try:
+        # Segmente sind zusammenhängend: ein insert_pdf pro Seitenbereich statt pro Seite
+        run_start = prev = pages[0]
+        for page_num in list(pages[1:]) + [None]:
+            if page_num is not None and page_num == prev + 1:
+                prev = page_num
+                continue
+            new_doc.insert_pdf(doc, from_page=run_start, to_page=prev)
+            run_start = prev = page_num
+        return new_doc.tobytes(garbage=4, deflate=True, clean=True)
+    finally:
+        new_doc.close()
+
+
+def split_pdf_by_datamatrix(file_path, output_dir=None, timeout_per_page=5, filename=None, build_parts=True):
     """
     Teilt ein mehrseitiges PDF anhand von DataMatrix-Codes auf.
     Bei jedem neuen Mitarbeiter-Code wird ein neues Segment gestartet.
     Behält die Seitenreihenfolge bei (zusammenhängende Segmente).
     
+    Die Teil-PDFs werden im Speicher erzeugt und als Bytes zurückgegeben.
+    Nur wenn output_dir angegeben ist, werden sie zusätzlich auf Disk geschrieben.
+    
     Args:
-        file_path: Pfad zur Original-PDF
-        output_dir: Verzeichnis für die geteilten PDFs
+        file_path: Pfad zur Original-PDF, PDF-Bytes oder bereits geöffnetes fitz.Document
+        output_dir: Optionales Verzeichnis für die geteilten PDFs
         timeout_per_page: Timeout in Sekunden pro Seite
+        filename: Originaler Dateiname (für Logs und Namen der Teil-PDFs, falls kein Pfad)
+        build_parts: False liefert nur die Segmente (Seiten, Mitarbeiter) ohne Teil-PDFs;
+            'content' ist dann None
         
     Returns:
-        list of dicts: [{'file_path': str, 'employee_id': str, 'pages': list, 'page_count': int}]
+        list of dicts: [{'content': bytes, 'filename': str, 'file_path': str or None,
+                         'employee_id': str, 'pages': list, 'page_count': int}]
     """
-    import fitz
-    from pylibdmtx.pylibdmtx import decode
-    from PIL import Image
-    import io
-    
     result = []
+    source_name = _pdf_source_name(file_path, filename)
     
     try:
-        doc = fitz.open(file_path)
+        doc, owns_doc = _open_pdf(file_path)
         total_pages = len(doc)
         
         if total_pages <= 1:
-            doc.close()
+            if owns_doc:
+                doc.close()
             return result
         
         segments = []
         current_segment = {'employee_id': None, 'pages': []}
         
-        log_system_event('INFO', 'PDFSplitter', f"Scanne {total_pages} Seiten für DataMatrix-Codes: {Path(file_path).name}")
+        log_system_event('INFO', 'PDFSplitter', f"Scanne {total_pages} Seiten für DataMatrix-Codes: {source_name}")
         
         mandant_code_found = None
         
-        for page_num in range(total_pages):
-            page_emp_id = None
-            page_mandant = None
-            
-            try:
-                page = doc[page_num]
-                pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                
-                decoded = decode(img)
-                
-                for d in decoded:
-                    try:
-                        raw_data = d.data.decode('utf-8')
-                        emp_id = parse_employee_id_from_datamatrix(raw_data)
-                        if emp_id:
-                            page_emp_id = emp_id
-                            metadata = parse_datamatrix_metadata(raw_data)
-                            if metadata.get('tenant_code') and not mandant_code_found:
-                                mandant_code_found = metadata['tenant_code']
-                            break
-                    except:
-                        continue
-                
-            except Exception as e:
-                logger.warning(f"Error scanning page {page_num}: {e}")
+        timeout_ms = timeout_per_page * 1000
+        processes = _get_split_parallelism(total_pages)
+        if processes > 1:
+            page_results = _scan_pages_multiprocess(file_path, doc, total_pages, processes, timeout_ms)
+        else:
+            page_results = _scan_pages_threaded(doc, total_pages, timeout_ms)
+        
+        for page_num, (page_emp_id, page_mandant) in enumerate(page_results):
+            if page_mandant and not mandant_code_found:
+                mandant_code_found = page_mandant
             
             if page_emp_id and page_emp_id != current_segment['employee_id']:
                 if current_segment['pages']:
@@ -539,20 +1213,23 @@ def split_pdf_by_datamatrix(file_path, output_dir, timeout_per_page=5):
         segments_with_employee = [s for s in segments if s['employee_id']]
         
         if len(segments_with_employee) <= 1:
-            doc.close()
-            log_system_event('INFO', 'PDFSplitter', f"Nur ein Mitarbeiter-Segment gefunden, kein Split nötig: {Path(file_path).name}")
+            if owns_doc:
+                doc.close()
+            log_system_event('INFO', 'PDFSplitter', f"Nur ein Mitarbeiter-Segment gefunden, kein Split nötig: {source_name}")
             return result
         
         if segments and not segments[0]['employee_id'] and len(segments) > 1:
             segments[1]['pages'] = segments[0]['pages'] + segments[1]['pages']
             segments = segments[1:]
         
-        log_system_event('INFO', 'PDFSplitter', f"Gefunden: {len(segments)} Segmente in {Path(file_path).name}")
+        log_system_event('INFO', 'PDFSplitter', f"Gefunden: {len(segments)} Segmente in {source_name}")
         
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+        output_path = None
+        if output_dir:
+            output_path = Path(output_dir)
+            output_path.mkdir(parents=True, exist_ok=True)
         
-        base_name = Path(file_path).stem
+        base_name = Path(source_name).stem
         segment_counter = {}
         
         for segment in segments:
@@ -567,23 +1244,23 @@ def split_pdf_by_datamatrix(file_path, output_dir, timeout_per_page=5):
             segment_counter[emp_id] += 1
             
             try:
-                new_doc = fitz.open()
-                
-                for page_num in pages:
-                    new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
-                
                 suffix = f"_{segment_counter[emp_id]}" if segment_counter[emp_id] > 1 else ""
                 split_filename = f"{base_name}_MA{emp_id}{suffix}.pdf"
-                split_path = output_path / split_filename
-                new_doc.save(str(split_path))
-                new_doc.close()
+                split_content = _extract_pdf_pages(doc, pages) if build_parts else None
+                
+                split_path = None
+                if output_path and split_content is not None:
+                    split_path = output_path / split_filename
+                    split_path.write_bytes(split_content)
                 
                 result.append({
-                    'file_path': str(split_path),
+                    'content': split_content,
+                    'filename': split_filename,
+                    'file_path': str(split_path) if split_path else None,
                     'employee_id': emp_id if emp_id != 'UNBEKANNT' else None,
                     'pages': pages,
                     'page_count': len(pages),
-                    'original_file': str(file_path),
+                    'original_file': source_name,
                     'mandant_code': mandant_code_found
                 })
                 
@@ -593,16 +1270,17 @@ def split_pdf_by_datamatrix(file_path, output_dir, timeout_per_page=5):
             except Exception as e:
                 logger.error(f"Error creating split PDF for segment {emp_id}: {e}")
         
-        doc.close()
+        if owns_doc:
+            doc.close()
         
         log_system_event('INFO', 'PDFSplitter', 
-            f"Split abgeschlossen: {len(result)} Dokumente aus {Path(file_path).name}")
+            f"Split abgeschlossen: {len(result)} Dokumente aus {source_name}")
         
         return result
         
     except Exception as e:
-        logger.error(f"PDF split failed for {file_path}: {e}")
-        log_system_event('ERROR', 'PDFSplitter', f"Split fehlgeschlagen: {str(e)}", {'file': str(file_path)})
+        logger.error(f"PDF split failed for {source_name}: {e}")
+        log_system_event('ERROR', 'PDFSplitter', f"Split fehlgeschlagen: {str(e)}", {'file': source_name})
         return result
 
 
@@ -642,62 +1320,102 @@ def find_employee_by_id(employee_id, tenant=None, mandant_code=None):
     if not employee_id:
         return None
     
-    def search_in_queryset(qs, emp_id, mandant_code_local, tenant_local):
-        """Hilfsfunktion für die Suche in einem Queryset"""
-        employee = qs.filter(employee_id=emp_id).first()
-        if employee:
-            return employee
-        
-        if mandant_code_local:
-            sage_id = f"{mandant_code_local}_{emp_id}"
-            employee = qs.filter(employee_id=sage_id).first()
-            if employee:
-                return employee
-        
-        if tenant_local and tenant_local.code:
-            mandant_num = tenant_local.code.lstrip('0') or '1'
-            sage_id = f"{mandant_num}_{emp_id}"
-            employee = qs.filter(employee_id=sage_id).first()
-            if employee:
-                return employee
-        
-        for prefix in ['1', '2', '3', '4', '5']:
-            sage_id = f"{prefix}_{emp_id}"
-            employee = qs.filter(employee_id=sage_id).first()
-            if employee:
-                return employee
-        
-        if emp_id.isdigit():
-            employee = qs.filter(employee_id=emp_id.lstrip('0')).first()
-            if employee:
-                return employee
-            employee = qs.filter(employee_id=emp_id.zfill(8)).first()
-            if employee:
-                return employee
-        
-        return None
+    # Der Tenant-Kontext gehört mit in den Schlüssel, da Employee.objects danach filtert
+    current_tenant = get_current_tenant()
+    return _find_employee_cached(
+        str(employee_id), tenant, mandant_code,
+        current_tenant.pk if current_tenant else None
+    )
+
+
+@lru_cache(maxsize=4096)
+def _find_employee_cached(employee_id, tenant, mandant_code, context_tenant_id):
+    # Alle Schreibweisen in einer Abfrage statt bis zu ~30 einzelnen .first()-Queries
+    return find_employees_by_ids([employee_id], tenant=tenant, mandant_code=mandant_code).get(employee_id)
+
+
+def clear_employee_lookup_cache():
+    """
+    Leert den Mitarbeiter-Cache von find_employee_by_id. Aufgerufen bei Änderungen
+    an Mitarbeitern und nach jedem Celery-Task, damit Änderungen aus anderen
+    Prozessen (Web) nicht über Task-Grenzen hinweg veraltet bleiben.
+    """
+    _find_employee_cached.cache_clear()
+
+
+def _employee_id_candidates(emp_id, mandant_code=None, tenant=None):
+    """
+    Mögliche Schreibweisen einer Personalnummer in der Suchreihenfolge von find_employee_by_id.
+    """
+    candidates = [emp_id]
+    
+    if mandant_code:
+        candidates.append(f"{mandant_code}_{emp_id}")
+    
+    if tenant and tenant.code:
+        mandant_num = tenant.code.lstrip('0') or '1'
+        candidates.append(f"{mandant_num}_{emp_id}")
+    
+    candidates.extend(f"{prefix}_{emp_id}" for prefix in ['1', '2', '3', '4', '5'])
+    
+    if emp_id.isdigit():
+        candidates.append(emp_id.lstrip('0'))
+        candidates.append(emp_id.zfill(8))
+    
+    return list(dict.fromkeys(candidates))
+
+
+def find_employees_by_ids(employee_ids, tenant=None, mandant_code=None):
+    """
+    Batch-Variante von find_employee_by_id: löst mehrere Personalnummern
+    mit EINER Datenbankabfrage (employee_id IN ...) auf.
+    
+    Es gilt dieselbe Priorität wie bei find_employee_by_id:
+    1. Mitarbeiter des Tenants
+    2. Mitarbeiter ohne Tenant (Legacy-Daten)
+    3. Alle Mitarbeiter (nur wenn ein Tenant angegeben ist)
+    
+    Returns: dict {employee_id: Employee} - nur gefundene IDs
+    """
+    employee_ids = [emp_id for emp_id in dict.fromkeys(employee_ids) if emp_id]
+    if not employee_ids:
+        return {}
+    
+    candidates_by_id = {
+        emp_id: _employee_id_candidates(emp_id, mandant_code, tenant)
+        for emp_id in employee_ids
+    }
+    all_candidates = {c for candidates in candidates_by_id.values() for c in candidates}
     
     try:
-        if tenant:
-            queryset = Employee.objects.filter(tenant=tenant)
-            employee = search_in_queryset(queryset, employee_id, mandant_code, tenant)
-            if employee:
-                return employee
-        
-        queryset_null = Employee.objects.filter(tenant__isnull=True)
-        employee = search_in_queryset(queryset_null, employee_id, mandant_code, tenant)
-        if employee:
-            return employee
-        
-        if tenant:
-            queryset_all = Employee.objects.all()
-            employee = search_in_queryset(queryset_all, employee_id, mandant_code, tenant)
-            if employee:
-                return employee
-        
-        return None
+        queryset = Employee.objects.filter(employee_id__in=all_candidates)
+        if not tenant:
+            queryset = queryset.filter(tenant__isnull=True)
+        employees = list(queryset)
     except Exception:
-        return None
+        return {}
+    
+    def scope_rank(employee):
+        if tenant and employee.tenant_id == tenant.pk:
+            return 0
+        if employee.tenant_id is None:
+            return 1
+        return 2
+    
+    index = {}
+    for employee in employees:
+        index.setdefault((scope_rank(employee), employee.employee_id), employee)
+    
+    ranks = (0, 1, 2) if tenant else (1,)
+    result = {}
+    for emp_id, candidates in candidates_by_id.items():
+        for rank in ranks:
+            match = next((index[(rank, c)] for c in candidates if (rank, c) in index), None)
+            if match:
+                result[emp_id] = match
+                break
+    
+    return result
 
 
 SAGE_DOCUMENT_TYPES = {
@@ -836,21 +1554,81 @@ SAGE_DOCUMENT_TYPES = {
 }
 
 
-def classify_sage_document(filename):
+# (Muster kleingeschrieben, Ergebnis) in Prioritätsreihenfolge von SAGE_DOCUMENT_TYPES
+_SAGE_PATTERNS = [
+    (pattern.lower(), (doc_type, config['is_personnel'], config['category'], config['description']))
+    for doc_type, config in SAGE_DOCUMENT_TYPES.items()
+    for pattern in config['patterns']
+]
+_SAGE_UNKNOWN = ('UNBEKANNT', False, None, 'Unbekanntes Dokument')
+_sage_automaton = None
+
+
+def _get_sage_automaton():
+    """
+    Aho-Corasick-Automat über alle Sage-Muster (lazy).
+    Payload: (Priorität, Ergebnis).
+    """
+    global _sage_automaton
+    if _sage_automaton is None:
+        automaton = ahocorasick.Automaton()
+        for priority, (pattern, classification) in enumerate(_SAGE_PATTERNS):
+            # Gleiches Muster bei mehreren Typen: der erste gewinnt
+            if pattern not in automaton:
+                automaton.add_word(pattern, (priority, classification))
+        automaton.make_automaton()
+        _sage_automaton = automaton
+    return _sage_automaton
+
+
+def classify_sage_document(filename):
+    """
+    Klassifiziert ein Sage-Dokument anhand des Dateinamens.
+    Gibt (doc_type, is_personnel, category, description) zurück.
+    """
+    # Cache-Schlüssel kleingeschrieben: die Klassifizierung ignoriert die Schreibweise
+    return _classify_sage_document_cached(filename.lower())
+
+
+@lru_cache(maxsize=8192)
+def _classify_sage_document_cached(filename_lower):
+    # Ein Durchlauf; bei mehreren Treffern entscheidet wie bisher die Reihenfolge
+    # in SAGE_DOCUMENT_TYPES, nicht die Position im Dateinamen
+    best = min((payload for _, payload in _get_sage_automaton().iter(filename_lower)), default=None)
+    return best[1] if best else _SAGE_UNKNOWN
+
+
+# FileCategory-ID pro (Tenant-Kontext, Aktenzeichen); geleert per Signal bei Änderungen
+# und nach jedem Celery-Task
+_FILE_CATEGORY_CACHE = {}
+
+
+def _get_file_category_id(category_code):
     """
-    Klassifiziert ein Sage-Dokument anhand des Dateinamens.
-    Gibt (doc_type, is_personnel, category, description) zurück.
+    Sucht die FileCategory zu einem Aktenzeichen (exakt, sonst Hauptgruppe)
+    und merkt sich das Ergebnis pro Prozess.
     """
-    for doc_type, config in SAGE_DOCUMENT_TYPES.items():
-        for pattern in config['patterns']:
-            if pattern.lower() in filename.lower():
-                return (
-                    doc_type,
-                    config['is_personnel'],
-                    config['category'],
-                    config['description']
-                )
-    return ('UNBEKANNT', False, None, 'Unbekanntes Dokument')
+    from dms.models import FileCategory
+    
+    current_tenant = get_current_tenant()
+    key = (current_tenant.pk if current_tenant else None, category_code)
+    if key in _FILE_CATEGORY_CACHE:
+        return _FILE_CATEGORY_CACHE[key]
+    
+    file_category_id = FileCategory.objects.filter(
+        code=category_code
+    ).values_list('id', flat=True).first()
+    if not file_category_id:
+        file_category_id = FileCategory.objects.filter(
+            code__startswith=category_code.split('.')[0]
+        ).values_list('id', flat=True).first()
+    
+    _FILE_CATEGORY_CACHE[key] = file_category_id
+    return file_category_id
+
+
+def clear_file_category_cache():
+    _FILE_CATEGORY_CACHE.clear()
 
 
 def get_or_create_document_type(doc_type_name, description, category_code, tenant=None):
@@ -858,8 +1636,10 @@ def get_or_create_document_type(doc_type_name, description, category_code, tenan
     Holt oder erstellt einen DocumentType basierend auf der Sage-Klassifizierung.
     Verknüpft automatisch mit der passenden FileCategory.
     """
-    from dms.models import DocumentType, FileCategory
+    from dms.models import DocumentType
     
+    # Race zwischen parallelen Split-Tasks fängt get_or_create über den
+    # UniqueConstraint (tenant, name) ab
     doc_type_obj, created = DocumentType.objects.get_or_create(
         name=doc_type_name,
         tenant=tenant,
@@ -869,19 +1649,13 @@ def get_or_create_document_type(doc_type_name, description, category_code, tenan
         }
     )
     
-    if category_code and not doc_type_obj.file_category:
+    if category_code and not doc_type_obj.file_category_id:
         try:
-            file_category = FileCategory.objects.filter(
-                code=category_code
-            ).first()
-            if not file_category:
-                file_category = FileCategory.objects.filter(
-                    code__startswith=category_code.split('.')[0]
-                ).first()
-            if file_category:
-                doc_type_obj.file_category = file_category
+            file_category_id = _get_file_category_id(category_code)
+            if file_category_id:
+                doc_type_obj.file_category_id = file_category_id
                 doc_type_obj.save(update_fields=['file_category'])
-                logger.info(f"DocumentType '{doc_type_name}' mit FileCategory '{file_category.code}' verknüpft")
+                logger.info(f"DocumentType '{doc_type_name}' mit FileCategory '{category_code}' verknüpft")
         except Exception as e:
             logger.warning(f"Konnte FileCategory für {category_code} nicht zuordnen: {e}")
     
@@ -891,6 +1665,28 @@ def get_or_create_document_type(doc_type_name, description, category_code, tenan
     return doc_type_obj
 
 
+# DocumentType-ID pro (Tenant-ID, Klassifizierung); geleert per Signal bei Änderungen
+# und nach jedem Celery-Task (Änderungen aus dem Web-Prozess erreichen den Worker nicht)
+_DOCUMENT_TYPE_ID_CACHE = {}
+
+
+def get_document_type_id_cached(doc_type_name, description, category_code, tenant=None):
+    """
+    Wie get_or_create_document_type, liefert aber nur die ID und merkt sie sich.
+    Spart get_or_create + FileCategory-Lookup bei jedem Dokument mit gleicher Klassifizierung.
+    """
+    key = (tenant.pk if tenant else None, doc_type_name, description, category_code)
+    if key not in _DOCUMENT_TYPE_ID_CACHE:
+        _DOCUMENT_TYPE_ID_CACHE[key] = get_or_create_document_type(
+            doc_type_name, description, category_code, tenant
+        ).pk
+    return _DOCUMENT_TYPE_ID_CACHE[key]
+
+
+def clear_document_type_cache():
+    _DOCUMENT_TYPE_ID_CACHE.clear()
+
+
 @shared_task(bind=True, max_retries=3)
 def scan_sage_archive(self):
     """
@@ -916,12 +1712,478 @@ def scan_sage_archive(self):
         
         if settings_obj.azure_storage_connection_string_encrypted:
             log_system_event('INFO', 'SageScanner', "Verwende Azure Blob Storage")
-            return _run_sage_scan_azure(self)
+            return _run_sage_scan_azure(self, settings_obj, lock=acquired)
         else:
             log_system_event('INFO', 'SageScanner', "Verwende lokales Dateisystem")
             return _run_sage_scan(self)
 
 
+def _hash_key(sha256_hex):
+    """
+    Kompakter Schlüssel für die Duplikat-Sets: 32 Byte Digest statt 64 Zeichen Hex-String
+    (etwa halber Speicher pro Eintrag bei Millionen verarbeiteter Dateien).
+    """
+    return bytes.fromhex(sha256_hex)
+
+
+def _path_key(path):
+    """Kompakter Schlüssel (16 Byte BLAKE2b) für bekannte Pfade statt des vollen Pfad-Strings."""
+    return hashlib.blake2b(path.encode('utf-8'), digest_size=16).digest()
+
+
+def _walk_files(dirpath, cookies=None, children=None, dir_mtimes=None):
+    """
+    Rekursiver Verzeichnis-Walk mit os.scandir: der Dateityp kommt aus dem
+    Verzeichniseintrag (d_type), ohne zusätzlichen stat-Aufruf pro Eintrag wie bei rglob.
+    
+    Mit cookies ({pfad: mtime_ns} aus ScanCookie) werden Verzeichnisse, deren mtime
+    sich seit dem letzten Scan nicht geändert hat, nicht aufgelistet - es kamen keine
+    Einträge hinzu. Ihre bekannten Unterverzeichnisse (children) werden trotzdem geprüft,
+    da Änderungen in Unterordnern die mtime des Elternordners nicht ändern.
+    Die beobachteten mtimes landen in dir_mtimes.
+    
+    Yields: os.DirEntry für jede reguläre Datei
+    """
+    if cookies is not None:
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Verzeichnis nicht lesbar: {dirpath}: {e}")
+            return
+        # mtime VOR dem Auflisten merken: später hinzukommende Dateien ändern sie erneut
+        dir_mtimes[dirpath] = mtime_ns
+        if cookies.get(dirpath) == mtime_ns:
+            for child in children.get(dirpath, ()):
+                yield from _walk_files(child, cookies, children, dir_mtimes)
+            return
+    
+    try:
+        entries = os.scandir(dirpath)
+    except OSError as e:
+        logger.warning(f"Verzeichnis nicht lesbar: {dirpath}: {e}")
+        return
+    
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk_files(entry.path, cookies, children, dir_mtimes)
+                elif entry.is_file():
+                    yield entry
+            except OSError:
+                continue
+
+
+# Zeilen pro Fetch beim Laden bekannter Dateien. iterator() nutzt auf PostgreSQL einen
+# serverseitigen Cursor, der Client hält also nie mehr als einen Chunk zusätzlich im Speicher.
+_KNOWN_FILES_CHUNK_SIZE = 50000
+
+
+def _load_scan_cookies():
+    """
+    Lädt die Verzeichnis-mtimes des letzten Sage-Scans.
+    
+    Returns: (cookies, children) - {pfad: mtime_ns} und {elternpfad: [unterverzeichnisse]}
+    """
+    cookies = {}
+    children = defaultdict(list)
+    for path, mtime_ns in ScanCookie.objects.values_list('path', 'mtime_ns').iterator(chunk_size=_KNOWN_FILES_CHUNK_SIZE):
+        cookies[path] = mtime_ns
+        children[os.path.dirname(path)].append(path)
+    return cookies, children
+
+
+def _save_scan_cookies(dir_mtimes, failed_dirs, scan_started):
+    """
+    Speichert die beobachteten Verzeichnis-mtimes nach einem erfolgreichen Scan.
+    
+    Verzeichnisse mit fehlgeschlagenen Dateien erhalten mtime -1, damit sie beim
+    nächsten Scan wieder aufgelistet werden (der Eintrag bleibt als Unterverzeichnis
+    des Elternordners bekannt). Nicht mehr vorhandene Verzeichnisse werden entfernt.
+    """
+    cookies = [
+        ScanCookie(
+            path=path,
+            path_hash=hashlib.sha256(path.encode('utf-8')).hexdigest(),
+            mtime_ns=-1 if path in failed_dirs else mtime_ns,
+            checked_at=scan_started,
+        )
+        for path, mtime_ns in dir_mtimes.items()
+    ]
+    ScanCookie.objects.bulk_create(
+        cookies,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['path_hash'],
+        update_fields=['mtime_ns', 'checked_at'],
+    )
+    ScanCookie.objects.filter(checked_at__lt=scan_started).delete()
+
+
+def _load_known_paths():
+    """Lädt die Pfade aller verarbeiteten Dateien als kompakte Schlüssel (siehe _path_key)."""
+    rows = ProcessedFile.objects.order_by().values_list('original_path', flat=True)
+    return {_path_key(path) for path in rows.iterator(chunk_size=_KNOWN_FILES_CHUNK_SIZE)}
+
+
+def _load_known_hashes_by_tenant():
+    """
+    Lädt die Hashes aller verarbeiteten Dateien aktiver Mandanten in einem Query
+    (statt einem Query pro Mandant) und streamt das Ergebnis per iterator().
+    
+    Returns: {tenant_code: set(_hash_key(sha256_hash))}
+    """
+    known_hashes_by_tenant = defaultdict(set)
+    # order_by() entfernt die Meta-Sortierung nach processed_at, die hier nur Kosten verursacht
+    rows = (ProcessedFile.objects.filter(tenant__is_active=True)
+            .order_by()
+            .values_list('tenant__code', 'sha256_hash'))
+    for tenant_code, file_hash in rows.iterator(chunk_size=_KNOWN_FILES_CHUNK_SIZE):
+        known_hashes_by_tenant[tenant_code].add(_hash_key(file_hash))
+    return known_hashes_by_tenant
+
+
+# Sage-Archiv: {tenant_code (8-stellig)}/{YYYYMM}/{Datei}
+_SAGE_SUPPORTED_EXTENSIONS = frozenset({'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.tiff', '.txt', '.csv'})
+_SAGE_SKIP_FILES = frozenset({'thumbs.db', 'desktop.ini', '.ds_store'})
+
+
+def _is_sage_tenant_folder(name):
+    """8-stelliger Mandantencode (len + isdigit statt Regex, läuft pro Verzeichniseintrag)."""
+    return len(name) == 8 and name.isascii() and name.isdigit()
+
+
+def _is_sage_month_folder(name):
+    """Monatsordner YYYYMM."""
+    return len(name) == 6 and name.isascii() and name.isdigit()
+
+
+# Scan-Zustand für die Worker-Threads von _run_sage_scan
+_sage_scan_state = {}
+
+
+def _process_sage_file_in_thread(file_info):
+    """
+    _process_sage_file im Thread-Pool. Die DB-Verbindung des Threads bleibt über die
+    Dateien hinweg offen (CONN_MAX_AGE); nur abgelaufene/defekte werden geschlossen.
+    """
+    from django.db import close_old_connections
+    try:
+        return _process_sage_file(file_info)
+    finally:
+        close_old_connections()
+
+
+def _delete_stored_files(documents):
+    """Entfernt bereits gespeicherte Blobs, wenn der INSERT der Dokumente scheitert."""
+    for document in documents:
+        if document.file:
+            try:
+                document.file.delete(save=False)
+            except Exception as e:
+                logger.warning(f"Blob {document.file.name} konnte nicht gelöscht werden: {e}")
+
+
+def _process_sage_file(file_info):
+    """
+    Verarbeitet eine einzelne Datei aus dem Sage-Archiv. Läuft in einem Worker-Thread
+    von _run_sage_scan; Zähler werden über das Rückgabe-dict im Scan-Thread aggregiert.
+    """
+    # Pfad kommt als str (billiger zu picklen); Path nur für Name/Endung/relative_to,
+    # statt str(file_path) bei jedem Hash/MIME/fitz/Metadaten-Aufruf
+    path_str, tenant_code = file_info
+    file_path = Path(path_str)
+    sage_path = _sage_scan_state['sage_path']
+    known_hashes_by_tenant = _sage_scan_state['known_hashes_by_tenant']
+    tenant = _sage_scan_state['tenant_cache'][tenant_code]
+    pdf_doc = None
+    
+    # SAAS FIX: Tenant-Kontext setzen, damit TenantAwareManager korrekt filtert
+    with tenant_context(tenant):
+        try:
+            # OPTIMIZATION: Chunked Hash ohne volle Datei in RAM
+            file_hash = calculate_sha256_chunked(path_str)
+            
+            # Hash-Check im Memory-Cache (von allen Worker-Threads geteilt)
+            if _hash_key(file_hash) in known_hashes_by_tenant.get(tenant_code, ()):
+                return {'success': True, 'already_processed': True}
+            
+            # Kein zusätzliches exists() pro Datei: Duplikate aus parallelen Workern fängt der
+            # Unique-Constraint (tenant, sha256_hash) beim INSERT ab (IntegrityError unten)
+            
+            # Monatsordner extrahieren (vor Content-Laden für Split-Check)
+            month_folder = None
+            try:
+                tenant_folder = sage_path / tenant_code
+                relative_path = file_path.relative_to(tenant_folder)
+                path_parts = relative_path.parts
+                if len(path_parts) >= 2 and _is_sage_month_folder(path_parts[0]):
+                    month_folder = path_parts[0]
+            except ValueError:
+                pass
+            
+            mime_type = get_mime_type(path_str)
+            
+            employee = None
+            status = 'UNASSIGNED'
+            needs_review = False
+            dm_result = None
+            is_personnel = False
+            doc_type = 'UNBEKANNT'
+            category = None
+            description = 'Unbekanntes Dokument'
+            
+            if file_path.suffix.lower() == '.pdf':
+                import fitz
+                # Einmal öffnen: Seitenzahl und DataMatrix-Scan nutzen dasselbe Dokument
+                try:
+                    pdf_doc = fitz.open(path_str)
+                    page_count = len(pdf_doc)
+                except:
+                    page_count = 1
+                
+                if page_count > 1:
+                    doc_type, is_personnel_type, _, _ = classify_sage_document(file_path.name)
+                    if is_personnel_type:
+                        split_results = split_pdf_by_datamatrix(path_str)
+                        
+                        if split_results and len(split_results) > 1:
+                            log_system_event('INFO', 'SageScanner', 
+                                f"PDF aufgeteilt: {file_path.name} → {len(split_results)} Dokumente")
+                            
+                            split_employees = find_employees_by_ids(
+                                [si['employee_id'] for si in split_results],
+                                tenant=tenant, mandant_code=split_results[0].get('mandant_code')
+                            )
+                            
+                            split_docs = []
+                            for split_info in split_results:
+                                split_filename = split_info['filename']
+                                emp_id = split_info['employee_id']
+                                
+                                split_content = split_info.pop('content')
+                                
+                                split_employee = split_employees.get(emp_id)
+                                split_status = 'ASSIGNED' if split_employee else 'REVIEW_NEEDED'
+                                
+                                doc_type_split, _, category_split, desc_split = classify_sage_document(file_path.name)
+                                
+                                split_metadata = {
+                                    'original_path': path_str,
+                                    'split_from': file_path.name,
+                                    'employee_id_from_datamatrix': emp_id,
+                                    'pages_in_split': split_info['page_count'],
+                                    'tenant_code': tenant_code,
+                                    'doc_type': doc_type_split,
+                                    'is_personnel_document': True,
+                                    'month_folder': month_folder,
+                                }
+                                
+                                period_year, period_month = parse_month_folder(month_folder)
+                                split_doc = Document(
+                                    tenant=tenant,
+                                    title=Path(split_filename).stem,
+                                    original_filename=split_filename,
+                                    file_extension='.pdf',
+                                    mime_type='application/pdf',
+                                    employee=split_employee,
+                                    status=split_status,
+                                    source='SAGE',
+                                    metadata=split_metadata,
+                                    period_year=period_year,
+                                    period_month=period_month
+                                )
+                                # Verschlüsselter Blob in Document.file; Hash und Größe aus demselben Durchgang
+                                split_docs.append(split_doc)
+                                split_doc.sha256_hash, split_doc.file_size = save_encrypted_file(
+                                    split_doc.file, split_content, f"{split_doc.id}.enc"
+                                )
+                                
+                                del split_content
+                            
+                            # Alle Teile + ProcessedFile in einer Transaktion und einem Multi-Row-INSERT
+                            # (UUID-PKs sind bereits vergeben; document_type ist noch leer,
+                            # daher entfällt nur der für sie wirkungslose post_save-Handler)
+                            try:
+                                with transaction.atomic():
+                                    Document.objects.bulk_create(split_docs, batch_size=50)
+                                    ProcessedFile.objects.create(
+                                        tenant=tenant,
+                                        sha256_hash=file_hash,
+                                        original_path=path_str,
+                                        document=None
+                                    )
+                            except IntegrityError:
+                                # Parallel von einem anderen Worker importiert (Unique-Constraint auf tenant+Hash)
+                                _delete_stored_files(split_docs)
+                                return {'success': True, 'already_processed': True}
+                            except Exception:
+                                _delete_stored_files(split_docs)
+                                raise
+                            
+                            # Klassifizierung/Prüfaufgaben laufen nach dem Scan als Celery-Tasks
+                            split_docs_created = [str(split_doc.id) for split_doc in split_docs]
+                            post_import = [(str(split_doc.id), split_doc.status == 'REVIEW_NEEDED')
+                                           for split_doc in split_docs]
+                            
+                            known_hashes_by_tenant[tenant_code].add(_hash_key(file_hash))
+                            
+                            return {'success': True, 'split': True, 'split_count': len(split_results),
+                                    'filename': file_path.name, 'doc_ids': split_docs_created, 'tenant': tenant_code,
+                                    'post_import': post_import}
+                
+                dm_result = extract_employee_from_datamatrix(pdf_doc if pdf_doc is not None else path_str)
+                dm_mandant_code = dm_result.get('mandant_code')
+                
+                if dm_result['success'] and dm_result['employee_ids']:
+                    is_personnel = True
+                    # Pro-ID-Cache: dieselben Mitarbeiter tauchen in einem Monatsordner mehrfach auf
+                    employee = next(filter(None, (
+                        find_employee_by_id(e, tenant=tenant, mandant_code=dm_mandant_code)
+                        for e in dm_result['employee_ids']
+                    )), None)
+                    if employee:
+                        status = 'ASSIGNED'
+                    
+                    if not employee:
+                        needs_review = True
+                        status = 'REVIEW_NEEDED'
+                    
+                    doc_type, _, category, description = classify_sage_document(file_path.name)
+                elif dm_result['success'] and dm_result['codes']:
+                    is_personnel = True
+                    needs_review = True
+                    status = 'REVIEW_NEEDED'
+                    doc_type, _, category, description = classify_sage_document(file_path.name)
+                else:
+                    doc_type, is_personnel, category, description = classify_sage_document(file_path.name)
+                    if is_personnel:
+                        needs_review = True
+                        status = 'REVIEW_NEEDED'
+                    else:
+                        status = 'COMPANY'
+            else:
+                doc_type, is_personnel, category, description = classify_sage_document(file_path.name)
+                status = 'COMPANY' if not is_personnel else 'UNASSIGNED'
+            
+            metadata = {
+                'original_path': path_str,
+                'needs_review': needs_review,
+                'tenant_code': tenant_code,
+                'doc_type': doc_type,
+                'doc_type_description': description,
+                'is_personnel_document': is_personnel,
+                'category_code': category,
+                'month_folder': month_folder,
+            }
+            
+            if dm_result:
+                metadata['datamatrix'] = {
+                    'success': dm_result['success'],
+                    'codes_found': len(dm_result['codes']),
+                    'employee_ids': dm_result['employee_ids'],
+                }
+            
+            # DocumentType aus Sage-Klassifizierung holen oder erstellen
+            document_type_id = None
+            if doc_type and doc_type != 'UNBEKANNT':
+                document_type_id = get_document_type_id_cached(doc_type, description, category, tenant)
+            
+            # DB-Operationen in einem Block
+            period_year, period_month = parse_month_folder(month_folder)
+            document = Document(
+                tenant=tenant,
+                title=file_path.stem,
+                original_filename=file_path.name,
+                file_extension=file_path.suffix,
+                mime_type=mime_type,
+                employee=employee,
+                document_type_id=document_type_id,
+                status=status,
+                source='SAGE',
+                sha256_hash=file_hash,
+                metadata=metadata,
+                period_year=period_year,
+                period_month=period_month
+            )
+            # Content erst hier lesen (nach Split-Check): chunkweise verschlüsselt in Document.file,
+            # der Klartext liegt nie vollständig im RAM
+            with open(file_path, 'rb') as f:
+                _, document.file_size = save_encrypted_file(document.file, f, f"{document.id}.enc")
+            
+            # Document + ProcessedFile atomar in einer Transaktion (ein Commit statt zwei)
+            try:
+                with transaction.atomic():
+                    document.save()
+                    ProcessedFile.objects.create(
+                        tenant=tenant,
+                        sha256_hash=file_hash,
+                        original_path=path_str,
+                        document=document
+                    )
+            except IntegrityError:
+                # Parallel von einem anderen Worker importiert (Unique-Constraint auf tenant+Hash)
+                _delete_stored_files([document])
+                return {'success': True, 'already_processed': True}
+            except Exception:
+                _delete_stored_files([document])
+                raise
+            
+            # Hash zu known_hashes hinzufügen (Duplikate innerhalb dieses Worker-Prozesses)
+            known_hashes_by_tenant[tenant_code].add(_hash_key(file_hash))
+            
+            # Auto-Klassifizierung und Prüfaufgabe (bei REVIEW_NEEDED) laufen nach dem Scan
+            return {'success': True, 'is_personnel': is_personnel, 'needs_review': needs_review, 
+                    'filename': file_path.name, 'doc_id': str(document.id), 'tenant': tenant_code,
+                    'post_import': [(str(document.id), status == 'REVIEW_NEEDED')]}
+            
+        except Exception as e:
+            logger.error(f"Fehler bei {file_path}: {e}")
+            return {'success': False, 'error': str(e), 'filename': file_path.name}
+        finally:
+            if pdf_doc is not None:
+                pdf_doc.close()
+            # Gepufferte SystemLogs des Worker-Prozesses nicht verlieren
+            flush_system_logs()
+            # Verbindung über CONN_MAX_AGE weiterverwenden, nur defekte/abgelaufene schließen
+            db_connection.close_if_unusable_or_obsolete()
+
+
+@shared_task(bind=True, max_retries=3, autoretry_for=(OperationalError,), retry_backoff=True,
+             retry_backoff_max=600, retry_jitter=True)
+def finalize_imported_document_task(self, document_id, needs_review_task=False, source='SAGE_ARCHIVE'):
+    """
+    Wendet die Matching-Regeln auf ein importiertes Dokument an und legt bei Bedarf
+    die Prüfaufgabe an. Der Sage-Scan verschickt diese Tasks gesammelt als Celery-Group,
+    statt beides pro Datei synchron in der Import-Schleife auszuführen.
+    
+    needs_review_task wird beim Import bestimmt (Status vor der Klassifizierung).
+    """
+    try:
+        document = Document.objects.select_related('tenant').get(id=document_id)
+    except Document.DoesNotExist:
+        logger.error(f"FinalizeImportedDocument: Document {document_id} not found")
+        return None
+    
+    with tenant_context(document.tenant):
+        auto_classify_document(document, tenant=document.tenant)
+        if needs_review_task:
+            create_review_task(document, source=source)
+    
+    return document_id
+
+
+def _dispatch_post_import(post_import, source='SAGE_ARCHIVE'):
+    """Verschickt Klassifizierung/Prüfaufgaben für [(document_id, needs_review_task)] als Group."""
+    if not post_import:
+        return
+    group(
+        finalize_imported_document_task.s(document_id, needs_review_task, source)
+        for document_id, needs_review_task in post_import
+    ).apply_async()
+    log_system_event('INFO', 'SageScanner', f"Klassifizierung für {len(post_import)} Dokumente eingeplant")
+
+
 def _run_sage_scan(task_self):
     """
     Optimierte Scan-Logik nach paperless-ngx Vorbild:
@@ -931,7 +2193,6 @@ def _run_sage_scan(task_self):
     - Weniger DB-Roundtrips
     """
     from concurrent.futures import ThreadPoolExecutor, as_completed
-    import threading
     
     scan_job = ScanJob.objects.create(
         source='SAGE',
@@ -947,23 +2208,29 @@ def _run_sage_scan(task_self):
         scan_job.save(update_fields=['status'])
         return {'status': 'error', 'message': 'Path does not exist'}
     
-    supported_extensions = {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.tiff', '.txt', '.csv'}
-    skip_files = {'thumbs.db', 'desktop.ini', '.ds_store'}
-    tenant_folder_pattern = re.compile(r'^\d{8}$')
-    month_folder_pattern = re.compile(r'^\d{6}$')
+    # Frischer Mitarbeiter-Cache pro Scan; die Worker-Threads teilen ihn
+    clear_employee_lookup_cache()
     
     # Phase 1: Bekannte Pfade UND Hashes laden (schneller Lookup)
     log_system_event('INFO', 'SageScanner', "Lade bekannte Dateien aus Datenbank...")
     
-    known_paths = set(ProcessedFile.objects.values_list('original_path', flat=True))
-    known_hashes_by_tenant = {}
+    known_paths = _load_known_paths()
+    known_hashes_by_tenant = _load_known_hashes_by_tenant()
     tenant_cache = {}
     
-    for tenant in Tenant.objects.filter(is_active=True):
+    # Nur die Felder, die der Scan braucht (code, FK-Zuweisung, Logs)
+    for tenant in Tenant.objects.filter(is_active=True).only('id', 'code', 'name'):
         tenant_cache[tenant.code] = tenant
-        known_hashes_by_tenant[tenant.code] = set(
-            ProcessedFile.objects.filter(tenant=tenant).values_list('sha256_hash', flat=True)
-        )
+    
+    # Verzeichnis-mtimes des letzten Scans: unveränderte Ordner werden nicht aufgelistet
+    use_cookies = getattr(settings, 'SAGE_SCAN_DIR_COOKIES', True)
+    scan_started = timezone.now()
+    if use_cookies:
+        cookies, cookie_children = _load_scan_cookies()
+    else:
+        cookies, cookie_children = None, None
+    dir_mtimes = {}
+    failed_dirs = set()
     
     # Phase 2: Dateien sammeln - NUR PFADE, kein Hash berechnen für bekannte Pfade!
     new_file_paths = []
@@ -972,8 +2239,9 @@ def _run_sage_scan(task_self):
     scan_job.current_file = "Scanne Verzeichnis..."
     scan_job.save(update_fields=['current_file'])
     
+    tenant_folders = []
     for tenant_folder in sage_path.iterdir():
-        if not tenant_folder.is_dir() or not tenant_folder_pattern.match(tenant_folder.name):
+        if not tenant_folder.is_dir() or not _is_sage_tenant_folder(tenant_folder.name):
             continue
         
         tenant_code = tenant_folder.name
@@ -989,20 +2257,26 @@ def _run_sage_scan(task_self):
             if created:
                 log_system_event('INFO', 'SageScanner', f"Neuer Mandant erstellt: {tenant_code}")
         
-        for file_path in tenant_folder.rglob('*'):
-            if not file_path.is_file():
-                continue
-            if file_path.name.lower() in skip_files:
-                continue
-            if file_path.suffix.lower() not in supported_extensions:
-                continue
-            
-            # OPTIMIZATION: Pfad-basierter Quick-Check - KEIN Hash für bekannte Pfade!
-            path_str = str(file_path)
-            if path_str in known_paths:
-                already_processed_count += 1
-            else:
-                new_file_paths.append((file_path, tenant_code))
+        tenant_folders.append((tenant_folder, tenant_code))
+    
+    def collect_files(tenant_folder):
+        return [
+            entry.path for entry in _walk_files(os.fspath(tenant_folder), cookies, cookie_children, dir_mtimes)
+            if entry.name.lower() not in _SAGE_SKIP_FILES
+            and os.path.splitext(entry.name)[1].lower() in _SAGE_SUPPORTED_EXTENSIONS
+        ]
+    
+    # Mandantenordner parallel durchlaufen (Verzeichnis-I/O gibt den GIL frei)
+    if tenant_folders:
+        with ThreadPoolExecutor(max_workers=min(8, len(tenant_folders))) as executor:
+            folder_files = executor.map(collect_files, [folder for folder, _ in tenant_folders])
+            for (_, tenant_code), paths in zip(tenant_folders, folder_files):
+                for path_str in paths:
+                    # OPTIMIZATION: Pfad-basierter Quick-Check - KEIN Hash für bekannte Pfade!
+                    if _path_key(path_str) in known_paths:
+                        already_processed_count += 1
+                    else:
+                        new_file_paths.append((path_str, tenant_code))
     
     scan_job.total_files = len(new_file_paths)
     scan_job.skipped_files = already_processed_count
@@ -1012,319 +2286,76 @@ def _run_sage_scan(task_self):
         f"Gefunden: {len(new_file_paths)} neue Dateien, {already_processed_count} bereits verarbeitet (Pfad-Check)")
     
     if not new_file_paths:
+        if use_cookies:
+            _save_scan_cookies(dir_mtimes, failed_dirs, scan_started)
         scan_job.status = 'COMPLETED'
         scan_job.completed_at = timezone.now()
         scan_job.current_file = ''
         scan_job.save()
         return {'status': 'success', 'processed': 0, 'already_processed': already_processed_count}
     
-    # Shared counters with thread-safe lock
+    # Zähler werden im Elternprozess aus den Ergebnissen der Worker aggregiert
     processed_count = 0
     error_count = 0
     personnel_docs = 0
     company_docs = 0
-    counter_lock = threading.Lock()
-    hashes_lock = threading.Lock()  # Lock für known_hashes Modifikation
-    
-    def process_single_file(file_info):
-        """Verarbeitet eine einzelne Datei - thread-safe"""
-        nonlocal processed_count, error_count, personnel_docs, company_docs, already_processed_count
-        
-        file_path, tenant_code = file_info
-        tenant = tenant_cache[tenant_code]
-        
-        # SAAS FIX: Tenant-Kontext setzen, damit TenantAwareManager korrekt filtert
-        with tenant_context(tenant):
-            try:
-                # OPTIMIZATION: Chunked Hash ohne volle Datei in RAM
-                file_hash = calculate_sha256_chunked(str(file_path))
-                
-                # Thread-safe Hash-Check im Memory-Cache (keine verschachtelten Locks!)
-                is_known = False
-                with hashes_lock:
-                    known_hashes = known_hashes_by_tenant.get(tenant_code, set())
-                    is_known = file_hash in known_hashes
-                
-                if is_known:
-                    with counter_lock:
-                        already_processed_count += 1
-                    return None
-                
-                # DB-Level Duplikat-Prüfung (race condition safety)
-                if ProcessedFile.objects.filter(tenant=tenant, sha256_hash=file_hash).exists():
-                    with counter_lock:
-                        already_processed_count += 1
-                    return None
-                
-                # Monatsordner extrahieren (vor Content-Laden für Split-Check)
-                month_folder = None
-                try:
-                    tenant_folder = sage_path / tenant_code
-                    relative_path = file_path.relative_to(tenant_folder)
-                    path_parts = relative_path.parts
-                    if len(path_parts) >= 2 and month_folder_pattern.match(path_parts[0]):
-                        month_folder = path_parts[0]
-                except ValueError:
-                    pass
-                
-                mime_type = get_mime_type(str(file_path))
-                
-                employee = None
-                status = 'UNASSIGNED'
-                needs_review = False
-                dm_result = None
-                is_personnel = False
-                doc_type = 'UNBEKANNT'
-                category = None
-                description = 'Unbekanntes Dokument'
-                
-                if file_path.suffix.lower() == '.pdf':
-                    import fitz
-                    try:
-                        pdf_doc = fitz.open(str(file_path))
-                        page_count = len(pdf_doc)
-                        pdf_doc.close()
-                    except:
-                        page_count = 1
-                    
-                    if page_count > 1:
-                        doc_type, is_personnel_type, _, _ = classify_sage_document(file_path.name)
-                        if is_personnel_type:
-                            split_output_dir = Path(settings.BASE_DIR) / 'data' / 'split_temp' / tenant_code
-                            split_results = split_pdf_by_datamatrix(str(file_path), str(split_output_dir))
-                            
-                            if split_results and len(split_results) > 1:
-                                log_system_event('INFO', 'SageScanner', 
-                                    f"PDF aufgeteilt: {file_path.name} → {len(split_results)} Dokumente")
-                                
-                                split_docs_created = []
-                                for split_info in split_results:
-                                    split_path = Path(split_info['file_path'])
-                                    emp_id = split_info['employee_id']
-                                    mandant_code_dm = split_info.get('mandant_code')
-                                    
-                                    with open(split_path, 'rb') as sf:
-                                        split_content = sf.read()
-                                    split_encrypted = encrypt_data(split_content)
-                                    split_hash = calculate_sha256_chunked(str(split_path))
-                                    split_size = len(split_content)
-                                    
-                                    split_employee = find_employee_by_id(emp_id, tenant=tenant, mandant_code=mandant_code_dm)
-                                    split_status = 'ASSIGNED' if split_employee else 'REVIEW_NEEDED'
-                                    
-                                    doc_type_split, _, category_split, desc_split = classify_sage_document(file_path.name)
-                                    
-                                    split_metadata = {
-                                        'original_path': str(file_path),
-                                        'split_from': file_path.name,
-                                        'employee_id_from_datamatrix': emp_id,
-                                        'pages_in_split': split_info['page_count'],
-                                        'tenant_code': tenant_code,
-                                        'doc_type': doc_type_split,
-                                        'is_personnel_document': True,
-                                        'month_folder': month_folder,
-                                    }
-                                    
-                                    period_year, period_month = parse_month_folder(month_folder)
-                                    split_doc = Document.objects.create(
-                                        tenant=tenant,
-                                        title=split_path.stem,
-                                        original_filename=split_path.name,
-                                        file_extension='.pdf',
-                                        mime_type='application/pdf',
-                                        encrypted_content=split_encrypted,
-                                        file_size=split_size,
-                                        employee=split_employee,
-                                        status=split_status,
-                                        source='SAGE',
-                                        sha256_hash=split_hash,
-                                        metadata=split_metadata,
-                                        period_year=period_year,
-                                        period_month=period_month
-                                    )
-                                    
-                                    auto_classify_document(split_doc, tenant=tenant)
-                                    
-                                    if split_status == 'REVIEW_NEEDED':
-                                        create_review_task(split_doc, source='SAGE_ARCHIVE')
-                                    
-                                    split_docs_created.append(str(split_doc.id))
-                                    
-                                    del split_content
-                                    del split_encrypted
-                                    
-                                    try:
-                                        split_path.unlink()
-                                    except:
-                                        pass
-                                
-                                ProcessedFile.objects.create(
-                                    tenant=tenant,
-                                    sha256_hash=file_hash,
-                                    original_path=str(file_path),
-                                    document=None
-                                )
-                                
-                                with hashes_lock:
-                                    if tenant_code not in known_hashes_by_tenant:
-                                        known_hashes_by_tenant[tenant_code] = set()
-                                    known_hashes_by_tenant[tenant_code].add(file_hash)
-                                
-                                with counter_lock:
-                                    processed_count += len(split_results)
-                                    personnel_docs += len(split_results)
-                                
-                                return {'success': True, 'split': True, 'split_count': len(split_results),
-                                        'filename': file_path.name, 'doc_ids': split_docs_created, 'tenant': tenant_code}
-                    
-                    dm_result = extract_employee_from_datamatrix(str(file_path))
-                    dm_mandant_code = dm_result.get('mandant_code')
-                    
-                    if dm_result['success'] and dm_result['employee_ids']:
-                        is_personnel = True
-                        for emp_id in dm_result['employee_ids']:
-                            employee = find_employee_by_id(emp_id, tenant=tenant, mandant_code=dm_mandant_code)
-                            if employee:
-                                status = 'ASSIGNED'
-                                break
-                        
-                        if not employee:
-                            needs_review = True
-                            status = 'REVIEW_NEEDED'
-                        
-                        doc_type, _, category, description = classify_sage_document(file_path.name)
-                    elif dm_result['success'] and dm_result['codes']:
-                        is_personnel = True
-                        needs_review = True
-                        status = 'REVIEW_NEEDED'
-                        doc_type, _, category, description = classify_sage_document(file_path.name)
-                    else:
-                        doc_type, is_personnel, category, description = classify_sage_document(file_path.name)
-                        if is_personnel:
-                            needs_review = True
-                            status = 'REVIEW_NEEDED'
-                        else:
-                            status = 'COMPANY'
-                else:
-                    doc_type, is_personnel, category, description = classify_sage_document(file_path.name)
-                    status = 'COMPANY' if not is_personnel else 'UNASSIGNED'
-                
-                # Content erst hier laden (nach Split-Check für Memory-Optimierung)
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                encrypted_content = encrypt_data(content)
-                file_size = len(content)
-                
-                metadata = {
-                    'original_path': str(file_path),
-                    'needs_review': needs_review,
-                    'tenant_code': tenant_code,
-                    'doc_type': doc_type,
-                    'doc_type_description': description,
-                    'is_personnel_document': is_personnel,
-                    'category_code': category,
-                    'month_folder': month_folder,
-                }
-                
-                if dm_result:
-                    metadata['datamatrix'] = {
-                        'success': dm_result['success'],
-                        'codes_found': len(dm_result['codes']),
-                        'employee_ids': dm_result['employee_ids'],
-                    }
-                
-                # DocumentType aus Sage-Klassifizierung holen oder erstellen
-                document_type_obj = None
-                if doc_type and doc_type != 'UNBEKANNT':
-                    document_type_obj = get_or_create_document_type(doc_type, description, category, tenant)
-                
-                # DB-Operationen in einem Block
-                period_year, period_month = parse_month_folder(month_folder)
-                document = Document.objects.create(
-                    tenant=tenant,
-                    title=file_path.stem,
-                    original_filename=file_path.name,
-                    file_extension=file_path.suffix,
-                    mime_type=mime_type,
-                    encrypted_content=encrypted_content,
-                    file_size=file_size,
-                    employee=employee,
-                    document_type=document_type_obj,
-                    status=status,
-                    source='SAGE',
-                    sha256_hash=file_hash,
-                    metadata=metadata,
-                    period_year=period_year,
-                    period_month=period_month
-                )
-                
-                ProcessedFile.objects.create(
-                    tenant=tenant,
-                    sha256_hash=file_hash,
-                    original_path=str(file_path),
-                    document=document
-                )
-                
-                # Auto-Klassifizierung anhand Matching-Regeln
-                auto_classify_document(document, tenant=tenant)
-                
-                # Aufgabe erstellen bei REVIEW_NEEDED
-                if status == 'REVIEW_NEEDED':
-                    create_review_task(document, source='SAGE_ARCHIVE')
-                
-                # Speicher freigeben
-                del content
-                del encrypted_content
-                
-                # Hash zu known_hashes hinzufügen für Duplikat-Check (thread-safe)
-                with hashes_lock:
-                    if tenant_code not in known_hashes_by_tenant:
-                        known_hashes_by_tenant[tenant_code] = set()
-                    known_hashes_by_tenant[tenant_code].add(file_hash)
-                
-                with counter_lock:
-                    processed_count += 1
-                    if is_personnel:
-                        personnel_docs += 1
-                    else:
-                        company_docs += 1
-                
-                return {'success': True, 'is_personnel': is_personnel, 'needs_review': needs_review, 
-                        'filename': file_path.name, 'doc_id': str(document.id), 'tenant': tenant_code}
-                
-            except Exception as e:
-                with counter_lock:
-                    error_count += 1
-                logger.error(f"Fehler bei {file_path}: {e}")
-                return {'success': False, 'error': str(e), 'filename': file_path.name}
     
     # Phase 3: Parallele Verarbeitung mit ThreadPoolExecutor
-    # PAPERLESS-NGX Style: max 4 Workers, begrenzt durch CPU-Cores
-    import os
+    # Kein Prozess-Pool: Celery-Prefork-Kinder sind daemonisch und dürfen nicht forken.
+    # Datei-I/O, Hashing und libdmtx geben den GIL frei; große Sammel-PDFs scannt
+    # split_pdf_by_datamatrix zusätzlich auf dem billiard-Pool des Workers.
+    # PAPERLESS-NGX Style: max 4 Worker, begrenzt durch CPU-Cores
     max_workers = min(4, max(1, os.cpu_count() or 2))
     
     log_system_event('INFO', 'SageScanner', f"Starte parallele Verarbeitung mit {max_workers} Threads")
     
+    _sage_scan_state.update({
+        'sage_path': sage_path,
+        'tenant_cache': tenant_cache,
+        'known_hashes_by_tenant': known_hashes_by_tenant,
+    })
+    
+    # (document_id, needs_review_task) der neuen Dokumente - Klassifizierung folgt nach dem Scan
+    post_import = []
+    
     try:
         # Progress-Updates alle 10 Dateien statt bei jeder Datei
         update_interval = 10
         files_since_update = 0
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_single_file, f): f for f in new_file_paths}
+            futures = {executor.submit(_process_sage_file_in_thread, f): f for f in new_file_paths}
             
             for future in as_completed(futures):
                 result = future.result()
                 files_since_update += 1
+                post_import.extend(result.get('post_import', ()))
+                
+                if not result['success']:
+                    error_count += 1
+                    # Ordner beim nächsten Scan erneut auflisten, damit die Datei wiederholt wird
+                    failed_dirs.add(os.path.dirname(futures[future][0]))
+                elif result.get('already_processed'):
+                    already_processed_count += 1
+                elif result.get('split'):
+                    processed_count += result['split_count']
+                    personnel_docs += result['split_count']
+                else:
+                    processed_count += 1
+                    if result['is_personnel']:
+                        personnel_docs += 1
+                    else:
+                        company_docs += 1
                 
-                # Fortschritt nur alle X Dateien aktualisieren (weniger DB-Writes)
+                # Fortschritt nur alle X Dateien aktualisieren (Redis, kein DB-Write)
                 if files_since_update >= update_interval:
-                    scan_job.processed_files = processed_count
-                    scan_job.error_files = error_count
-                    scan_job.skipped_files = already_processed_count
-                    if result and result.get('filename'):
-                        scan_job.current_file = result['filename'][:100]
-                    scan_job.save(update_fields=['processed_files', 'error_files', 'skipped_files', 'current_file'])
+                    publish_scan_progress(
+                        scan_job,
+                        processed_files=processed_count,
+                        error_files=error_count,
+                        skipped_files=already_processed_count,
+                        current_file=(result.get('filename') or scan_job.current_file)[:100],
+                    )
                     files_since_update = 0
                 
                 # Logging für Review-Fälle
@@ -1333,6 +2364,9 @@ def _run_sage_scan(task_self):
                         f"File requires review: {result['filename']}",
                         {'document_id': result.get('doc_id'), 'tenant': result.get('tenant')})
         
+        if use_cookies:
+            _save_scan_cookies(dir_mtimes, failed_dirs, scan_started)
+        
         scan_job.status = 'COMPLETED'
         scan_job.completed_at = timezone.now()
         scan_job.processed_files = processed_count
@@ -1361,43 +2395,66 @@ def _run_sage_scan(task_self):
         scan_job.save()
         log_system_event('CRITICAL', 'SageScanner', f"Sage scan failed: {str(e)}")
         raise task_self.retry(exc=e, countdown=60)
+    finally:
+        _sage_scan_state.clear()
+        # Auch bei Abbruch: bereits importierte Dokumente klassifizieren
+        _dispatch_post_import(post_import)
 
 
 # NOTE: scan_manual_input task removed - SaaS uses API ingest instead of local file scanning
 
 
-def _run_sage_scan_azure(task_self):
+# Ein laufender Azure-Scan (Chord noch nicht abgeschlossen) gilt nach dieser Zeit als verwaist;
+# so lange hält der Chord auch den Scanner-Lock
+AZURE_SCAN_STALE_AFTER = timedelta(hours=2)
+
+
+def _run_sage_scan_azure(task_self, system_settings=None, lock=None):
     """
     Azure Blob Storage version of Sage archive scan.
     
     Reads documents from Azure Blob Storage container with structure:
     sage-archive/{tenant_code}/{YYYYMM}/{filename}
     
-    Downloads each blob to temp file for processing, then cleans up.
-    """
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    import threading
-    import os as os_module
-    import tempfile
+    Each new blob is downloaded and processed by a process_sage_azure_blob_task
+    subtask. This task only lists, filters and dispatches them as a chord and returns
+    immediately; finalize_sage_azure_scan_task aggregates the results.
     
+    The scanner lock (LockHandle from distributed_lock) is handed over to the chord:
+    finalize_sage_azure_scan_task or, if the chord fails, abort_sage_azure_scan_task
+    releases it.
+    """
     from dms.azure_storage import (
         list_sage_archive_blobs, 
-        download_blob_to_tempfile, 
+        get_container_client,
         parse_sage_blob_path
     )
     
+    # The chord holds the scanner lock until its callback; this check additionally covers
+    # scans started while Redis was unavailable (no lock at all)
+    in_flight = ScanJob.objects.filter(
+        source='SAGE', status='RUNNING',
+        started_at__gte=timezone.now() - AZURE_SCAN_STALE_AFTER,
+    ).exists()
+    if in_flight:
+        log_system_event('INFO', 'SageScanner', "Azure Scan übersprungen - vorheriger Scan läuft noch")
+        return {'status': 'skipped', 'message': 'Previous Azure scan still running'}
+    
     scan_job = ScanJob.objects.create(
         source='SAGE',
         status='RUNNING',
         total_files=0
     )
     
+    # Container-Client für das Listing; die Blob-Subtasks nutzen ihren eigenen pro Worker
+    container = get_container_client(system_settings=system_settings)
+    
     # Phase 1: List all blobs in sage-archive/
     log_system_event('INFO', 'SageScanner', "Liste Azure Blobs in sage-archive/...")
     
     all_blobs = []
     try:
-        for blob_name, blob_size in list_sage_archive_blobs():
+        for blob_name, blob_size in list_sage_archive_blobs(container=container):
             all_blobs.append((blob_name, blob_size))
     except Exception as e:
         log_system_event('ERROR', 'SageScanner', f"Fehler beim Lesen von Azure Blob Storage: {e}")
@@ -1415,22 +2472,13 @@ def _run_sage_scan_azure(task_self):
     
     log_system_event('INFO', 'SageScanner', f"Gefunden: {len(all_blobs)} Blobs in Azure")
     
-    supported_extensions = {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.tiff', '.txt', '.csv'}
-    skip_files = {'thumbs.db', 'desktop.ini', '.ds_store'}
-    tenant_folder_pattern = re.compile(r'^\d{8}$')
-    month_folder_pattern = re.compile(r'^\d{6}$')
-    
-    # Phase 2: Load known paths and hashes
-    known_paths = set(ProcessedFile.objects.values_list('original_path', flat=True))
-    known_hashes_by_tenant = {}
+    # Phase 2: Load known paths (hashes are checked per blob by the subtasks)
+    known_paths = _load_known_paths()
     tenant_cache = {}
     
-    for tenant in Tenant.objects.filter(is_active=True):
+    for tenant in Tenant.objects.filter(is_active=True).only('id', 'code', 'name'):
         if tenant.code:
             tenant_cache[tenant.code] = tenant
-            known_hashes_by_tenant[tenant.code] = set(
-                ProcessedFile.objects.filter(tenant=tenant).values_list('sha256_hash', flat=True)
-            )
     
     # Filter and prepare blobs for processing
     new_blobs = []
@@ -1442,18 +2490,18 @@ def _run_sage_scan_azure(task_self):
         if not tenant_code or not filename:
             continue
         
-        if not tenant_folder_pattern.match(tenant_code):
+        if not _is_sage_tenant_folder(tenant_code):
             continue
         
-        if filename.lower() in skip_files:
+        if filename.lower() in _SAGE_SKIP_FILES:
             continue
         
         suffix = Path(filename).suffix.lower()
-        if suffix not in supported_extensions:
+        if suffix not in _SAGE_SUPPORTED_EXTENSIONS:
             continue
         
         # Path-based quick check
-        if blob_name in known_paths:
+        if _path_key(blob_name) in known_paths:
             already_processed_count += 1
             continue
         
@@ -1464,7 +2512,6 @@ def _run_sage_scan_azure(task_self):
                 defaults={'name': f'Mandant {tenant_code}', 'is_active': True}
             )
             tenant_cache[tenant_code] = tenant
-            known_hashes_by_tenant[tenant_code] = set()
             if created:
                 log_system_event('INFO', 'SageScanner', f"Neuer Mandant erstellt: {tenant_code}")
         
@@ -1481,251 +2528,328 @@ def _run_sage_scan_azure(task_self):
         scan_job.status = 'COMPLETED'
         scan_job.completed_at = timezone.now()
         scan_job.save()
-        return {'status': 'success', 'processed': 0, 'already_processed': already_processed_count}
+        return {'status': 'success', 'processed': 0, 'already_processed': already_processed_count}
+    
+    # Phase 3: Blobs als Celery-Chord auf alle Worker verteilen. Jeder Worker holt sich
+    # über seinen Prefetch-Puffer neue Blobs nach (skaliert auch über mehrere Hosts).
+    # Der Scan-Task wartet nicht auf die Subtasks - sonst belegt er bei
+    # --concurrency=1 den einzigen Worker-Slot und die Blobs laufen nie.
+    log_system_event('INFO', 'SageScanner', f"Verteile {len(new_blobs)} Blobs auf die Celery-Worker")
+    
+    publish_scan_progress(scan_job, processed_files=0, current_file=f"0/{len(new_blobs)} Blobs verarbeitet")
+    
+    # Keep the lock for the lifetime of the chord instead of the 30 minute scanner TTL
+    lock_value = None
+    if lock:
+        lock.extend(int(AZURE_SCAN_STALE_AFTER.total_seconds()))
+        lock_value = lock.value
+    
+    try:
+        callback = finalize_sage_azure_scan_task.s(scan_job.pk, already_processed_count, lock_value)
+        callback.on_error(abort_sage_azure_scan_task.s(scan_job.pk, lock_value))
+        chord(
+            process_sage_azure_blob_task.s(blob_name, tenant_code, month_folder, filename, scan_job.pk)
+            for blob_name, _, tenant_code, month_folder, filename in new_blobs
+        )(callback)
+    except Exception as e:
+        scan_job.status = 'FAILED'
+        scan_job.error_message = str(e)
+        scan_job.completed_at = timezone.now()
+        scan_job.save()
+        log_system_event('CRITICAL', 'SageScanner', f"Azure Sage scan failed: {str(e)}")
+        raise task_self.retry(exc=e, countdown=60)
+    
+    if lock:
+        lock.hand_over()
+    
+    return {
+        'status': 'dispatched',
+        'source': 'azure',
+        'scan_job_id': scan_job.pk,
+        'blobs': len(new_blobs),
+        'already_processed': already_processed_count,
+    }
+
+
+@shared_task
+def abort_sage_azure_scan_task(request, exc, traceback, scan_job_id, lock_value=None):
+    """
+    Error callback of the _run_sage_scan_azure chord: marks the ScanJob as failed and
+    releases the scanner lock handed over to the chord.
+    """
+    ScanJob.objects.filter(pk=scan_job_id, status='RUNNING').update(
+        status='FAILED', error_message=str(exc), completed_at=timezone.now())
+    log_system_event('ERROR', 'SageScanner', f"Azure Scan abgebrochen: {exc}")
+    release_distributed_lock('sage_scanner', lock_value)
+
+
+@shared_task(bind=True)
+def finalize_sage_azure_scan_task(self, results, scan_job_id, already_processed_count=0, lock_value=None):
+    """
+    Chord callback of _run_sage_scan_azure: aggregates the blob results into the
+    ScanJob, dispatches classification of the imported documents and releases the
+    scanner lock handed over by the scan task.
+    """
+    try:
+        return _finalize_sage_azure_scan(results, scan_job_id, already_processed_count)
+    finally:
+        release_distributed_lock('sage_scanner', lock_value)
+
+
+def _finalize_sage_azure_scan(results, scan_job_id, already_processed_count):
+    scan_job = ScanJob.objects.filter(pk=scan_job_id).first()
     
-    # Shared counters
     processed_count = 0
     error_count = 0
     personnel_docs = 0
     company_docs = 0
-    counter_lock = threading.Lock()
-    hashes_lock = threading.Lock()
+    post_import = []
     
-    def process_azure_blob(blob_info):
-        """Process a single blob from Azure."""
-        nonlocal processed_count, error_count, personnel_docs, company_docs, already_processed_count
-        
-        blob_name, blob_size, tenant_code, month_folder, filename = blob_info
-        tenant = tenant_cache[tenant_code]
-        temp_file = None
-        
-        with tenant_context(tenant):
-            try:
-                # Download blob to temp file
-                suffix = Path(filename).suffix
-                temp_file = download_blob_to_tempfile(blob_name, suffix=suffix)
-                
-                if not temp_file:
-                    with counter_lock:
-                        error_count += 1
-                    return {'success': False, 'error': 'Download failed', 'filename': filename}
-                
-                file_path = Path(temp_file)
-                
-                # Calculate hash
-                file_hash = calculate_sha256_chunked(str(file_path))
-                
-                # Thread-safe hash check
-                is_known = False
-                with hashes_lock:
-                    known_hashes = known_hashes_by_tenant.get(tenant_code, set())
-                    is_known = file_hash in known_hashes
-                
-                if is_known:
-                    with counter_lock:
-                        already_processed_count += 1
-                    return None
-                
-                # DB-level duplicate check
-                if ProcessedFile.objects.filter(tenant=tenant, sha256_hash=file_hash).exists():
-                    with counter_lock:
-                        already_processed_count += 1
-                    return None
-                
-                mime_type = get_mime_type(str(file_path))
+    for result in results:
+        if not result or not result.get('success'):
+            error_count += 1
+        elif result.get('already_processed'):
+            already_processed_count += 1
+        else:
+            processed_count += 1
+            if result['is_personnel']:
+                personnel_docs += 1
+            else:
+                company_docs += 1
+            post_import.extend(result.get('post_import', ()))
+            
+            if result.get('needs_review'):
+                log_system_event('WARNING', 'SageScanner',
+                    f"File requires review: {result['filename']}",
+                    {'document_id': result.get('doc_id'), 'tenant': result.get('tenant')})
+    
+    _dispatch_post_import(post_import)
+    
+    if scan_job is not None:
+        scan_job.status = 'COMPLETED'
+        scan_job.completed_at = timezone.now()
+        scan_job.processed_files = processed_count
+        scan_job.error_files = error_count
+        scan_job.skipped_files = already_processed_count
+        scan_job.current_file = ''
+        scan_job.save()
+    
+    log_system_event('INFO', 'SageScanner',
+        f"Azure Scan abgeschlossen: {processed_count} neu verarbeitet, "
+        f"{already_processed_count} bereits vorhanden, {error_count} Fehler")
+    
+    return {
+        'status': 'success',
+        'source': 'azure',
+        'processed': processed_count,
+        'personnel_documents': personnel_docs,
+        'company_documents': company_docs,
+        'already_processed': already_processed_count,
+        'errors': error_count
+    }
+
+
+def _process_sage_azure_blob(blob_name, tenant, month_folder, filename, container):
+    """
+    Process a single blob from sage-archive/ (download, hash, DataMatrix, encryption, insert).
+    Must run inside tenant_context(tenant).
+    
+    Returns: result dict like _process_sage_file
+    """
+    from dms.azure_storage import download_blob_to_tempfile
+    
+    tenant_code = tenant.code
+    temp_file = None
+    
+    try:
+        # Download blob to temp file
+        suffix = Path(filename).suffix
+        temp_file = download_blob_to_tempfile(blob_name, suffix=suffix, container=container)
+        
+        if not temp_file:
+            return {'success': False, 'error': 'Download failed', 'filename': filename}
+        
+        file_path = Path(temp_file)
+        
+        # Calculate hash
+        file_hash = calculate_sha256_chunked(str(file_path))
+        
+        # Indexed lookup before the expensive part (DataMatrix, encryption); concurrent
+        # duplicates are still caught by the (tenant, sha256_hash) unique constraint below
+        if ProcessedFile.objects.filter(tenant=tenant, sha256_hash=file_hash).exists():
+            return {'success': True, 'already_processed': True, 'filename': filename}
+        
+        mime_type = get_mime_type(str(file_path))
+        
+        # Document classification
+        employee = None
+        status = 'UNASSIGNED'
+        needs_review = False
+        is_personnel = False
+        doc_type = 'UNBEKANNT'
+        category = None
+        description = 'Unbekanntes Dokument'
+        dm_result = None
+        
+        if suffix.lower() == '.pdf':
+            dm_result = extract_employee_from_datamatrix(str(file_path))
+            dm_mandant_code = dm_result.get('mandant_code')
+            
+            if dm_result['success'] and dm_result['employee_ids']:
+                is_personnel = True
+                # Pro-ID-Cache: dieselben Mitarbeiter tauchen in einem Monatsordner mehrfach auf
+                employee = next(filter(None, (
+                    find_employee_by_id(e, tenant=tenant, mandant_code=dm_mandant_code)
+                    for e in dm_result['employee_ids']
+                )), None)
+                if employee:
+                    status = 'ASSIGNED'
                 
-                # Document classification
-                employee = None
-                status = 'UNASSIGNED'
-                needs_review = False
-                is_personnel = False
-                doc_type = 'UNBEKANNT'
-                category = None
-                description = 'Unbekanntes Dokument'
-                dm_result = None
+                if not employee:
+                    needs_review = True
+                    status = 'REVIEW_NEEDED'
                 
-                if suffix.lower() == '.pdf':
-                    dm_result = extract_employee_from_datamatrix(str(file_path))
-                    dm_mandant_code = dm_result.get('mandant_code')
-                    
-                    if dm_result['success'] and dm_result['employee_ids']:
-                        is_personnel = True
-                        for emp_id in dm_result['employee_ids']:
-                            employee = find_employee_by_id(emp_id, tenant=tenant, mandant_code=dm_mandant_code)
-                            if employee:
-                                status = 'ASSIGNED'
-                                break
-                        
-                        if not employee:
-                            needs_review = True
-                            status = 'REVIEW_NEEDED'
-                        
-                        doc_type, _, category, description = classify_sage_document(filename)
-                    elif dm_result['success'] and dm_result['codes']:
-                        is_personnel = True
-                        needs_review = True
-                        status = 'REVIEW_NEEDED'
-                        doc_type, _, category, description = classify_sage_document(filename)
-                    else:
-                        doc_type, is_personnel, category, description = classify_sage_document(filename)
-                        if is_personnel:
-                            needs_review = True
-                            status = 'REVIEW_NEEDED'
-                        else:
-                            status = 'COMPANY'
+                doc_type, _, category, description = classify_sage_document(filename)
+            elif dm_result['success'] and dm_result['codes']:
+                is_personnel = True
+                needs_review = True
+                status = 'REVIEW_NEEDED'
+                doc_type, _, category, description = classify_sage_document(filename)
+            else:
+                doc_type, is_personnel, category, description = classify_sage_document(filename)
+                if is_personnel:
+                    needs_review = True
+                    status = 'REVIEW_NEEDED'
                 else:
-                    doc_type, is_personnel, category, description = classify_sage_document(filename)
-                    status = 'COMPANY' if not is_personnel else 'UNASSIGNED'
-                
-                # Read and encrypt content
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                encrypted_content = encrypt_data(content)
-                file_size = len(content)
-                
-                metadata = {
-                    'original_path': blob_name,
-                    'azure_blob': True,
-                    'needs_review': needs_review,
-                    'tenant_code': tenant_code,
-                    'doc_type': doc_type,
-                    'doc_type_description': description,
-                    'is_personnel_document': is_personnel,
-                    'category_code': category,
-                    'month_folder': month_folder,
-                }
-                
-                if dm_result:
-                    metadata['datamatrix'] = {
-                        'success': dm_result['success'],
-                        'codes_found': len(dm_result['codes']),
-                        'employee_ids': dm_result['employee_ids'],
-                    }
-                
-                document_type_obj = None
-                if doc_type and doc_type != 'UNBEKANNT':
-                    document_type_obj = get_or_create_document_type(doc_type, description, category, tenant)
-                
-                period_year, period_month = parse_month_folder(month_folder)
-                document = Document.objects.create(
-                    tenant=tenant,
-                    title=Path(filename).stem,
-                    original_filename=filename,
-                    file_extension=suffix,
-                    mime_type=mime_type,
-                    encrypted_content=encrypted_content,
-                    file_size=file_size,
-                    employee=employee,
-                    document_type=document_type_obj,
-                    status=status,
-                    source='SAGE',
-                    sha256_hash=file_hash,
-                    metadata=metadata,
-                    period_year=period_year,
-                    period_month=period_month
-                )
-                
+                    status = 'COMPANY'
+        else:
+            doc_type, is_personnel, category, description = classify_sage_document(filename)
+            status = 'COMPANY' if not is_personnel else 'UNASSIGNED'
+        
+        metadata = {
+            'original_path': blob_name,
+            'azure_blob': True,
+            'needs_review': needs_review,
+            'tenant_code': tenant_code,
+            'doc_type': doc_type,
+            'doc_type_description': description,
+            'is_personnel_document': is_personnel,
+            'category_code': category,
+            'month_folder': month_folder,
+        }
+        
+        if dm_result:
+            metadata['datamatrix'] = {
+                'success': dm_result['success'],
+                'codes_found': len(dm_result['codes']),
+                'employee_ids': dm_result['employee_ids'],
+            }
+        
+        document_type_id = None
+        if doc_type and doc_type != 'UNBEKANNT':
+            document_type_id = get_document_type_id_cached(doc_type, description, category, tenant)
+        
+        period_year, period_month = parse_month_folder(month_folder)
+        document = Document(
+            tenant=tenant,
+            title=Path(filename).stem,
+            original_filename=filename,
+            file_extension=suffix,
+            mime_type=mime_type,
+            employee=employee,
+            document_type_id=document_type_id,
+            status=status,
+            source='SAGE',
+            sha256_hash=file_hash,
+            metadata=metadata,
+            period_year=period_year,
+            period_month=period_month
+        )
+        # Encrypt the temp file chunk by chunk into Document.file
+        with open(file_path, 'rb') as f:
+            _, document.file_size = save_encrypted_file(document.file, f, f"{document.id}.enc")
+        
+        # Document + ProcessedFile atomar in einer Transaktion (ein Commit statt zwei)
+        try:
+            with transaction.atomic():
+                document.save()
                 ProcessedFile.objects.create(
                     tenant=tenant,
                     sha256_hash=file_hash,
                     original_path=blob_name,
                     document=document
                 )
-                
-                auto_classify_document(document, tenant=tenant)
-                
-                if status == 'REVIEW_NEEDED':
-                    create_review_task(document, source='SAGE_ARCHIVE')
-                
-                del content
-                del encrypted_content
-                
-                with hashes_lock:
-                    if tenant_code not in known_hashes_by_tenant:
-                        known_hashes_by_tenant[tenant_code] = set()
-                    known_hashes_by_tenant[tenant_code].add(file_hash)
-                
-                with counter_lock:
-                    processed_count += 1
-                    if is_personnel:
-                        personnel_docs += 1
-                    else:
-                        company_docs += 1
-                
-                return {'success': True, 'is_personnel': is_personnel, 'needs_review': needs_review,
-                        'filename': filename, 'doc_id': str(document.id), 'tenant': tenant_code}
-                
-            except Exception as e:
-                with counter_lock:
-                    error_count += 1
-                logger.error(f"Fehler bei Azure Blob {blob_name}: {e}")
-                return {'success': False, 'error': str(e), 'filename': filename}
-            finally:
-                # Clean up temp file
-                if temp_file and os_module.path.exists(temp_file):
-                    try:
-                        os_module.unlink(temp_file)
-                    except:
-                        pass
-    
-    # Phase 3: Parallel processing
-    max_workers = min(4, max(1, os_module.cpu_count() or 2))
-    log_system_event('INFO', 'SageScanner', f"Starte Azure-Verarbeitung mit {max_workers} Threads")
-    
-    try:
-        update_interval = 10
-        files_since_update = 0
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_azure_blob, b): b for b in new_blobs}
-            
-            for future in as_completed(futures):
-                result = future.result()
-                files_since_update += 1
-                
-                if files_since_update >= update_interval:
-                    scan_job.processed_files = processed_count
-                    scan_job.error_files = error_count
-                    scan_job.skipped_files = already_processed_count
-                    if result and result.get('filename'):
-                        scan_job.current_file = result['filename'][:100]
-                    scan_job.save(update_fields=['processed_files', 'error_files', 'skipped_files', 'current_file'])
-                    files_since_update = 0
-                
-                if result and result.get('needs_review'):
-                    log_system_event('WARNING', 'SageScanner',
-                        f"File requires review: {result['filename']}",
-                        {'document_id': result.get('doc_id'), 'tenant': result.get('tenant')})
+        except IntegrityError:
+            # Parallel importiert (Unique-Constraint auf tenant+Hash)
+            _delete_stored_files([document])
+            return {'success': True, 'already_processed': True, 'filename': filename}
+        except Exception:
+            _delete_stored_files([document])
+            raise
         
-        scan_job.status = 'COMPLETED'
-        scan_job.completed_at = timezone.now()
-        scan_job.processed_files = processed_count
-        scan_job.error_files = error_count
-        scan_job.skipped_files = already_processed_count
-        scan_job.current_file = ''
-        scan_job.save()
+        return {'success': True, 'is_personnel': is_personnel, 'needs_review': needs_review,
+                'filename': filename, 'doc_id': str(document.id), 'tenant': tenant_code,
+                'post_import': [(str(document.id), status == 'REVIEW_NEEDED')]}
         
-        log_system_event('INFO', 'SageScanner',
-            f"Azure Scan abgeschlossen: {processed_count} neu verarbeitet, "
-            f"{already_processed_count} bereits vorhanden, {error_count} Fehler")
+    except Exception as e:
+        logger.error(f"Fehler bei Azure Blob {blob_name}: {e}")
+        return {'success': False, 'error': str(e), 'filename': filename}
+    finally:
+        # Clean up temp file
+        if temp_file and os.path.exists(temp_file):
+            try:
+                os.unlink(temp_file)
+            except:
+                pass
+
+
+_sage_container = None
+_sage_container_key = None
+
+
+def _get_sage_container():
+    """
+    Container-Client pro Worker-Prozess wiederverwenden, damit die HTTP-Verbindungen
+    zwischen den Blob-Subtasks offen bleiben. Neu aufgebaut nach Fork oder geänderter
+    Verbindung in den SystemSettings.
+    """
+    global _sage_container, _sage_container_key
+    from dms.models import SystemSettings
+    from dms.azure_storage import get_container_client
+    
+    system_settings = SystemSettings.load()
+    connection = system_settings.azure_storage_connection_string_encrypted
+    key = (os.getpid(), bytes(connection) if connection else None, system_settings.azure_storage_container_name)
+    if _sage_container is None or _sage_container_key != key:
+        _sage_container = get_container_client(system_settings=system_settings)
+        _sage_container_key = key
+    return _sage_container
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_sage_azure_blob_task(self, blob_name, tenant_code, month_folder, filename, scan_job_id=None):
+    """
+    Process a single Sage blob. _run_sage_scan_azure fans the blobs out as a Celery
+    chord; acks_late + reject_on_worker_lost re-queue a blob if its worker dies.
+    Never raises, so the chord callback always runs.
+    """
+    try:
+        tenant = Tenant.objects.filter(code=tenant_code).only('id', 'code', 'name').first()
+        if tenant is None:
+            return {'success': False, 'error': f'Mandant {tenant_code} nicht gefunden', 'filename': filename}
         
-        return {
-            'status': 'success',
-            'source': 'azure',
-            'processed': processed_count,
-            'personnel_documents': personnel_docs,
-            'company_documents': company_docs,
-            'already_processed': already_processed_count,
-            'errors': error_count
-        }
+        container = _get_sage_container()
+        if container is None:
+            return {'success': False, 'error': 'Azure Blob Storage nicht konfiguriert', 'filename': filename}
         
+        with tenant_context(tenant):
+            return _process_sage_azure_blob(blob_name, tenant, month_folder, filename, container)
     except Exception as e:
-        scan_job.status = 'FAILED'
-        scan_job.error_message = str(e)
-        scan_job.completed_at = timezone.now()
-        scan_job.save()
-        log_system_event('CRITICAL', 'SageScanner', f"Azure Sage scan failed: {str(e)}")
-        raise task_self.retry(exc=e, countdown=60)
+        log_system_event('ERROR', 'SageScanner', f"Error processing blob {blob_name}: {e}")
+        return {'success': False, 'error': str(e), 'filename': filename}
+    finally:
+        if scan_job_id is not None:
+            increment_scan_progress(scan_job_id)
 
 
 @shared_task(bind=True, max_retries=3)
@@ -1853,6 +2977,16 @@ def poll_email_inbox(self):
     return poll_central_inbox_graph()
 
 
+# Einmal kompiliert statt über den re-Cache bei jedem Empfänger
+_INGEST_TOKEN_RE = re.compile(r'upload\.([a-f0-9-]+)@', re.IGNORECASE)
+
+
+def _parse_ingest_token(email_address):
+    """Liefert <token> aus upload.<token>@... oder None."""
+    match = _INGEST_TOKEN_RE.search(email_address)
+    return match.group(1) if match else None
+
+
 def extract_tenant_from_recipients(message):
     """
     Extrahiert den Tenant anhand des Tokens in der Empfängeradresse.
@@ -1863,32 +2997,75 @@ def extract_tenant_from_recipients(message):
     Returns:
         Tenant-Objekt oder None wenn kein gültiges Token gefunden.
     """
-    token_pattern = re.compile(r'upload\.([a-f0-9-]+)@', re.IGNORECASE)
-    
     all_recipients = list(message.to or []) + list(message.cc or [])
     
     for recipient in all_recipients:
         email_address = recipient.address if hasattr(recipient, 'address') else str(recipient)
-        match = token_pattern.search(email_address)
+        token = _parse_ingest_token(email_address)
         
-        if match:
-            token = match.group(1)
+        if token:
             # Hash token before lookup
-            import hashlib
             token_hash = hashlib.sha256(token.encode()).hexdigest()
             
-            try:
-                tenant = Tenant.objects.get(ingest_token_hash=token_hash, is_active=True)
+            # Bewusst ungecached: deaktivierte Tenants und rotierte Tokens müssen sofort
+            # greifen (Unique-Index auf ingest_token_hash, ein Lookup pro Mail)
+            tenant = Tenant.objects.filter(ingest_token_hash=token_hash, is_active=True).first()
+            if tenant is not None:
                 return tenant
-            except Tenant.DoesNotExist:
-                log_system_event('WARNING', 'CentralIngest', 
-                    f'Unbekanntes Ingest-Token: {token} (Hash: {token_hash})',
-                    {'email': email_address})
-                continue
+            log_system_event('WARNING', 'CentralIngest', 
+                f'Unbekanntes Ingest-Token: {token} (Hash: {token_hash})',
+                {'email': email_address})
     
     return None
 
 
+# SECURITY: Nur sichere Tags erlauben, keine iframes, scripts, object, embed etc.
+EMAIL_ALLOWED_TAGS = frozenset({
+    'b', 'i', 'u', 'p', 'br', 'strong', 'em', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'a', 'blockquote', 'pre',
+    'code', 'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'div', 'span',
+})
+EMAIL_ALLOWED_ATTRS = {
+    'a': ['href', 'title'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan'],
+}
+
+_email_cleaner_local = threading.local()
+
+
+def _get_email_cleaner():
+    """
+    bleach.Cleaner (inkl. html5lib-Parser) einmal pro Thread aufbauen statt bei jedem
+    bleach.clean()-Aufruf; Cleaner-Instanzen sind nicht thread-safe.
+    """
+    cleaner = getattr(_email_cleaner_local, 'cleaner', None)
+    if cleaner is None:
+        cleaner = bleach.Cleaner(tags=EMAIL_ALLOWED_TAGS, attributes=EMAIL_ALLOWED_ATTRS, strip=True)
+        _email_cleaner_local.cleaner = cleaner
+    return cleaner
+
+
+def _reject_url_fetch(url, *args, **kwargs):
+    """URL-Fetcher für WeasyPrint: E-Mail-PDFs laden keine Bilder, Stylesheets oder lokalen Dateien."""
+    raise ValueError(f'Externe Ressource blockiert: {url}')
+
+
+def _create_email_document(tenant, content, **fields):
+    """
+    Legt ein Dokument aus dem E-Mail-Import an. Der Inhalt wird in einem Durchgang
+    gehasht und chunkweise verschlüsselt in Document.file geschrieben.
+    """
+    document = Document(tenant=tenant, status='UNASSIGNED', source='EMAIL', **fields)
+    document.sha256_hash, document.file_size = save_encrypted_file(document.file, content, f"{document.id}.enc")
+    try:
+        document.save()
+    except Exception:
+        _delete_stored_files([document])
+        raise
+    return document
+
+
 def process_email_message(message, tenant):
     """
     Verarbeitet eine einzelne E-Mail und erstellt Dokumente für den Mandanten.
@@ -1897,10 +3074,6 @@ def process_email_message(message, tenant):
         message: O365 Message-Objekt
         tenant: Tenant-Objekt für die Zuordnung
     """
-    import pdfkit
-    import bleach
-    from django.utils.html import escape
-    
     email_archive_path = Path(settings.EMAIL_ARCHIVE_PATH)
     email_archive_path.mkdir(exist_ok=True)
     
@@ -1919,20 +3092,12 @@ Date: {message.received}
 {safe_body}
 """
     
-    eml_encrypted = encrypt_data(eml_content.encode('utf-8'))
-    eml_hash = calculate_sha256(eml_content.encode('utf-8'))
-    
-    eml_doc = Document.objects.create(
-        tenant=tenant,
+    eml_doc = _create_email_document(
+        tenant, eml_content.encode('utf-8'),
         title=f"Email: {message.subject}",
         original_filename=f"{timestamp}_{subject_safe}.eml",
         file_extension='.eml',
         mime_type='message/rfc822',
-        encrypted_content=eml_encrypted,
-        file_size=len(eml_content),
-        status='UNASSIGNED',
-        source='EMAIL',
-        sha256_hash=eml_hash,
         metadata={
             'sender': message.sender.address,
             'received': str(message.received),
@@ -1940,26 +3105,12 @@ Date: {message.received}
             'tenant_code': tenant.code
         }
     )
+    del eml_content
     
     try:
         # SECURITY FIX: HTML-Input sanitisieren um SSRF/LFI/XSS zu verhindern
-        # Nur sichere Tags erlauben, keine iframes, scripts, object, embed etc.
-        allowed_tags = ['b', 'i', 'u', 'p', 'br', 'strong', 'em', 'h1', 'h2', 'h3', 
-                        'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'a', 'blockquote', 'pre', 
-                        'code', 'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'div', 'span']
-        allowed_attrs = {
-            'a': ['href', 'title'],
-            'td': ['colspan', 'rowspan'],
-            'th': ['colspan', 'rowspan'],
-        }
-        
         # Entferne potentiell gefährliche HTML-Elemente
-        clean_body = bleach.clean(
-            message.body or '', 
-            tags=allowed_tags, 
-            attributes=allowed_attrs,
-            strip=True
-        )
+        clean_body = _get_email_cleaner().clean(message.body or '')
         
         # Escape kritische Felder
         safe_subject = escape(message.subject)
@@ -1979,30 +3130,17 @@ Date: {message.received}
         </html>
         """
         
-        # SECURITY FIX: wkhtmltopdf Optionen härten gegen LFI und SSRF
-        pdfkit_options = {
-            'disable-local-file-access': None,
-            'disable-javascript': None,
-            'no-images': None,
-            'disable-external-links': None,
-            'quiet': None,
-        }
-        
-        pdf_content = pdfkit.from_string(html_content, False, options=pdfkit_options)
-        pdf_encrypted = encrypt_data(pdf_content)
-        pdf_hash = calculate_sha256(pdf_content)
+        # SECURITY FIX: Kein Nachladen externer/lokaler Ressourcen (LFI, SSRF).
+        # WeasyPrint rendert im Prozess ohne JavaScript; der URL-Fetcher lehnt alles ab.
+        from weasyprint import HTML
+        pdf_content = HTML(string=html_content, url_fetcher=_reject_url_fetch).write_pdf()
         
-        Document.objects.create(
-            tenant=tenant,
+        _create_email_document(
+            tenant, pdf_content,
             title=f"Email PDF: {message.subject}",
             original_filename=f"{timestamp}_{subject_safe}.pdf",
             file_extension='.pdf',
             mime_type='application/pdf',
-            encrypted_content=pdf_encrypted,
-            file_size=len(pdf_content),
-            status='UNASSIGNED',
-            source='EMAIL',
-            sha256_hash=pdf_hash,
             metadata={'parent_email_id': str(eml_doc.id), 'tenant_code': tenant.code}
         )
     except Exception as e:
@@ -2013,21 +3151,12 @@ Date: {message.received}
     if message.has_attachments:
         for attachment in message.attachments:
             try:
-                att_content = attachment.content
-                att_encrypted = encrypt_data(att_content)
-                att_hash = calculate_sha256(att_content)
-                
-                Document.objects.create(
-                    tenant=tenant,
+                _create_email_document(
+                    tenant, attachment.content,
                     title=f"Attachment: {attachment.name}",
                     original_filename=attachment.name,
                     file_extension=Path(attachment.name).suffix,
                     mime_type=attachment.content_type or 'application/octet-stream',
-                    encrypted_content=att_encrypted,
-                    file_size=len(att_content),
-                    status='UNASSIGNED',
-                    source='EMAIL',
-                    sha256_hash=att_hash,
                     metadata={'parent_email_id': str(eml_doc.id), 'tenant_code': tenant.code}
                 )
             except Exception as e:
@@ -2045,7 +3174,6 @@ Date: {message.received}
 @shared_task(bind=True, max_retries=3)
 def sync_sage_cloud_employees(self):
     """Sync employees from Sage Cloud and create personnel files"""
-    from .connectors.sage_cloud import SageCloudConnector
     
     try:
         connector = SageCloudConnector()
@@ -2067,7 +3195,6 @@ def sync_sage_cloud_employees(self):
 @shared_task(bind=True, max_retries=3)
 def import_sage_cloud_leave_requests(self):
     """Import approved leave requests from Sage Cloud"""
-    from .connectors.sage_cloud import SageCloudConnector
     from datetime import timedelta
     
     try:
@@ -2086,7 +3213,6 @@ def import_sage_cloud_leave_requests(self):
 @shared_task(bind=True, max_retries=3)
 def import_sage_cloud_timesheets(self, year: int = None, month: int = None):
     """Import monthly timesheets from Sage Cloud"""
-    from .connectors.sage_cloud import SageCloudConnector
     
     if year is None or month is None:
         now = timezone.now()
@@ -2107,18 +3233,45 @@ def import_sage_cloud_timesheets(self, year: int = None, month: int = None):
         log_system_event('ERROR', 'SageCloudImport', 
             f'Zeiterfassungs-Import fehlgeschlagen: {str(e)}')
         raise self.retry(exc=e, countdown=300)
-@shared_task(bind=True, max_retries=3)
+
+
+class DeadLetterTask(CeleryTask):
+    """
+    Celery-Task-Basis, die endgültig fehlgeschlagene Aufrufe (Retries erschöpft
+    oder nicht-transienter Fehler) in eine eigene Queue umleitet. Diese Queue wird
+    bewusst von keinem Worker konsumiert: jeder Eintrag erzeugt einen ERROR-SystemLog
+    (Quelle 'DeadLetter'), nach Behebung der Ursache stellt
+    `manage.py requeue_dead_letters --requeue` die Aufrufe wieder in die normale Queue.
+    """
+    abstract = True
+    dead_letter_queue = None
+    
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        delivery_info = self.request.delivery_info or {}
+        # Bereits aus der Dead-Letter-Queue abgearbeitet -> nicht erneut einreihen
+        if self.dead_letter_queue and delivery_info.get('routing_key') != self.dead_letter_queue:
+            # Wie retry(): Task-ID, Callbacks, Zeitlimits und Header bleiben erhalten
+            self.signature_from_request(args=args, kwargs=kwargs, queue=self.dead_letter_queue).apply_async()
+            log_system_event('ERROR', 'DeadLetter',
+                f"{self.name} endgültig fehlgeschlagen, in {self.dead_letter_queue} verschoben: {exc}",
+                {'task_id': task_id, 'args': [str(a) for a in args]})
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+
+
+@shared_task(bind=True, base=DeadLetterTask, dead_letter_queue='process_imported_document_dlq',
+             max_retries=5, autoretry_for=(OperationalError, ConnectionError),
+             retry_backoff=60, retry_backoff_max=1800, retry_jitter=True)
 def process_imported_document(self, document_id):
     """
     Verarbeitet ein importiertes Dokument asynchron.
-    - Entschlüsselt Dokument
+    - Entschlüsselt Dokument (nur PDFs)
     - Prüft auf DataMatrix-Codes (Sage)
     - Teilt PDF bei Bedarf (Lohnscheine)
     - Führt Auto-Klassifizierung durch
     - Erstellt Aufgaben bei Klärungsbedarf
     """
     try:
-        document = Document.objects.get(id=document_id)
+        document = Document.objects.select_related('tenant').get(id=document_id)
     except Document.DoesNotExist:
         logger.error(f"ProcessDocument: Document {document_id} not found")
         return "Document not found"
@@ -2129,45 +3282,51 @@ def process_imported_document(self, document_id):
     try:
         # Tenant Kontext setzen
         with tenant_context(document.tenant):
-            # 1. Inhalt entschlüsseln und temporär speichern (für PDF Processing)
-            decrypted_content = decrypt_data(document.encrypted_content)
-            
-            with tempfile.NamedTemporaryFile(suffix=document.file_extension, delete=False) as temp_file:
-                temp_file.write(decrypted_content)
-                temp_file_path = temp_file.name
+            pdf_doc = None
                 
             try:
                 # 2. Prüfen ob PDF und Verarbeitung notwendig
-                is_pdf = document.mime_type == 'application/pdf' or document.file_extension.lower() == '.pdf'
+                is_pdf = document.is_pdf
                 
                 dm_result = None
                 split_occurred = False
                 
+                # Klassifizierung einmalig anhand des Dateinamens (auch für Split-Entscheidung)
+                doc_type, is_personnel, category, description = classify_sage_document(document.original_filename)
+                
                 if is_pdf:
-                    # Klassifizierung vorab prüfen um zu sehen ob es Personaldokumente sein könnten
-                    doc_type_guess, is_personnel_guess, _, _ = classify_sage_document(document.original_filename)
+                    # 1. Blob aus Document.file entschlüsseln - PyMuPDF öffnet den Klartext
+                    #    direkt aus dem Speicher, er landet nie in einer temporären Datei
+                    pdf_doc, _ = _open_pdf(read_decrypted_file(document.file))
                     
-                    if is_personnel_guess:
+                    if is_personnel:
                          # Versuch Split wenn DataMatrix vorhanden
-                        split_output_dir = Path(settings.BASE_DIR) / 'data' / 'split_temp' / (document.tenant.code if document.tenant else 'global')
-                        split_results = split_pdf_by_datamatrix(temp_file_path, str(split_output_dir))
+                        split_results = split_pdf_by_datamatrix(pdf_doc, filename=document.original_filename, build_parts=False)
                         
                         if split_results and len(split_results) > 1:
                             # SPLIT FALL
                             log_system_event('INFO', 'ProcessDocument', f"PDF Split erfolgreich: {len(split_results)} Teile")
                             
-                            for split_info in split_results:
-                                _create_split_document(document, split_info, decrypted_content=None) # Helper creates new docs
-                                
-                            # Original Dokument archivieren/löschen da aufgeteilt
-                            document.status = 'ARCHIVED'
-                            document.notes += "\nAutomatisch aufgeteilt und archiviert."
-                            document.save(update_fields=['status', 'notes', 'updated_at'])
+                            split_employees = find_employees_by_ids(
+                                [si['employee_id'] for si in split_results], tenant=document.tenant
+                            )
+                            # Teile parallel über den Worker-Pool anlegen (Verschlüsselung, Hash, Insert).
+                            # Im Payload nur Seitenbereiche und IDs - jeder Teil wird im Subtask aus
+                            # dem Eltern-Dokument neu erzeugt. Das Original wird erst im Chord-Callback
+                            # archiviert, wenn alle Teile angelegt sind.
+                            chord(
+                                create_split_document_task.s(
+                                    str(document.id),
+                                    _split_info_payload(split_info, split_employees.get(split_info['employee_id']))
+                                )
+                                for split_info in split_results
+                            )(finalize_split_document_task.s(str(document.id)))
+                            
                             split_occurred = True
                         
                         else:
                              # Kein Split, aber vielleicht Einzel-DataMatrix?
-                             dm_result = extract_employee_from_datamatrix(temp_file_path)
+                             dm_result = extract_employee_from_datamatrix(pdf_doc)
 
                 if not split_occurred:
                     # 3. Metadaten extrahieren und anreichern
@@ -2183,18 +3342,14 @@ def process_imported_document(self, document_id):
                          if dm_result.get('mandant_code'):
                              metadata['mandant_code_dm'] = dm_result.get('mandant_code')
                     
-                    # 4. Klassifizierung & Zuordnung
-                    doc_type, is_personnel, category, description = classify_sage_document(document.original_filename)
-                    
+                    # 4. Zuordnung
                     employee = document.employee
                     if not employee and dm_result and dm_result.get('employee_ids'):
-                        for emp_id in dm_result['employee_ids']:
-                            employee = find_employee_by_id(emp_id, tenant=document.tenant, mandant_code=dm_result.get('mandant_code'))
-                            if employee:
-                                break
+                        found = find_employees_by_ids(dm_result['employee_ids'], tenant=document.tenant, mandant_code=dm_result.get('mandant_code'))
+                        employee = next((found[e] for e in dm_result['employee_ids'] if e in found), None)
                     
                     # Update Document
-                    document.document_type = get_or_create_document_type(doc_type, description, category, document.tenant) if doc_type != 'UNBEKANNT' else None
+                    document.document_type_id = get_document_type_id_cached(doc_type, description, category, document.tenant) if doc_type != 'UNBEKANNT' else None
                     document.employee = employee
                     
                     if employee:
@@ -2212,7 +3367,7 @@ def process_imported_document(self, document_id):
                         'processed_at': str(timezone.now())
                     })
                     document.metadata = metadata
-                    document.save()
+                    document.save(update_fields=['document_type', 'employee', 'status', 'metadata', 'updated_at'])
                     
                     # 5. Auto-Classify Regelwerk anwenden
                     auto_classify_document(document, tenant=document.tenant)
@@ -2224,70 +3379,166 @@ def process_imported_document(self, document_id):
                     log_system_event('INFO', 'ProcessDocument', f"Verarbeitung abgeschlossen. Status: {document.status}")
 
             finally:
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+                if pdf_doc is not None:
+                    pdf_doc.close()
                     
     except Exception as e:
         logger.error(f"Error processing document {document_id}: {e}")
         log_system_event('ERROR', 'ProcessDocument', f"Fehler bei Verarbeitung: {e}", {'doc_id': str(document_id)})
-        raise self.retry(exc=e, countdown=60)
+        # Transiente Fehler wiederholt der Decorator mit exponentiellem Backoff + Jitter
+        raise
 
 
-def _create_split_document(parent_doc, split_info, decrypted_content=None):
+def _split_info_payload(split_info, employee=None):
     """
-    Helper to create a new document from a split result.
+    Bereitet ein split_info-Dict für den Versand an create_split_document_task vor
+    (JSON-serialisierbar: nur Seitenbereich und Metadaten, Mitarbeiter als PK).
+    Der PDF-Inhalt geht nicht über den Broker.
     """
-    from .models import Document, ProcessedFile
+    return {
+        'filename': split_info['filename'],
+        'employee_id': split_info.get('employee_id'),
+        'employee_pk': str(employee.pk) if employee else None,
+        'pages': list(split_info['pages']),
+        'page_count': split_info.get('page_count'),
+        'mandant_code': split_info.get('mandant_code'),
+    }
+
+
+def _find_split_document(parent_id, pages):
+    """Bereits angelegtes Split-Dokument für (Eltern-Dokument, Seiten) oder None."""
+    return Document.objects.filter(
+        metadata__split_from=str(parent_id),
+        metadata__split_pages=list(pages),
+    ).first()
+
+
+@shared_task(bind=True, max_retries=3, autoretry_for=(OperationalError,), retry_backoff=True,
+             retry_backoff_max=600, retry_jitter=True)
+def create_split_document_task(self, parent_id, split_info):
+    """
+    Legt ein einzelnes Split-Dokument an. Wird von process_imported_document
+    als Chord-Header pro Teil aufgerufen.
+    
+    Der Teil wird über seinen Seitenbereich aus dem Eltern-Dokument neu erzeugt.
+    Idempotent über (Eltern-Dokument, Seiten): ein Retry nach bereits erfolgtem
+    Insert liefert das vorhandene Dokument statt ein Duplikat anzulegen.
+    """
+    import fitz
+    
+    try:
+        parent_doc = Document.objects.select_related('tenant').get(id=parent_id)
+    except Document.DoesNotExist:
+        logger.error(f"CreateSplitDocument: Parent {parent_id} not found")
+        return None
+    
+    split_info = dict(split_info)
+    pages = split_info['pages']
+    
+    with tenant_context(parent_doc.tenant):
+        existing = _find_split_document(parent_id, pages)
+        if existing:
+            return str(existing.id)
+        
+        pdf_doc = fitz.open(stream=read_decrypted_file(parent_doc.file), filetype="pdf")
+        try:
+            split_info['content'] = _extract_pdf_pages(pdf_doc, pages)
+        finally:
+            pdf_doc.close()
+        
+        employee_pk = split_info.get('employee_pk')
+        employee = Employee.objects.filter(pk=employee_pk).first() if employee_pk else None
+        
+        with transaction.atomic():
+            # Eltern-Zeile sperren: parallele Zustellungen desselben Teils serialisieren
+            Document.objects.select_for_update().filter(pk=parent_doc.pk).first()
+            existing = _find_split_document(parent_id, pages)
+            if existing:
+                return str(existing.id)
+            new_doc = _create_split_document(
+                parent_doc, split_info,
+                employee_cache={split_info.get('employee_id'): employee}
+            )
+    
+    return str(new_doc.id)
+
+
+@shared_task
+def finalize_split_document_task(results, parent_id):
+    """
+    Chord-Callback nach create_split_document_task: archiviert das Original erst,
+    wenn alle Teile angelegt wurden. Schlägt ein Teil fehl, läuft der Callback
+    nicht und das Original bleibt unverändert.
+    """
+    from django.db.models import Value
+    from django.db.models.functions import Concat
     
-    split_path = Path(split_info['file_path'])
+    if not results or not all(results):
+        log_system_event('WARNING', 'ProcessDocument',
+            f"Split von {parent_id} unvollständig, Original wird nicht archiviert",
+            {'parts': len(results or [])})
+        return None
     
-    with open(split_path, 'rb') as f:
-        content = f.read()
+    # Ein atomares UPDATE - die Notizen werden in der DB angehängt statt in Python gelesen/geschrieben
+    Document.objects.filter(pk=parent_id).update(
+        status='ARCHIVED',
+        notes=Concat('notes', Value("\nAutomatisch aufgeteilt und archiviert.")),
+        updated_at=timezone.now()
+    )
+    log_system_event('INFO', 'ProcessDocument', f"Original {parent_id} nach Split archiviert",
+                     {'parts': len(results)})
+    return results
+
+
+def _create_split_document(parent_doc, split_info, decrypted_content=None, employee_cache=None):
+    """
+    Helper to create a new document from a split result.
+    employee_cache: optionales Ergebnis von find_employees_by_ids (vermeidet Einzel-Queries).
+    """
+    from .models import Document, ProcessedFile
     
-    encrypted = encrypt_data(content)
-    file_hash = calculate_sha256(content)
+    content = split_info['content']
     
     # Metadata parsing
     emp_id = split_info.get('employee_id')
     tenant = parent_doc.tenant
     
-    employee = find_employee_by_id(emp_id, tenant=tenant)
+    if employee_cache is not None:
+        employee = employee_cache.get(emp_id)
+    else:
+        employee = find_employee_by_id(emp_id, tenant=tenant)
     
     doc_type, _, category, desc = classify_sage_document(parent_doc.original_filename)
+    document_type_id = get_document_type_id_cached(doc_type, desc, category, tenant) if doc_type != 'UNBEKANNT' else None
     
-    new_doc = Document.objects.create(
+    new_doc = Document(
         tenant=tenant,
         title=f"{parent_doc.title} (Teil)",
-        original_filename=split_path.name,
+        original_filename=split_info['filename'],
         file_extension='.pdf',
         mime_type='application/pdf',
-        encrypted_content=encrypted,
-        file_size=len(content),
         employee=employee,
+        document_type_id=document_type_id,
         status='ASSIGNED' if employee else 'REVIEW_NEEDED',
         source=parent_doc.source,
-        sha256_hash=file_hash,
         metadata={
             'split_from': str(parent_doc.id),
+            'split_pages': list(split_info['pages']),
             'original_filename': parent_doc.original_filename,
             'employee_id_dm': emp_id
         }
     )
+    # Verschlüsselter Blob in Document.file, Hash und Größe aus demselben Durchgang
+    new_doc.sha256_hash, new_doc.file_size = save_encrypted_file(new_doc.file, content, f"{new_doc.id}.enc")
+    try:
+        new_doc.save()
+    except Exception:
+        new_doc.file.delete(save=False)
+        raise
     
-    # Document Type assignment
-    if doc_type != 'UNBEKANNT':
-        new_doc.document_type = get_or_create_document_type(doc_type, desc, category, tenant)
-        new_doc.save(update_fields=['document_type'])
-
     if new_doc.status == 'REVIEW_NEEDED':
         create_review_task(new_doc, source='SPLIT')
         
-    # Cleanup split file
-    try:
-        split_path.unlink()
-    except:
-        pass
-        
     return new_doc
 
 
@@ -1,3 +1,697 @@
-from django.test import TestCase
+import os
 
-# Create your tests here.
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .encryption import (
+    decrypt_data, encrypt_data, encrypt_stream_to_blob, iter_decrypt_stream, read_decrypted_file,
+    save_encrypted_file,
+)
+from .models import Document, Employee, Tenant
+from .tasks import (
+    _split_info_payload, clear_document_type_cache, clear_employee_lookup_cache, clear_file_category_cache,
+    create_split_document_task, finalize_split_document_task,
+)
+
+
+TEST_ENCRYPTION_KEY = Fernet.generate_key()
+
+
+@override_settings(ENCRYPTION_KEY=TEST_ENCRYPTION_KEY)
+class EncryptionTests(SimpleTestCase):
+    """encrypt_data (Fernet, Einstellungs-Secrets) und das AES-GCM-Chunkformat der Dokument-Blobs."""
+
+    def test_encrypt_data_roundtrip(self):
+        token = encrypt_data('Größe')
+        self.assertEqual(decrypt_data(memoryview(token)), 'Größe'.encode('utf-8'))
+
+    def test_encrypt_data_tampered_token_rejected(self):
+        token = bytearray(encrypt_data(b'secret'))
+        token[-5] ^= 0x01
+        with self.assertRaises(InvalidToken):
+            decrypt_data(bytes(token))
+
+    def test_blob_roundtrip_over_several_chunks(self):
+        import hashlib
+        from io import BytesIO
+
+        payload = b'%PDF-1.7 Lohnschein' * 10000
+        blob = BytesIO()
+        sha256_hash, size, written = encrypt_stream_to_blob(BytesIO(payload), blob, chunk_size=4096)
+        self.assertEqual((sha256_hash, size, written), (hashlib.sha256(payload).hexdigest(), len(payload), blob.tell()))
+
+        blob.seek(0)
+        chunks = list(iter_decrypt_stream(blob))
+        self.assertEqual(len(chunks), -(-len(payload) // 4096))
+        self.assertEqual(b''.join(chunks), payload)
+
+    def test_blob_tampered_chunk_rejected(self):
+        from io import BytesIO
+
+        blob = BytesIO()
+        encrypt_stream_to_blob(BytesIO(b'payload'), blob)
+        data = bytearray(blob.getvalue())
+        data[-1] ^= 0x01
+        with self.assertRaises(InvalidTag):
+            list(iter_decrypt_stream(BytesIO(bytes(data))))
+
+
+def _make_pdf(page_texts):
+    import fitz
+
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+class _MediaRootMixin:
+    """Dokument-Blobs landen in einem temporären MEDIA_ROOT, Prozess-Caches starten leer."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        super().setUp()
+        # Rollbacks zwischen Tests lösen keine delete-Signale aus
+        for clear_cache in (clear_document_type_cache, clear_employee_lookup_cache, clear_file_category_cache):
+            clear_cache()
+            self.addCleanup(clear_cache)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+
+@override_settings(ENCRYPTION_KEY=TEST_ENCRYPTION_KEY)
+class SplitDocumentTests(_MediaRootMixin, TestCase):
+    """create_split_document_task + finalize_split_document_task über Document.file."""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant = Tenant.objects.create(code='0000001', name='Test')
+        self.employee = Employee.objects.create(
+            tenant=self.tenant, employee_id='1', first_name='Max', last_name='Muster'
+        )
+        self.parent = Document(
+            tenant=self.tenant, title='Lohnscheine', original_filename='Lohnscheine.pdf',
+            file_extension='.pdf', mime_type='application/pdf', source='SAGE',
+        )
+        content = _make_pdf(['Seite 1', 'Seite 2', 'Seite 3'])
+        self.parent.sha256_hash, self.parent.file_size = save_encrypted_file(
+            self.parent.file, content, f"{self.parent.id}.enc"
+        )
+        self.parent.save()
+
+    def _payload(self, pages, employee=None):
+        return _split_info_payload(
+            {'filename': f"Lohnscheine_{pages[0]}.pdf", 'employee_id': employee.employee_id if employee else None,
+             'pages': pages, 'page_count': len(pages), 'mandant_code': None},
+            employee,
+        )
+
+    def test_split_end_to_end(self):
+        import fitz
+
+        first = create_split_document_task(str(self.parent.id), self._payload([0, 1], self.employee))
+        second = create_split_document_task(str(self.parent.id), self._payload([2]))
+
+        child = Document.objects.get(pk=first)
+        self.assertEqual(child.status, 'ASSIGNED')
+        self.assertEqual(child.employee, self.employee)
+        self.assertEqual(child.metadata['split_pages'], [0, 1])
+        with fitz.open(stream=read_decrypted_file(child.file), filetype='pdf') as part:
+            self.assertEqual(part.page_count, 2)
+            self.assertIn('Seite 2', part[1].get_text())
+        self.assertEqual(Document.objects.get(pk=second).status, 'REVIEW_NEEDED')
+
+        finalize_split_document_task([first, second], str(self.parent.id))
+        self.parent.refresh_from_db()
+        self.assertEqual(self.parent.status, 'ARCHIVED')
+
+    def test_split_is_idempotent_per_page_range(self):
+        first = create_split_document_task(str(self.parent.id), self._payload([0, 1], self.employee))
+        again = create_split_document_task(str(self.parent.id), self._payload([0, 1], self.employee))
+        self.assertEqual(first, again)
+        self.assertEqual(Document.objects.filter(metadata__split_from=str(self.parent.id)).count(), 1)
+
+    def test_incomplete_split_keeps_parent(self):
+        finalize_split_document_task([None], str(self.parent.id))
+        self.parent.refresh_from_db()
+        self.assertNotEqual(self.parent.status, 'ARCHIVED')
+
+
+@override_settings(ENCRYPTION_KEY=TEST_ENCRYPTION_KEY)
+class EmailImportTests(_MediaRootMixin, TestCase):
+    """process_email_message schreibt die E-Mail verschlüsselt in Document.file."""
+
+    def test_eml_document_stored_in_file(self):
+        import hashlib
+        import tempfile
+        from types import SimpleNamespace
+
+        from .tasks import process_email_message
+
+        tenant = Tenant.objects.create(code='0000002', name='Mail')
+        message = SimpleNamespace(
+            subject='Krankmeldung', body='<p>Hallo</p>', to=[SimpleNamespace(address='hr@example.com')],
+            sender=SimpleNamespace(address='max@example.com'), received='2026-01-02 10:00',
+            has_attachments=False, attachments=[],
+        )
+        with override_settings(EMAIL_ARCHIVE_PATH=tempfile.mkdtemp()):
+            process_email_message(message, tenant)
+
+        eml_doc = Document.objects.get(tenant=tenant, mime_type='message/rfc822')
+        content = read_decrypted_file(eml_doc.file)
+        self.assertIn(b'Subject: Krankmeldung', content)
+        self.assertEqual(eml_doc.file_size, len(content))
+        self.assertEqual(eml_doc.sha256_hash, hashlib.sha256(content).hexdigest())
+
+
+@override_settings(ENCRYPTION_KEY=TEST_ENCRYPTION_KEY)
+class DocumentDeliveryTests(_MediaRootMixin, TestCase):
+    """upload_file verschlüsselt in Document.file, document_download/document_view streamen den Klartext."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        super().setUp()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.content = b'%PDF-1.7 ' + bytes(range(256)) * 1024  # mehrere 64-KB-Chunks
+        self.document = Document(
+            title='Vertrag', original_filename='Vertrag.pdf', file_extension='.pdf', mime_type='application/pdf',
+        )
+        save_encrypted_file(self.document.file, self.content, f"{self.document.id}.enc")
+        self.document.save()
+
+    def _get(self, view):
+        from django.test import RequestFactory
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return view(request, pk=self.document.pk)
+
+    def test_download_streams_plaintext(self):
+        from .views import document_download
+
+        response = self._get(document_download)
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Vertrag.pdf"')
+
+    def test_upload_writes_encrypted_file(self):
+        import hashlib
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+        from .views import upload_file
+
+        content = _make_pdf(['Upload'])
+        request = RequestFactory().post('/', {'file': SimpleUploadedFile('Scan.pdf', content, 'application/pdf')})
+        request.user = self.user
+        request._dont_enforce_csrf_checks = True
+        response = upload_file(request)
+
+        self.assertEqual(response.status_code, 200, response.content)
+        document = Document.objects.get(original_filename='Scan.pdf')
+        self.assertEqual(document.mime_type, 'application/pdf')
+        self.assertEqual(document.file_size, len(content))
+        self.assertEqual(document.sha256_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(read_decrypted_file(document.file), content)
+
+    def test_missing_blob_returns_error(self):
+        from .views import document_view
+
+        self.document.file.delete(save=False)
+        Document.objects.filter(pk=self.document.pk).update(file='documents/fehlt.enc')
+        self.assertEqual(self._get(document_view).status_code, 500)
+
+
+def _sage_code(employee_id, mandant='5'):
+    return f"DDLGA;MD{mandant};PN{employee_id};UNtest;ED01.12.2025;ES12/2025;YR2025"
+
+
+class DataMatrixTextLayerTests(SimpleTestCase):
+    """Textlayer vor DataMatrix: Seiten mit Personalnummer im Text werden nicht gerendert/dekodiert."""
+
+    def setUp(self):
+        # Deckblatt, MA 1001 (2 Seiten), MA 1002 (2 Seiten)
+        self.content = _make_pdf(['Deckblatt', _sage_code(1001), 'Seite 2 von 2', _sage_code(1002), _sage_code(1002)])
+
+    def test_split_boundaries_from_text_layer(self):
+        from unittest import mock
+
+        from . import tasks
+
+        rendered = set()
+        render = tasks.render_datamatrix_pixels
+
+        def record_render(page, zoom):
+            rendered.add(page.number)
+            return render(page, zoom)
+
+        with mock.patch.object(tasks, '_get_split_parallelism', return_value=1), \
+                mock.patch.object(tasks, 'render_datamatrix_pixels', side_effect=record_render), \
+                mock.patch.object(tasks, '_decode_split_page', return_value=(None, None)):
+            parts = tasks.split_pdf_by_datamatrix(self.content, filename='Lohn.pdf', build_parts=False)
+
+        self.assertEqual([(p['employee_id'], p['pages']) for p in parts], [('1001', [0, 1, 2]), ('1002', [3, 4])])
+        self.assertEqual(parts[0]['mandant_code'], '5')
+        # Nur die Seiten ohne Personalnummer im Textlayer werden gerendert und dekodiert
+        self.assertEqual(rendered, {0, 2})
+
+    def test_range_worker_uses_text_layer(self):
+        from unittest import mock
+
+        from . import tasks
+
+        with mock.patch.object(tasks, 'render_datamatrix_pixels', side_effect=AssertionError('gerendert')):
+            results = tasks._scan_page_range_worker(self.content, 3, 5, 1000)
+        self.assertEqual(results, [('1002', '5'), ('1002', '5')])
+
+    def test_single_document_skips_decoding(self):
+        from unittest import mock
+
+        from . import tasks
+
+        with mock.patch.object(tasks, 'decode_datamatrix_page', side_effect=AssertionError('dekodiert')):
+            result = tasks.extract_employee_from_datamatrix(_make_pdf([_sage_code(1001)]))
+        self.assertTrue(result['success'])
+        self.assertEqual(result['employee_ids'], ['1001'])
+
+
+class ProcessPoolParallelismTests(SimpleTestCase):
+    """Ein billiard-Pool pro Worker, jede Aufgabenart belegt nur ihre eigene Obergrenze."""
+
+    @override_settings(OCR_PARALLELISM=2, PDF_SPLIT_PARALLELISM=4)
+    def test_limits_per_setting(self):
+        from unittest import mock
+
+        from . import process_pool
+
+        with mock.patch('os.cpu_count', return_value=8):
+            self.assertEqual(process_pool._pool_size(), 4)
+            with mock.patch.object(process_pool, 'get_process_pool_size', return_value=4):
+                self.assertEqual(process_pool.get_pool_parallelism('OCR_PARALLELISM'), 2)
+                self.assertEqual(process_pool.get_pool_parallelism('PDF_SPLIT_PARALLELISM'), 4)
+            with mock.patch.object(process_pool, 'get_process_pool_size', return_value=1):
+                self.assertEqual(process_pool.get_pool_parallelism('PDF_SPLIT_PARALLELISM'), 1)
+            # Thread-Fallback im Task nutzt dieselbe Obergrenze
+            self.assertEqual(process_pool.get_parallelism('PDF_SPLIT_PARALLELISM'), 4)
+
+    @override_settings(OCR_PARALLELISM=0, PDF_SPLIT_PARALLELISM=0)
+    def test_zero_means_default(self):
+        from unittest import mock
+
+        from . import process_pool
+
+        with mock.patch('os.cpu_count', return_value=8):
+            self.assertEqual(process_pool.get_parallelism('OCR_PARALLELISM'), 8)
+            self.assertEqual(process_pool.get_parallelism('PDF_SPLIT_PARALLELISM'), 1)
+
+    @override_settings(OCR_PARALLELISM=2)
+    def test_ocr_submits_at_most_its_limit(self):
+        from unittest import mock
+
+        from . import ocr
+
+        pool = mock.Mock()
+        pool.map.side_effect = lambda func, batches: [[(f'p{image}', 90.0) for image in batch] for batch in batches]
+        with mock.patch('os.cpu_count', return_value=8), \
+                mock.patch('dms.process_pool.get_process_pool', return_value=pool), \
+                mock.patch('dms.process_pool.get_process_pool_size', return_value=8), \
+                mock.patch.object(ocr, '_render_pdf_page', side_effect=lambda content, doc, page_num, dpi: page_num):
+            doc = mock.Mock(page_count=5)
+            texts = ocr._ocr_pdf_pages(b'', doc=doc)
+
+        self.assertEqual(len(pool.map.call_args[0][1]), 2)
+        self.assertEqual(texts, {n: f'p{n}' for n in range(5)})
+
+
+class SystemLogBufferTests(TestCase):
+    """log_system_event puffert Einträge mit dem Zeitpunkt des Ereignisses."""
+
+    def test_buffered_entry_keeps_event_time(self):
+        from datetime import datetime, timezone as dt_timezone
+        from unittest import mock
+
+        from .models import SystemLog
+        from .tasks import flush_system_logs, log_system_event
+
+        event_time = datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=event_time):
+            log_system_event('INFO', 'Test', 'gepuffert')
+        self.assertFalse(SystemLog.all_objects.filter(source='Test').exists())
+
+        flush_system_logs()
+        self.assertEqual(SystemLog.all_objects.get(source='Test').timestamp, event_time)
+
+    def test_review_task_is_logged_through_buffer(self):
+        from .models import SystemLog
+        from .tasks import create_review_task, flush_system_logs
+
+        document = Document.objects.create(title='Scan', original_filename='Scan.pdf', file_extension='.pdf')
+        # Prüfung auf offene Aufgabe + INSERT der Aufgabe, kein eigener SystemLog-INSERT
+        with self.assertNumQueries(2):
+            task = create_review_task(document, source='SPLIT')
+        flush_system_logs()
+        log = SystemLog.all_objects.get(source='TASK_CREATE')
+        self.assertEqual(log.details['task_id'], str(task.id))
+
+
+class ScannerLockHandoverTests(TestCase):
+    """Der Azure-Scan übergibt den Scanner-Lock an den Chord statt ihn beim Dispatch freizugeben."""
+
+    def setUp(self):
+        from unittest import mock
+
+        from . import tasks
+
+        self.acquire, self.release, self.extend = mock.Mock(return_value=[1, 0]), mock.Mock(), mock.Mock()
+        client = mock.Mock()
+        client.register_script.side_effect = [self.acquire, self.release, self.extend]
+        patcher = mock.patch.object(tasks, 'get_redis_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tasks._lock_scripts = None
+        self.addCleanup(setattr, tasks, '_lock_scripts', None)
+
+    def test_lock_released_on_exit(self):
+        from .tasks import distributed_lock
+
+        with distributed_lock('sage_scanner') as lock:
+            self.assertTrue(lock)
+        self.release.assert_called_once_with(
+            keys=['dms:lock:sage_scanner', 'dms:lock:sage_scanner:meta'], args=[lock.value])
+
+    def test_handed_over_lock_is_released_by_callback(self):
+        from .models import ScanJob
+        from .tasks import distributed_lock, finalize_sage_azure_scan_task
+
+        with distributed_lock('sage_scanner') as lock:
+            lock.extend(7200)
+            lock_value = lock.hand_over()
+        self.extend.assert_called_once_with(
+            keys=['dms:lock:sage_scanner', 'dms:lock:sage_scanner:meta'], args=[lock_value, 7200])
+        self.release.assert_not_called()
+
+        scan_job = ScanJob.objects.create(source='SAGE', status='RUNNING', total_files=1)
+        finalize_sage_azure_scan_task.run([{'success': False}], scan_job.pk, 0, lock_value)
+        self.release.assert_called_once_with(
+            keys=['dms:lock:sage_scanner', 'dms:lock:sage_scanner:meta'], args=[lock_value])
+        scan_job.refresh_from_db()
+        self.assertEqual((scan_job.status, scan_job.error_files), ('COMPLETED', 1))
+
+    def test_chord_error_releases_lock(self):
+        from .models import ScanJob
+        from .tasks import abort_sage_azure_scan_task
+
+        scan_job = ScanJob.objects.create(source='SAGE', status='RUNNING', total_files=1)
+        abort_sage_azure_scan_task(None, RuntimeError('Worker verloren'), None, scan_job.pk, 'token')
+        self.release.assert_called_once_with(
+            keys=['dms:lock:sage_scanner', 'dms:lock:sage_scanner:meta'], args=['token'])
+        scan_job.refresh_from_db()
+        self.assertEqual((scan_job.status, scan_job.error_message), ('FAILED', 'Worker verloren'))
+
+
+class RequeueDeadLettersTests(TestCase):
+    """requeue_dead_letters gegen den In-Memory-Broker von kombu."""
+
+    def setUp(self):
+        from unittest import mock
+
+        from celery.backends.base import DisabledBackend
+
+        from dms_project.celery import app
+
+        self.app = app
+        # Die App liest ihre Konfiguration mit Namespace CELERY aus den Django-Settings
+        self.addCleanup(self._restore, app.conf.broker_url)
+        app.conf.update(CELERY_BROKER_URL='memory://')
+        self._reset_pools()
+        # Ohne Result-Backend: der Redis-Backend würde beim Senden eine Verbindung aufbauen
+        patcher = mock.patch.object(type(app), 'backend', new_callable=mock.PropertyMock,
+                                    return_value=DisabledBackend(app))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _restore(self, broker_url):
+        self.app.conf.update(CELERY_BROKER_URL=broker_url)
+        self._reset_pools()
+
+    def _reset_pools(self):
+        self.app._pool = None
+        self.app.amqp._producer_pool = None
+
+    def _drain(self, queue_name):
+        messages = []
+        with self.app.connection_for_write() as conn:
+            queue = conn.SimpleQueue(self.app.amqp.queues[queue_name])
+            try:
+                while True:
+                    try:
+                        message = queue.get(block=False)
+                    except queue.Empty:
+                        break
+                    message.ack()
+                    messages.append(message)
+            finally:
+                queue.close()
+        return messages
+
+    def test_requeue_keeps_routing_and_options(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from .models import SystemLog
+        from .tasks import flush_system_logs, process_imported_document
+
+        dlq = process_imported_document.dead_letter_queue
+        callback = process_imported_document.si('callback-doc')
+        process_imported_document.apply_async(
+            args=['doc-1'], queue=dlq, task_id='dead-1', link=callback,
+            retries=5, headers={'x-trace': 'abc'},
+        )
+
+        out = StringIO()
+        call_command('requeue_dead_letters', '--requeue', stdout=out)
+        self.assertIn(f'{dlq}: 1 Task(s)', out.getvalue())
+        flush_system_logs()
+        self.assertTrue(SystemLog.all_objects.filter(source='DeadLetter').exists())
+
+        self.assertEqual(self._drain(dlq), [])
+        [message] = self._drain(self.app.conf.task_default_queue)
+        self.assertEqual(message.headers['task'], process_imported_document.name)
+        self.assertEqual(message.headers['id'], 'dead-1')
+        self.assertEqual(message.headers['retries'], 0)
+        self.assertEqual(message.headers['x-trace'], 'abc')
+        args, kwargs, embed = message.payload
+        self.assertEqual((args, kwargs), (['doc-1'], {}))
+        self.assertEqual(embed['callbacks'][0]['args'], ['callback-doc'])
+
+
+class KeysetPaginationTests(TestCase):
+    """_keyset_page: Cursor vor/zurück über (created_at, id) absteigend."""
+
+    def setUp(self):
+        from datetime import datetime, timezone as dt_timezone
+
+        base = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        # Zwei Dokumente teilen sich jeweils einen Zeitstempel: die ID entscheidet
+        for n, minute in enumerate([0, 1, 1, 2, 3, 3, 4]):
+            document = Document.objects.create(title=f'D{n}', original_filename=f'D{n}.pdf')
+            Document.objects.filter(pk=document.pk).update(created_at=base.replace(minute=minute))
+        self.expected = list(Document.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def page(self, **cursor):
+        from .views import _keyset_page
+
+        items, prev_before, next_after = _keyset_page(Document.objects.all(), per_page=3, **cursor)
+        return [item.pk for item in items], prev_before, next_after
+
+    def test_forward_and_back(self):
+        first, prev_before, next_after = self.page()
+        self.assertEqual(first, self.expected[:3])
+        self.assertIsNone(prev_before)
+
+        second, prev_before, next_after = self.page(after=next_after)
+        self.assertEqual(second, self.expected[3:6])
+        self.assertEqual(prev_before, self.expected[3])
+
+        last, last_prev, last_next = self.page(after=next_after)
+        self.assertEqual(last, self.expected[6:])
+        self.assertIsNone(last_next)
+
+        # Zurück von der letzten Seite landet wieder auf der zweiten, von dort auf der ersten
+        back, back_prev, back_next = self.page(before=last_prev)
+        self.assertEqual(back, second)
+        self.assertEqual(back_next, self.expected[5])
+        back_first, back_first_prev, _ = self.page(before=back_prev)
+        self.assertEqual(back_first, first)
+        self.assertIsNone(back_first_prev)
+
+    def test_invalid_or_unknown_cursor_starts_at_first_page(self):
+        import uuid
+
+        for cursor in ({'after': 'kein-uuid'}, {'before': 'kein-uuid'}, {'after': str(uuid.uuid4())}):
+            with self.subTest(**cursor):
+                items, prev_before, _ = self.page(**cursor)
+                self.assertEqual(items, self.expected[:3])
+                self.assertIsNone(prev_before)
+
+    def test_after_wins_over_before(self):
+        items, _, _ = self.page(after=self.expected[2], before=self.expected[5])
+        self.assertEqual(items, self.expected[3:6])
+
+
+class FindEmployeesByIdsTests(TestCase):
+    """find_employees_by_ids: Tenant vor Legacy (ohne Tenant) vor anderen Tenants."""
+
+    def setUp(self):
+        clear_employee_lookup_cache()
+        self.addCleanup(clear_employee_lookup_cache)
+        self.tenant = Tenant.objects.create(code='0000001', name='Eigener')
+        self.other = Tenant.objects.create(code='0000002', name='Fremder')
+
+    def employee(self, employee_id, tenant):
+        return Employee.objects.create(tenant=tenant, employee_id=employee_id, first_name='Max', last_name='Muster')
+
+    def test_priority_order(self):
+        from .tasks import find_employees_by_ids
+
+        # Tenant-Treffer schlägt Legacy und fremden Tenant, auch in späterer Schreibweise
+        self.employee('42', self.other)
+        self.employee('42', None)
+        own_42 = self.employee('1_42', self.tenant)
+        # Ohne Tenant-Treffer: Legacy vor fremdem Tenant
+        self.employee('7', self.other)
+        legacy_7 = self.employee('7', None)
+        # Nur im fremden Tenant (mit führenden Nullen)
+        other_9 = self.employee('00000009', self.other)
+        # Gleicher Rang: die erste Schreibweise gewinnt
+        own_8 = self.employee('8', self.tenant)
+        self.employee('5_8', self.tenant)
+
+        with self.assertNumQueries(1):
+            result = find_employees_by_ids(['42', '7', '9', '8', '404', '42', ''], tenant=self.tenant)
+        self.assertEqual(result, {'42': own_42, '7': legacy_7, '9': other_9, '8': own_8})
+
+    def test_without_tenant_only_legacy(self):
+        from .tasks import find_employees_by_ids
+
+        self.employee('42', self.other)
+        legacy = self.employee('43', None)
+        self.assertEqual(find_employees_by_ids(['42', '43']), {'43': legacy})
+
+    def test_mandant_code_candidate(self):
+        from .tasks import find_employees_by_ids
+
+        employee = self.employee('3_15', self.tenant)
+        self.assertEqual(find_employees_by_ids(['15'], tenant=self.tenant, mandant_code='3'), {'15': employee})
+
+
+class ClassifySageDocumentTests(SimpleTestCase):
+    """classify_sage_document (Aho-Corasick) liefert dasselbe wie die frühere Schleife."""
+
+    @staticmethod
+    def classify_loop(filename):
+        from .tasks import SAGE_DOCUMENT_TYPES
+
+        for doc_type, config in SAGE_DOCUMENT_TYPES.items():
+            for pattern in config['patterns']:
+                if pattern.lower() in filename.lower():
+                    return (doc_type, config['is_personnel'], config['category'], config['description'])
+        return ('UNBEKANNT', False, None, 'Unbekanntes Dokument')
+
+    def test_parity_with_loop(self):
+        from .tasks import SAGE_DOCUMENT_TYPES, classify_sage_document
+
+        patterns = [pattern for config in SAGE_DOCUMENT_TYPES.values() for pattern in config['patterns']]
+        filenames = ['Unbekannt.pdf', '', 'lohn.pdf']
+        filenames += [f'202601_{pattern}.pdf' for pattern in patterns]
+        filenames += [f'{pattern.upper()}_x.PDF' for pattern in patterns]
+        # Mehrere Muster in einem Namen: die Reihenfolge der Typen entscheidet, nicht die Position
+        filenames += [f'{a} {b}.pdf' for a in patterns[::3] for b in patterns[::4]]
+        for filename in filenames:
+            with self.subTest(filename=filename):
+                self.assertEqual(classify_sage_document(filename), self.classify_loop(filename))
+
+
+class ScanCookieTests(TestCase):
+    """_walk_files überspringt unveränderte Verzeichnisse anhand der ScanCookies."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.sub = os.path.join(self.root, 'A')
+        self.subsub = os.path.join(self.sub, 'B')
+        os.makedirs(self.subsub)
+        for path in (os.path.join(self.sub, 'f1.pdf'), os.path.join(self.subsub, 'f2.pdf')):
+            with open(path, 'wb') as f:
+                f.write(b'%PDF')
+
+    def scan(self, failed_dirs=()):
+        """Ein Scan wie _run_sage_scan: Cookies laden, laufen, speichern. Returns: (Dateien, gelistete Ordner)"""
+        from unittest import mock
+
+        from django.utils import timezone
+
+        from .tasks import _load_scan_cookies, _save_scan_cookies, _walk_files
+
+        listed = []
+        real_scandir = os.scandir
+
+        def scandir(path):
+            listed.append(path)
+            return real_scandir(path)
+
+        cookies, children = _load_scan_cookies()
+        dir_mtimes = {}
+        with mock.patch('dms.tasks.os.scandir', side_effect=scandir):
+            files = sorted(os.path.basename(e.path) for e in _walk_files(self.root, cookies, children, dir_mtimes))
+        _save_scan_cookies(dir_mtimes, set(failed_dirs), timezone.now())
+        return files, sorted(listed)
+
+    def touch_dir(self, path):
+        mtime_ns = os.stat(path).st_mtime_ns + 10 ** 9
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_unchanged_directories_are_not_listed(self):
+        self.assertEqual(self.scan(), (['f1.pdf', 'f2.pdf'], sorted([self.root, self.sub, self.subsub])))
+        self.assertEqual(self.scan(), ([], []))
+
+    def test_changed_subdirectory_is_listed_below_unchanged_parent(self):
+        self.scan()
+        with open(os.path.join(self.subsub, 'f3.pdf'), 'wb') as f:
+            f.write(b'%PDF')
+        self.touch_dir(self.subsub)
+        self.assertEqual(self.scan(), (['f2.pdf', 'f3.pdf'], [self.subsub]))
+        self.assertEqual(self.scan(), ([], []))
+
+    def test_failed_directory_is_listed_again(self):
+        from .models import ScanCookie
+
+        self.scan(failed_dirs={self.sub})
+        self.assertEqual(ScanCookie.objects.get(path=self.sub).mtime_ns, -1)
+        self.assertEqual(self.scan(), (['f1.pdf'], [self.sub]))
+
+    def test_removed_directory_cookie_is_deleted(self):
+        import shutil
+
+        from .models import ScanCookie
+
+        self.scan()
+        shutil.rmtree(self.subsub)
+        self.touch_dir(self.sub)
+        self.scan()
+        self.assertEqual(set(ScanCookie.objects.values_list('path', flat=True)), {self.root, self.sub})
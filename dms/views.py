@@ -1,3 +1,4 @@
+import os
 import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse, FileResponse
@@ -13,8 +14,14 @@ from .models import (
     FileCategory, DocumentVersion, AuditLog, SystemSettings, SystemLog,
     Tenant, TenantUser
 )
-from .encryption import encrypt_data, decrypt_data, calculate_sha256
-import magic
+from .encryption import read_decrypted_file, save_encrypted_file
+
+
+# Wie lange die Dashboard-Zähler gecacht werden (Sekunden)
+DASHBOARD_STATS_CACHE_SECONDS = 30
+
+# Zeilen pro Fetch bei Exporten (serverseitiger Cursor statt kompletter Ergebnismenge)
+EXPORT_CHUNK_SIZE = 2000
 
 
 def _get_user_tenants(user):
@@ -164,17 +171,33 @@ def index(request):
     recent_documents = accessible_docs.select_related('employee', 'document_type').order_by('-updated_at')[:10]
     open_tasks = Task.objects.filter(status='OPEN')[:5]
     
-    active_scans = ScanJob.objects.filter(status='RUNNING')
+    # Laufende Scans: Zwischenstand aus Redis statt aus der (nur an Phasengrenzen gespeicherten) Zeile
+    from .tasks import apply_scan_progress
+    active_scans = apply_scan_progress(list(ScanJob.objects.filter(status='RUNNING')))
     recent_scans = ScanJob.objects.exclude(status='RUNNING')[:3]
     
     # SECURITY: Statistiken nur für zugängliche Dokumente
-    stats = {
-        'total_documents': accessible_docs.count(),
-        'unassigned': accessible_docs.filter(status='UNASSIGNED').count(),
-        'review_needed': accessible_docs.filter(status='REVIEW_NEEDED').count(),
-        'open_tasks': Task.objects.filter(status='OPEN').count(),
-        'total_personnel_files': PersonnelFile.objects.count(),
-    }
+    # Alle Dokument-Zähler in einer Abfrage (bedingte Aggregation statt drei COUNTs)
+    from django.db.models import Count
+    from django.core.cache import cache
+    from .middleware import get_current_tenant
+    
+    def _dashboard_stats():
+        doc_counts = accessible_docs.aggregate(
+            total_documents=Count('id'),
+            unassigned=Count('id', filter=Q(status='UNASSIGNED')),
+            review_needed=Count('id', filter=Q(status='REVIEW_NEEDED')),
+        )
+        return {
+            **doc_counts,
+            'open_tasks': Task.objects.filter(status='OPEN').count(),
+            'total_personnel_files': PersonnelFile.objects.count(),
+        }
+    
+    # Dashboard wird häufig neu geladen - Zähler pro Benutzer und Mandant kurz cachen
+    tenant = get_current_tenant()
+    stats_key = f"dashboard_stats:{request.user.pk}:{tenant.pk if tenant else 'all'}"
+    stats = cache.get_or_set(stats_key, _dashboard_stats, DASHBOARD_STATS_CACHE_SECONDS)
     
     return render(request, 'dms/index.html', {
         'recent_documents': recent_documents,
@@ -237,9 +260,10 @@ def _check_permission(user, target_type, target_obj, required_level='VIEW'):
 def _can_access_document(user, document):
     if user.has_perm('dms.view_all_documents'):
         return True
-    if document.owner == user:
+    # Über die FK-Spalten vergleichen, ohne Owner/Mitarbeiter nachzuladen
+    if document.owner_id is not None and document.owner_id == user.pk:
         return True
-    if hasattr(user, 'employee_profile') and document.employee == user.employee_profile:
+    if document.employee_id is not None and hasattr(user, 'employee_profile') and document.employee_id == user.employee_profile.pk:
         return True
     
     if document.employee and hasattr(document.employee, 'personnel_file'):
@@ -263,16 +287,20 @@ def upload_file(request):
         return JsonResponse({'success': False, 'error': 'File too large (max 50MB)'}, status=400)
     
     allowed_extensions = {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.tiff', '.txt'}
-    file_ext = '.' + uploaded_file.name.rsplit('.', 1)[-1].lower() if '.' in uploaded_file.name else ''
+    base_name, file_ext = os.path.splitext(uploaded_file.name)
+    file_ext = file_ext.lower()
     if file_ext not in allowed_extensions:
         return JsonResponse({'success': False, 'error': 'File type not allowed'}, status=400)
     
     try:
-        content = uploaded_file.read()
-        
-        # SECURITY: Magic Bytes Validierung - prüfe tatsächlichen Dateityp
+        # SECURITY: Magic Bytes Validierung - prüfe tatsächlichen Dateityp.
+        # libmagic braucht nur den Dateianfang, nicht den kompletten Upload.
+        # Prozessweite Magic-Instanz statt die libmagic-Datenbank pro Upload neu zu laden
+        from .tasks import MIME_SNIFF_BYTES, _get_magic
+        head = uploaded_file.read(MIME_SNIFF_BYTES)
+        uploaded_file.seek(0)
         try:
-            detected_mime = magic.from_buffer(content, mime=True)
+            detected_mime = _get_magic().from_buffer(head)
         except Exception:
             detected_mime = None
         
@@ -301,25 +329,28 @@ def upload_file(request):
         
         mime_type = detected_mime or uploaded_file.content_type or 'application/octet-stream'
         
-        file_hash = calculate_sha256(content)
-        encrypted_content = encrypt_data(content)
-        
-        title = request.POST.get('title', uploaded_file.name.rsplit('.', 1)[0])
+        title = request.POST.get('title', base_name)
         
-        document = Document.objects.create(
+        document = Document(
             title=title,
             original_filename=uploaded_file.name,
             file_extension=file_ext,
             mime_type=mime_type,
-            encrypted_content=encrypted_content,
-            file_size=len(content),
             status='UNASSIGNED',
             source='WEB',
-            sha256_hash=file_hash,
             owner=request.user,
         )
+        # Hash, Größe und Verschlüsselung in einem Durchgang direkt aus dem Upload-Stream
+        # (wie api.py: encrypt_stream_to_blob in Document.file, kein Klartext-Puffer)
+        document.sha256_hash, file_size = save_encrypted_file(document.file, uploaded_file, f"{document.id}.enc")
+        document.file_size = file_size
+        try:
+            document.save()
+        except Exception:
+            document.file.delete(save=False)
+            raise
         
-        _log_audit(request, 'CREATE', document=document, details={'filename': uploaded_file.name, 'size': len(content)})
+        _log_audit(request, 'CREATE', document=document, details={'filename': uploaded_file.name, 'size': file_size})
         
         return JsonResponse({
             'success': True,
@@ -417,11 +448,13 @@ def document_list(request):
             ).values_list('document_id', flat=True)
             documents = documents.filter(id__in=filed_doc_ids)
     
-    documents = documents.select_related('employee', 'document_type', 'owner', 'tenant').order_by('-created_at')
+    documents = documents.select_related('employee', 'document_type', 'owner', 'tenant')
+    result_count = documents.count()
     
-    paginator = Paginator(documents, 25)
-    page = request.GET.get('page', 1)
-    documents = paginator.get_page(page)
+    # Keyset statt OFFSET: tiefe Seiten scannen nicht alle vorherigen Zeilen
+    documents, prev_before, next_after = _keyset_page(
+        documents, after=request.GET.get('after'), before=request.GET.get('before')
+    )
     
     from .models import DocumentType, Tenant, FileCategory
     document_types = DocumentType.objects.filter(is_active=True)
@@ -448,6 +481,9 @@ def document_list(request):
     
     return render(request, 'dms/document_list.html', {
         'documents': documents,
+        'result_count': result_count,
+        'prev_before': prev_before,
+        'next_after': next_after,
         'status_choices': Document.STATUS_CHOICES,
         'source_choices': Document.SOURCE_CHOICES,
         'document_types': document_types,
@@ -471,21 +507,19 @@ def document_detail(request, pk):
 
 @login_required
 def document_download(request, pk):
-    document = get_object_or_404(Document, pk=pk)
+    # Nur die für Berechtigung und Antwort nötigen Spalten; Datei erst nach der Prüfung lesen
+    document = get_object_or_404(Document.objects.only(*DOCUMENT_DELIVERY_FIELDS), pk=pk)
     
     if not _can_access_document(request.user, document):
         return HttpResponse('Permission denied', status=403)
     
     try:
-        decrypted_content = decrypt_data(document.encrypted_content)
+        response = _decrypted_file_response(
+            document.file, document.mime_type,
+            f'attachment; filename="{document.original_filename}"'
+        )
         
         _log_audit(request, 'DOWNLOAD', document=document)
-        
-        response = HttpResponse(
-            decrypted_content,
-            content_type=document.mime_type or 'application/octet-stream'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{document.original_filename}"'
         return response
     except Exception as e:
         return HttpResponse('Error downloading file', status=500)
@@ -493,21 +527,19 @@ def document_download(request, pk):
 
 @login_required
 def document_view(request, pk):
-    document = get_object_or_404(Document, pk=pk)
+    # Nur die für Berechtigung und Antwort nötigen Spalten; Datei erst nach der Prüfung lesen
+    document = get_object_or_404(Document.objects.only(*DOCUMENT_DELIVERY_FIELDS), pk=pk)
     
     if not _can_access_document(request.user, document):
         return HttpResponse('Permission denied', status=403)
     
     try:
-        decrypted_content = decrypt_data(document.encrypted_content)
+        response = _decrypted_file_response(
+            document.file, document.mime_type,
+            f'inline; filename="{document.original_filename}"'
+        )
         
         _log_audit(request, 'VIEW', document=document)
-        
-        response = HttpResponse(
-            decrypted_content,
-            content_type=document.mime_type or 'application/octet-stream'
-        )
-        response['Content-Disposition'] = f'inline; filename="{document.original_filename}"'
         return response
     except Exception as e:
         return HttpResponse('Error viewing file', status=500)
@@ -527,8 +559,7 @@ def document_page_thumbnail(request, pk, page_num):
         return HttpResponse('Not a PDF', status=400)
     
     try:
-        decrypted_content = decrypt_data(document.encrypted_content)
-        pdf_doc = fitz.open(stream=decrypted_content, filetype='pdf')
+        pdf_doc = fitz.open(stream=read_decrypted_file(document.file), filetype='pdf')
         
         page_idx = page_num - 1
         if page_idx < 0 or page_idx >= len(pdf_doc):
@@ -601,6 +632,8 @@ def task_list(request):
     if status:
         tasks = tasks.filter(status=status)
     
+    # Dokument und Bearbeiter per JOIN laden statt je Zeile nachzuladen
+    tasks = tasks.select_related('document', 'assigned_to')
     paginator = Paginator(tasks, 25)
     page = request.GET.get('page', 1)
     tasks = paginator.get_page(page)
@@ -632,6 +665,81 @@ def task_complete(request, pk):
     return JsonResponse({'success': True, 'message': 'Task completed'})
 
 
+def _keyset_page(queryset, after=None, before=None, per_page=25):
+    """
+    Keyset-Pagination über (created_at, id) absteigend statt LIMIT/OFFSET:
+    jede Seite kostet einen Index-Scan über per_page Zeilen, egal wie tief.
+    
+    after/before: ID des letzten bzw. ersten Eintrags der bisherigen Seite.
+    Returns: (items, prev_before, next_after) - Cursor None, wenn es keine Seite gibt
+    """
+    import uuid
+    
+    def cursor(value):
+        try:
+            pk = uuid.UUID(str(value))
+        except (TypeError, ValueError):
+            return None
+        created_at = queryset.model.all_objects.filter(pk=pk).values_list('created_at', flat=True).first()
+        return (created_at, pk) if created_at else None
+    
+    after_cursor = cursor(after) if after else None
+    before_cursor = None if after_cursor else (cursor(before) if before else None)
+    
+    if before_cursor:
+        created_at, pk = before_cursor
+        items = list(queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        ).order_by('created_at', 'id')[:per_page + 1])
+        has_more = len(items) > per_page
+        items = items[:per_page][::-1]
+        prev_before = items[0].pk if has_more else None
+        next_after = items[-1].pk if items else None
+        return items, prev_before, next_after
+    
+    if after_cursor:
+        created_at, pk = after_cursor
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    
+    items = list(queryset.order_by('-created_at', '-id')[:per_page + 1])
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    prev_before = items[0].pk if after_cursor and items else None
+    next_after = items[-1].pk if has_more else None
+    return items, prev_before, next_after
+
+
+# Spalten für Auslieferung (Download/Ansicht): Berechtigungsprüfung + Datei, ohne Metadaten/Notizen
+DOCUMENT_DELIVERY_FIELDS = ('id', 'tenant_id', 'mime_type', 'original_filename', 'owner_id', 'employee_id', 'file')
+
+
+def _decrypted_file_response(field_file, content_type, disposition):
+    """
+    Liefert eine verschlüsselte Datei (Document.file/DocumentVersion.file,
+    AES-GCM-Streamingformat wie in api.py geschrieben) als StreamingHttpResponse aus.
+    Jeder Chunk wird erst beim Senden entschlüsselt, im Speicher liegt nie mehr als
+    ein Chunk. Erst nach der Berechtigungsprüfung aufrufen.
+    """
+    from django.http import StreamingHttpResponse
+    from .encryption import iter_decrypt_stream
+    
+    if not field_file:
+        raise FileNotFoundError('Dokument hat keine Datei')
+    
+    # Vor der Antwort öffnen: fehlende Blobs führen noch zu einem Fehlerstatus
+    encrypted_file = field_file.storage.open(field_file.name, 'rb')
+    
+    def decrypted_chunks():
+        try:
+            yield from iter_decrypt_stream(encrypted_file)
+        finally:
+            encrypted_file.close()
+    
+    response = StreamingHttpResponse(decrypted_chunks(), content_type=content_type or 'application/octet-stream')
+    response['Content-Disposition'] = disposition
+    return response
+
+
 def _log_audit(request, action, document=None, personnel_file=None, details=None, old_value='', new_value=''):
     ip = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR', ''))
     if ',' in ip:
@@ -724,7 +832,7 @@ def personnel_file_detail(request, pk):
             entries_by_category[cat_code] = []
         entries_by_category[cat_code].append(entry)
     
-    all_documents = employee.documents.all().order_by('-created_at')
+    all_documents = employee.documents.order_by('-created_at')
     
     category_tabs = {
         'personal': {
@@ -949,7 +1057,10 @@ def document_version_download(request, pk, version_number):
     version = get_object_or_404(DocumentVersion, document=document, version_number=version_number)
     
     try:
-        decrypted_content = decrypt_data(version.encrypted_content)
+        response = _decrypted_file_response(
+            version.file, document.mime_type,
+            f'attachment; filename="{document.original_filename}_v{version_number}"'
+        )
         
         _log_audit(
             request, 
@@ -957,12 +1068,6 @@ def document_version_download(request, pk, version_number):
             document=document,
             details={'version': version_number}
         )
-        
-        response = HttpResponse(
-            decrypted_content,
-            content_type=document.mime_type or 'application/octet-stream'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{document.original_filename}_v{version_number}"'
         return response
     except Exception:
         return HttpResponse('Fehler beim Herunterladen', status=500)
@@ -1200,8 +1305,6 @@ def system_logs(request):
 @login_required
 def document_split(request, pk):
     """Manuelles Teilen eines PDF-Dokuments nach Seitenbereichen"""
-    import tempfile
-    from pathlib import Path
     import fitz
     
     document = get_object_or_404(Document, pk=pk)
@@ -1214,8 +1317,9 @@ def document_split(request, pk):
         return redirect('dms:document_detail', pk=pk)
     
     try:
-        decrypted_content = decrypt_data(document.encrypted_content)
-        pdf_doc = fitz.open(stream=decrypted_content, filetype='pdf')
+        # Einmal entschlüsseln: Seitenzahl und Split (POST) nutzen denselben Klartext
+        pdf_content = read_decrypted_file(document.file)
+        pdf_doc = fitz.open(stream=pdf_content, filetype='pdf')
         page_count = len(pdf_doc)
         pdf_doc.close()
     except Exception as e:
@@ -1238,11 +1342,9 @@ def document_split(request, pk):
                 messages.error(request, 'Keine Split-Bereiche angegeben.')
                 return redirect('dms:document_split', pk=pk)
             
-            from .encryption import encrypt_data as enc_data, calculate_sha256_chunked
             from .tasks import auto_classify_document, log_system_event, parse_month_folder
             
-            decrypted_content = decrypt_data(document.encrypted_content)
-            pdf_doc = fitz.open(stream=decrypted_content, filetype='pdf')
+            pdf_doc = fitz.open(stream=pdf_content, filetype='pdf')
             
             created_docs = []
             
@@ -1257,17 +1359,9 @@ def document_split(request, pk):
                 new_pdf = fitz.open()
                 new_pdf.insert_pdf(pdf_doc, from_page=start_page, to_page=end_page - 1)
                 
-                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-                    new_pdf.save(tmp.name)
-                    new_pdf.close()
-                    
-                    with open(tmp.name, 'rb') as f:
-                        split_content = f.read()
-                    
-                    split_encrypted = enc_data(split_content)
-                    split_hash = calculate_sha256_chunked(tmp.name)
-                    
-                    Path(tmp.name).unlink()
+                # Direkt im Speicher serialisieren statt Temp-Datei schreiben und zweimal lesen
+                split_content = new_pdf.tobytes()
+                new_pdf.close()
                 
                 split_employee = None
                 if employee_id:
@@ -1285,22 +1379,23 @@ def document_split(request, pk):
                 split_filename = f"{document.title}{emp_suffix}.pdf"
                 
                 period_year, period_month = parse_month_folder(month_folder)
-                split_doc = Document.objects.create(
+                split_doc = Document(
                     tenant=document.tenant,
                     title=f"{document.title} (S.{start_page + 1}-{end_page})",
                     original_filename=split_filename,
                     file_extension='.pdf',
                     mime_type='application/pdf',
-                    encrypted_content=split_encrypted,
-                    file_size=len(split_content),
                     employee=split_employee,
                     status='ASSIGNED' if split_employee else 'REVIEW_NEEDED',
                     source=document.source,
-                    sha256_hash=split_hash,
                     metadata=metadata,
                     period_year=period_year,
                     period_month=period_month
                 )
+                split_doc.sha256_hash, split_doc.file_size = save_encrypted_file(
+                    split_doc.file, split_content, f"{split_doc.id}.enc"
+                )
+                split_doc.save()
                 
                 auto_classify_document(split_doc, tenant=document.tenant)
                 created_docs.append(split_doc)
@@ -1375,7 +1470,8 @@ def admin_maintenance(request):
         'last_scan': last_scan,
     }
     
-    recent_scanjobs = ScanJob.objects.order_by('-started_at')[:10]
+    from .tasks import apply_scan_progress
+    recent_scanjobs = apply_scan_progress(list(ScanJob.objects.order_by('-started_at')[:10]))
     
     return render(request, 'dms/admin_maintenance.html', {
         'stats': stats,
@@ -1823,8 +1919,10 @@ def gdpr_export(request):
     # Audit Logs sammeln
     logs = []
     if target_user:
-        user_logs = AuditLog.objects.filter(user=target_user).order_by('-timestamp')
-        for log in user_logs:
+        user_logs = AuditLog.objects.filter(user=target_user).order_by('-timestamp').only(
+            'timestamp', 'action', 'ip_address', 'details'
+        )
+        for log in user_logs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
             logs.append({
                 'timestamp': log.timestamp,
                 'action': log.action,
@@ -1837,8 +1935,11 @@ def gdpr_export(request):
     # Dokumente (Metadaten)
     docs = []
     if target_employee:
-        employee_docs = Document.objects.filter(employee=target_employee)
-        for doc in employee_docs:
+        # Nur die exportierten Metadaten laden
+        employee_docs = Document.objects.filter(employee=target_employee).select_related('document_type').only(
+            'title', 'original_filename', 'created_at', 'document_type'
+        )
+        for doc in employee_docs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
             docs.append({
                 'title': doc.title,
                 'filename': doc.original_filename,
@@ -1847,8 +1948,8 @@ def gdpr_export(request):
             })
     
     if target_user:
-        owned_docs = Document.objects.filter(owner=target_user)
-        for doc in owned_docs:
+        owned_docs = Document.objects.filter(owner=target_user).only('title', 'original_filename', 'created_at')
+        for doc in owned_docs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
             docs.append({
                 'title': doc.title,
                 'filename': doc.original_filename,
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown, task_postrun
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dms_project.settings')
 
@@ -11,3 +12,43 @@ app.autodiscover_tasks()
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
+
+
+@worker_process_init.connect
+def reset_ocr_engine(**kwargs):
+    """Tesseract-Handle nach dem Fork im Worker-Prozess neu aufbauen."""
+    from dms.ocr import reset_tess_api
+    reset_tess_api()
+
+
+@worker_process_init.connect
+def reset_redis_pool(**kwargs):
+    """Redis-Connection-Pool nach dem Fork im Worker-Prozess neu aufbauen."""
+    from dms.tasks import reset_redis_pool as _reset
+    _reset()
+
+
+@worker_process_init.connect
+def start_process_pool(**kwargs):
+    """billiard-Pool für OCR/DataMatrix-Scans einmal pro Worker-Prozess starten."""
+    from dms.process_pool import init_process_pool
+    init_process_pool()
+
+
+@worker_process_shutdown.connect
+def stop_process_pool(**kwargs):
+    from dms.process_pool import shutdown_process_pool
+    shutdown_process_pool()
+
+
+@task_postrun.connect
+def flush_system_logs_after_task(**kwargs):
+    """Gepufferte SystemLog-Einträge schreiben und Task-lokale Caches leeren."""
+    from dms.tasks import (
+        flush_system_logs, clear_employee_lookup_cache, clear_document_type_cache,
+        clear_file_category_cache,
+    )
+    flush_system_logs()
+    clear_employee_lookup_cache()
+    clear_document_type_cache()
+    clear_file_category_cache()
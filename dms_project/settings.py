@@ -266,6 +266,12 @@ if _use_azure_db:
             'PORT': os.environ.get('DB_PORT', '5432'),
             'OPTIONS': {
                 'sslmode': 'require',
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '10')),
+                # TCP-Keepalives: idle persistente Verbindungen nicht vom Azure-Gateway kappen lassen
+                'keepalives': 1,
+                'keepalives_idle': 30,
+                'keepalives_interval': 10,
+                'keepalives_count': 5,
             },
         }
     }
@@ -274,6 +280,12 @@ else:
         'default': dj_database_url.config(default=_database_url)
     }
 
+# Persistente DB-Verbindungen: kein neuer TLS-Handshake (Azure Postgres) pro Request/Task-Thread
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+# Hinter PgBouncer im Transaction-Pooling gibt es keine serverseitigen Cursor (iterator())
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = os.environ.get('DB_PGBOUNCER', 'False').lower() == 'true'
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -331,6 +343,24 @@ else:
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Gemeinsamer Cache für Web und Celery-Worker (Dashboard-Zahlen, OCR-Ergebnisse).
+# Ohne REDIS_URL (Entwicklung ohne Docker) bleibt es beim prozesslokalen LocMemCache:
+# dann teilt kein Prozess seine Einträge mit anderen.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_REDIS_URL', os.environ['REDIS_URL']),
+            'KEY_PREFIX': 'dms',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
@@ -338,6 +368,8 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Kleiner Prefetch-Puffer: freie Worker holen sich neue Subtasks (z.B. Sage-Blobs) schnell nach
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', '2'))
 
 AZURE_INGEST_CLIENT_ID = os.environ.get('AZURE_INGEST_CLIENT_ID')
 AZURE_INGEST_CLIENT_SECRET = os.environ.get('AZURE_INGEST_CLIENT_SECRET')
@@ -345,11 +377,21 @@ AZURE_INGEST_TENANT_ID = os.environ.get('AZURE_INGEST_TENANT_ID')
 AZURE_INGEST_MAILBOX = os.environ.get('AZURE_INGEST_MAILBOX', 'ingest@dms.cloud')
 
 SAGE_ARCHIVE_PATH = os.environ.get('SAGE_ARCHIVE_PATH', str(BASE_DIR / 'data' / 'sage_archive'))
+# Unveränderte Archivordner (gleiche mtime wie beim letzten Scan) nicht erneut auflisten.
+# False erzwingt einen vollständigen Verzeichnis-Scan.
+SAGE_SCAN_DIR_COOKIES = os.environ.get('SAGE_SCAN_DIR_COOKIES', 'True').lower() == 'true'
 # MANUAL_INPUT_PATH removed - SaaS uses API ingest instead of local file scanning
 EMAIL_ARCHIVE_PATH = os.environ.get('EMAIL_ARCHIVE_PATH', str(BASE_DIR / 'data' / 'email_archive'))
 
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', None)
 
+# Max. parallele Tesseract-Prozesse pro Celery-Worker (0 = alle CPU-Kerne)
+OCR_PARALLELISM = int(os.environ.get('OCR_PARALLELISM', '2'))
+# Max. parallele DataMatrix-Scans von Sammel-PDFs: Prozesse im Worker-Pool, außerhalb
+# eines Workers Threads im Task (1 = sequentiell). Der Pool ist so groß wie der größere
+# der beiden Werte, jede Aufgabenart belegt aber nur ihre eigene Obergrenze.
+PDF_SPLIT_PARALLELISM = int(os.environ.get('PDF_SPLIT_PARALLELISM', '2'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -9,26 +9,20 @@ Admin-Interface konfiguriert - keine manuelle .env-Bearbeitung nötig!
 import os
 import sys
 import secrets
-import string
 from pathlib import Path
 
 def generate_secret_key(length=50):
     """Generiert einen sicheren Django Secret Key."""
-    chars = string.ascii_letters + string.digits + '!@#$%^&*(-_=+)'
-    return ''.join(secrets.choice(chars) for _ in range(length))
+    return secrets.token_urlsafe(length)[:length]
 
 def generate_fernet_key():
     """Generiert einen Fernet-Verschlüsselungsschlüssel."""
     from cryptography.fernet import Fernet
     return Fernet.generate_key().decode()
 
-def generate_password(length=16, url_safe=False):
-    """Generiert ein sicheres Passwort."""
-    if url_safe:
-        chars = string.ascii_letters + string.digits
-    else:
-        chars = string.ascii_letters + string.digits + '!@#$%^&*()'
-    return ''.join(secrets.choice(chars) for _ in range(length))
+def generate_password(length=16):
+    """Generiert ein sicheres Passwort (URL-sicher: Buchstaben, Ziffern, '-' und '_')."""
+    return secrets.token_urlsafe(length)[:length]
 
 def create_env_file():
     """Erstellt die minimale .env Datei - nur technische Grundkonfiguration."""
@@ -43,7 +37,7 @@ def create_env_file():
     
     django_secret = generate_secret_key()
     encryption_key = generate_fernet_key()
-    db_password = generate_password(20, url_safe=True)
+    db_password = generate_password(20)
     
     env_content = f"""# DMS Konfiguration - Automatisch generiert
 # Technische Grundkonfiguration - NICHT MANUELL BEARBEITEN